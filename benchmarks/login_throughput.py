@@ -0,0 +1,85 @@
+"""
+Benchmark of concurrent password verifications, the CPU-bound part of a login.
+
+The script verifies the same password from many concurrent coroutines, once inline on the event loop,
+the way the login route used to, and once on the password pool of auth_service. A heartbeat coroutine
+measures how late the event loop wakes it up, which is the delay every other request of the worker sees.
+
+    python -m benchmarks.login_throughput --logins 64 --concurrency 1 8 32
+
+The work factor and the size of the pool come from the settings, BCRYPT_ROUNDS and PASSWORD_WORKERS.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+
+HEARTBEAT = 0.01
+
+
+async def heartbeat(lags: list[float]):
+    """
+    The heartbeat function sleeps in a loop and records how much later than asked the event loop woke it up.
+
+    :param lags: list[float]: The list the delays in seconds are appended to
+    :return: None
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT)
+        lags.append(time.perf_counter() - started - HEARTBEAT)
+
+
+async def run(password_hash: str, logins: int, concurrency: int, inline: bool) -> tuple[float, float, float]:
+    """
+    The run function verifies the password logins times with at most concurrency verifications in flight.
+
+    :param password_hash: str: The hash of the password "secret"
+    :param logins: int: The number of verifications
+    :param concurrency: int: How many verifications run at the same time
+    :param inline: bool: Whether bcrypt runs on the event loop instead of the password pool
+    :return: The logins per second, and the median and maximum delay of the event loop in seconds
+    :rtype: tuple[float, float, float]
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with slots:
+            if inline:
+                auth_service.pwd_context.verify("secret", password_hash)
+            else:
+                await auth_service.verify_password("secret", password_hash)
+
+    lags = []
+    beating = asyncio.ensure_future(heartbeat(lags))
+    await asyncio.sleep(HEARTBEAT * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    # Let the heartbeat record the wake-up that inline verifications held back
+    await asyncio.sleep(HEARTBEAT)
+    beating.cancel()
+    return logins / elapsed, statistics.median(lags), max(lags)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64, help="verifications per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="verifications in flight")
+    args = parser.parse_args()
+
+    password_hash = await auth_service.get_password_hash("secret")
+    print(f"bcrypt rounds {settings.bcrypt_rounds}, password workers {settings.password_workers}")
+    print(f"{'mode':8} {'concurrency':>11} {'logins/s':>10} {'loop lag p50 ms':>16} {'loop lag max ms':>16}")
+    for concurrency in args.concurrency:
+        for mode in ("inline", "pool"):
+            throughput, lag, worst = await run(password_hash, args.logins, concurrency, mode == "inline")
+            print(f"{mode:8} {concurrency:>11} {throughput:>10.1f} {lag * 1000:>16.1f} {worst * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Microbenchmark of the per-request cost of checking an access token.
+
+The script times the token check of get_current_user for a client that sends the same token again and again:
+once with a full jwt.decode on every request, the way it used to be, and once through auth_service.decode_token,
+where every request after the first is answered from the cache of verified tokens.
+
+    python -m benchmarks.token_decode --requests 100000
+"""
+
+import argparse
+import asyncio
+import time
+
+from jose import jwt
+
+from src.services.auth import auth_service, token_cache
+
+
+def check_uncached(token: str) -> str:
+    """
+    The check_uncached function verifies the token and its scope with a full decode.
+
+    :param token: str: The access token
+    :return: The email of the user
+    :rtype: str
+    """
+    payload = jwt.decode(token, auth_service.SECRET_KEY, algorithms=[auth_service.ALGORITHM])
+    assert payload["scope"] == "access_token"
+    return payload["sub"]
+
+
+def check_cached(token: str) -> str:
+    """
+    The check_cached function verifies the token and its scope through the cache of verified tokens.
+
+    :param token: str: The access token
+    :return: The email of the user
+    :rtype: str
+    """
+    payload = auth_service.decode_token(token)
+    assert payload["scope"] == "access_token"
+    return payload["sub"]
+
+
+def measure(check, token: str, requests: int) -> float:
+    """
+    The measure function runs a token check requests times.
+
+    :param check: The function that checks the token
+    :param token: str: The access token
+    :param requests: int: How many times the token is checked
+    :return: The average duration of a check in microseconds
+    :rtype: float
+    """
+    started = time.perf_counter()
+    for _ in range(requests):
+        check(token)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100000, help="token checks per run")
+    args = parser.parse_args()
+
+    token = asyncio.run(auth_service.create_access_token(data={"sub": "ghost@example.com"}))
+    uncached = measure(check_uncached, token, args.requests)
+    token_cache.clear()
+    cached = measure(check_cached, token, args.requests)
+    print(f"{'mode':10} {'us/request':>11}")
+    print(f"{'decode':10} {uncached:>11.2f}")
+    print(f"{'cached':10} {cached:>11.2f}")
+    print(f"speedup {uncached / cached:.1f}x, cache {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark of the substring search of image descriptions with and without the trigram index.
+
+The script seeds a scratch table shaped like images.description on PostgreSQL, builds the same
+GIN trigram index as the migration and times the ILIKE query of find.get_photo_by_key_words
+with the index and with index scans disabled. The scratch table is dropped at the end.
+
+    python -m benchmarks.trigram_search --rows 1000000
+
+The database is the one from the settings unless --url is given, it must be PostgreSQL with pg_trgm available.
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+
+from src.conf.config import settings
+from src.repository.find import like_pattern
+
+TABLE = "bench_image_descriptions"
+WORDS = ["sunny", "beach", "mountain", "lake", "forest", "city", "night", "river", "snow", "desert", "sunset",
+         "portrait", "street", "bridge", "garden", "ocean", "cloud", "storm", "autumn", "spring", "market", "train"]
+PATTERNS = ["sunset", "ain lak", "bridge", "autumn stor", "ocean", "zzz", "rket tr", "spring garden"]
+
+
+def seed(connection, rows: int):
+    """
+    The seed function creates the scratch table and fills it with rows descriptions of six random words
+    and a number, then builds the trigram index.
+
+    :param connection: The connection to the benchmark database
+    :param rows: int: The number of descriptions
+    :return: None
+    """
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    connection.execute(text(f"CREATE TABLE {TABLE} (id serial PRIMARY KEY, description varchar(500))"))
+    connection.execute(text(f"""
+        INSERT INTO {TABLE} (description)
+        SELECT (SELECT string_agg(words[1 + floor(random() * array_length(words, 1))::int], ' ')
+                FROM generate_series(1, 6) WHERE n > 0) || ' ' || n
+        FROM generate_series(1, :rows) AS n, (SELECT CAST(:words AS text[]) AS words) AS vocabulary
+    """), {"rows": rows, "words": WORDS})
+    connection.execute(text(f"CREATE INDEX ix_{TABLE}_trgm ON {TABLE} USING gin (description gin_trgm_ops)"))
+    connection.execute(text(f"ANALYZE {TABLE}"))
+
+
+def run(connection, pattern: str, repeat: int) -> tuple[float, int]:
+    """
+    The run function times the substring search for one pattern.
+
+    :param connection: The connection to the benchmark database
+    :param pattern: str: The words typed by the user
+    :param repeat: int: How many times the query runs
+    :return: The median duration in seconds and the number of matching rows
+    :rtype: tuple[float, int]
+    """
+    query = text(f"SELECT id FROM {TABLE} WHERE description ILIKE :pattern ESCAPE '\\'")
+    durations, found = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = len(connection.execute(query, {"pattern": like_pattern(pattern)}).all())
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations), found
+
+
+def plan(connection, pattern: str) -> str:
+    """
+    The plan function returns the top node of the executed plan of the substring search.
+
+    :param connection: The connection to the benchmark database
+    :param pattern: str: The words typed by the user
+    :return: The first line of EXPLAIN ANALYZE
+    :rtype: str
+    """
+    query = text(f"EXPLAIN ANALYZE SELECT id FROM {TABLE} WHERE description ILIKE :pattern ESCAPE '\\'")
+    return connection.execute(query, {"pattern": like_pattern(pattern)}).scalars().first()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=settings.sqlalchemy_database_url)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table for another run")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the scratch table of a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if engine.dialect.name != "postgresql":
+        parser.error("the trigram index exists only on PostgreSQL")
+    with engine.connect() as connection:
+        if not args.no_seed:
+            started = time.perf_counter()
+            with connection.begin():
+                seed(connection, args.rows)
+            print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'pattern':<16}{'rows':>8}{'seq scan ms':>14}{'trigram ms':>14}{'speedup':>10}")
+        speedups = []
+        for pattern in PATTERNS:
+            with connection.begin():
+                connection.execute(text("SET LOCAL enable_bitmapscan = off"))
+                connection.execute(text("SET LOCAL enable_indexscan = off"))
+                without_index, found = run(connection, pattern, args.repeat)
+            with connection.begin():
+                with_index, _ = run(connection, pattern, args.repeat)
+                node = plan(connection, pattern)
+            speedups.append(without_index / with_index)
+            print(f"{pattern:<16}{found:>8}{without_index * 1000:>14.1f}{with_index * 1000:>14.1f}"
+                  f"{speedups[-1]:>9.1f}x  {node.split('  (')[0]}")
+        print(f"median speedup {statistics.median(speedups):.1f}x")
+
+        if not args.keep:
+            with connection.begin():
+                connection.execute(text(f"DROP TABLE {TABLE}"))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,49 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 
-from src.routes import auth, users, comments, tags, images, access, transform_photo, find, ratings, message
+from src.routes import auth, users, comments, tags, images, access, transform_photo, find, ratings, message, metrics
 
 from src.conf.config import settings
+from src.database.db import recent_writes, request_writes, LAST_WRITE_COOKIE, SessionLocal
+from src.repository.tokens import load_revoked_tokens
+from src.services.auth import auth_service
+from src.services.executors import cloudinary_executor, password_executor
+from src.services.sweeper import refresh_token_sweeper, revoked_tokens_sweeper
+from src.services.upload_jobs import upload_jobs
 
 app = FastAPI()
 
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    """
+    The track_writes middleware remembers the clients that have just written to the primary database,
+    so that get_read_db keeps their next reads off the replicas for the read-your-writes window.
+    Only requests that committed a write count, a login or a rejected form does not pin a browser to the primary.
+
+    :param request: Request: The incoming request
+    :param call_next: The next handler of the application
+    :return: The response of the route
+    """
+    request.state.writer = auth_service.get_token_subject(request.headers.get("Authorization"))
+    writes = {"wrote": False}
+    token = request_writes.set(writes)
+    try:
+        response = await call_next(request)
+    finally:
+        request_writes.reset(token)
+    if request.method not in SAFE_METHODS and response.status_code < 400 and writes["wrote"]:
+        if request.state.writer:
+            recent_writes.record(request.state.writer)
+        response.set_cookie(LAST_WRITE_COOKIE, str(time.time()), max_age=int(recent_writes.window) + 1,
+                            httponly=True, samesite="lax")
+    return response
+
 app.include_router(auth.router, prefix='/api')
 app.include_router(images.router, prefix='/api')
 app.include_router(ratings.router, prefix='/api')
@@ -18,6 +54,56 @@ app.include_router(comments.router, prefix='/api')
 app.include_router(access.router, prefix='/api')
 app.include_router(tags.router, prefix='/api')
 app.include_router(find.router, prefix='/api')
+app.include_router(metrics.router, prefix='/api')
+
+
+@app.on_event("startup")
+async def start_upload_workers():
+    """
+    The start_upload_workers function starts the workers of the upload job queue.
+
+    :return: None
+    """
+    upload_jobs.start()
+
+
+@app.on_event("startup")
+async def start_sweepers():
+    """
+    The start_sweepers function starts the periodic sweep of expired refresh token sessions
+    and the periodic reload of the revoked tokens.
+
+    :return: None
+    """
+    refresh_token_sweeper.start()
+    revoked_tokens_sweeper.start()
+
+
+@app.on_event("startup")
+async def load_revocations():
+    """
+    The load_revocations function sweeps the revocations of expired tokens
+    and loads the others into the revocation filter of this worker.
+
+    :return: None
+    """
+    async with SessionLocal() as db:
+        await load_revoked_tokens(db)
+
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    """
+    The shutdown_executors function stops the upload workers and the sweeps, and lets the running Cloudinary
+    and password calls finish before the worker exits.
+
+    :return: None
+    """
+    await upload_jobs.stop()
+    await refresh_token_sweeper.stop()
+    await revoked_tokens_sweeper.stop()
+    cloudinary_executor.shutdown()
+    password_executor.shutdown()
 
 
 @app.get("/", tags=["Root"])
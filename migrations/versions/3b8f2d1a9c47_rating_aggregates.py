@@ -0,0 +1,41 @@
+"""Rating aggregates on images
+
+Revision ID: 3b8f2d1a9c47
+Revises: c71886e47620
+Create Date: 2026-10-17 10:12:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f2d1a9c47'
+down_revision = 'c71886e47620'
+branch_labels = None
+depends_on = None
+
+HISTOGRAM_COLUMNS = ['one_star_count', 'two_stars_count', 'three_stars_count', 'four_stars_count', 'five_stars_count']
+STARS = ("CASE WHEN r.one_star THEN 1 WHEN r.two_stars THEN 2 WHEN r.three_stars THEN 3 "
+         "WHEN r.four_stars THEN 4 WHEN r.five_stars THEN 5 ELSE 0 END")
+
+
+def upgrade() -> None:
+    for column in ['rating_sum', 'rating_count'] + HISTOGRAM_COLUMNS:
+        op.add_column('images', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the aggregates from the existing ratings
+    histogram = ",\n".join(
+        f"{column} = (SELECT count(*) FROM ratings r WHERE r.image_id = images.id AND {STARS} = {stars})"
+        for stars, column in enumerate(HISTOGRAM_COLUMNS, start=1))
+    op.execute(f"""
+        UPDATE images SET
+        rating_sum = (SELECT coalesce(sum({STARS}), 0) FROM ratings r WHERE r.image_id = images.id),
+        rating_count = (SELECT count(*) FROM ratings r WHERE r.image_id = images.id),
+        {histogram}
+    """)
+
+
+def downgrade() -> None:
+    for column in reversed(['rating_sum', 'rating_count'] + HISTOGRAM_COLUMNS):
+        op.drop_column('images', column)
@@ -0,0 +1,31 @@
+"""Usage count on tags
+
+Revision ID: 5c2e9a7d4b18
+Revises: 8e41c5d0b7f2
+Create Date: 2026-10-17 15:05:47.203318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e9a7d4b18'
+down_revision = '8e41c5d0b7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('tags', sa.Column('usage_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counts from the existing associations
+    op.execute("""
+        UPDATE tags SET usage_count = (SELECT count(*) FROM image_m2m_tag m WHERE m.tag_id = tags.id)
+    """)
+    op.create_index('ix_tags_usage_count_id', 'tags', ['usage_count', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tags_usage_count_id', table_name='tags')
+    op.drop_column('tags', 'usage_count')
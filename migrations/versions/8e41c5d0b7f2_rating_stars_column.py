@@ -0,0 +1,56 @@
+"""Single stars column for ratings
+
+Revision ID: 8e41c5d0b7f2
+Revises: 3b8f2d1a9c47
+Create Date: 2026-10-17 11:40:02.853114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41c5d0b7f2'
+down_revision = '3b8f2d1a9c47'
+branch_labels = None
+depends_on = None
+
+STAR_COLUMNS = ['one_star', 'two_stars', 'three_stars', 'four_stars', 'five_stars']
+HISTOGRAM_COLUMNS = ['one_star_count', 'two_stars_count', 'three_stars_count', 'four_stars_count', 'five_stars_count']
+
+
+def upgrade() -> None:
+    op.add_column('ratings', sa.Column('stars', sa.SmallInteger(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE ratings SET stars = CASE WHEN one_star THEN 1 WHEN two_stars THEN 2 WHEN three_stars THEN 3
+                                        WHEN four_stars THEN 4 WHEN five_stars THEN 5 ELSE 0 END
+    """)
+
+    # Keep the oldest rating of every user for an image, so the unique constraint can be created
+    op.execute("""
+        DELETE FROM ratings WHERE id NOT IN (SELECT min(id) FROM ratings GROUP BY user_id, image_id)
+    """)
+    histogram = ",\n".join(
+        f"{column} = (SELECT count(*) FROM ratings r WHERE r.image_id = images.id AND r.stars = {stars})"
+        for stars, column in enumerate(HISTOGRAM_COLUMNS, start=1))
+    op.execute(f"""
+        UPDATE images SET
+        rating_sum = (SELECT coalesce(sum(r.stars), 0) FROM ratings r WHERE r.image_id = images.id),
+        rating_count = (SELECT count(*) FROM ratings r WHERE r.image_id = images.id),
+        {histogram}
+    """)
+
+    op.create_unique_constraint('uq_ratings_user_image', 'ratings', ['user_id', 'image_id'])
+    op.create_check_constraint('ck_ratings_stars', 'ratings', 'stars BETWEEN 0 AND 5')
+    for column in STAR_COLUMNS:
+        op.drop_column('ratings', column)
+
+
+def downgrade() -> None:
+    for column in STAR_COLUMNS:
+        op.add_column('ratings', sa.Column(column, sa.Boolean(), nullable=True))
+    flags = ", ".join(f"{column} = (stars = {stars})" for stars, column in enumerate(STAR_COLUMNS, start=1))
+    op.execute(f"UPDATE ratings SET {flags}")
+    op.drop_constraint('ck_ratings_stars', 'ratings', type_='check')
+    op.drop_constraint('uq_ratings_user_image', 'ratings', type_='unique')
+    op.drop_column('ratings', 'stars')
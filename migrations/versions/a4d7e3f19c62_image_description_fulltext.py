@@ -0,0 +1,51 @@
+"""Full-text index on image descriptions
+
+Revision ID: a4d7e3f19c62
+Revises: 5c2e9a7d4b18
+Create Date: 2026-10-17 16:21:09.574120
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e3f19c62'
+down_revision = '5c2e9a7d4b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # The generated column is filled for the existing rows when it is added
+        op.execute("""
+            ALTER TABLE images ADD COLUMN description_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(description, ''))) STORED
+        """)
+        op.execute("CREATE INDEX ix_images_description_tsv ON images USING gin (description_tsv)")
+    elif op.get_bind().dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE images_fts USING fts5(description, content='images', content_rowid='id')")
+        op.execute("""
+            CREATE TRIGGER images_fts_ai AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts(rowid, description) VALUES (new.id, new.description); END
+        """)
+        op.execute("""
+            CREATE TRIGGER images_fts_ad AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts(images_fts, rowid, description) VALUES ('delete', old.id, old.description); END
+        """)
+        op.execute("""
+            CREATE TRIGGER images_fts_au AFTER UPDATE OF description ON images BEGIN
+            INSERT INTO images_fts(images_fts, rowid, description) VALUES ('delete', old.id, old.description);
+            INSERT INTO images_fts(rowid, description) VALUES (new.id, new.description); END
+        """)
+        op.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_images_description_tsv")
+        op.execute("ALTER TABLE images DROP COLUMN description_tsv")
+    elif op.get_bind().dialect.name == 'sqlite':
+        for trigger in ['images_fts_au', 'images_fts_ad', 'images_fts_ai']:
+            op.execute(f"DROP TRIGGER {trigger}")
+        op.execute("DROP TABLE images_fts")
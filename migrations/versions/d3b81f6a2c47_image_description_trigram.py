@@ -0,0 +1,27 @@
+"""Trigram index on image descriptions
+
+Revision ID: d3b81f6a2c47
+Revises: a4d7e3f19c62
+Create Date: 2026-10-17 17:02:41.318605
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b81f6a2c47'
+down_revision = 'a4d7e3f19c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Substring search uses ILIKE '%words%', which only a trigram index can serve, SQLite has nothing comparable
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_images_description_trgm ON images USING gin (description gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_images_description_trgm")
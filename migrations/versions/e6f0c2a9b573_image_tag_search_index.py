@@ -0,0 +1,23 @@
+"""Composite tag search index on image_m2m_tag
+
+Revision ID: e6f0c2a9b573
+Revises: d3b81f6a2c47
+Create Date: 2026-10-17 18:12:27.904153
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f0c2a9b573'
+down_revision = 'd3b81f6a2c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_image_m2m_tag_tag_id_image_id', 'image_m2m_tag', ['tag_id', 'image_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_image_m2m_tag_tag_id_image_id', table_name='image_m2m_tag')
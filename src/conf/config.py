@@ -1,12 +1,31 @@
 #from pydantic_settings import BaseSettings
+import os
+
 from pydantic import BaseSettings
 
 
 
 class Settings(BaseSettings):
     sqlalchemy_database_url: str
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    sqlalchemy_replica_urls: str = ""
+    read_your_writes_seconds: float = 5
     secret_key: str
     algorithm: str
+    bcrypt_rounds: int = 12
+    password_workers: int = os.cpu_count() or 1
+    password_queue_size: int = 64
+    password_queue_timeout: float = 10
+    token_cache_size: int = 10000
+    revoked_filter_capacity: int = 100000
+    revoked_filter_error_rate: float = 0.001
+    revoked_tokens_reload_interval: float = 30
+    refresh_token_sweep_interval: float = 3600
+    refresh_token_sweep_batch_size: int = 1000
     mail_username: str
     mail_password: str
     mail_from: str
@@ -16,6 +35,20 @@ class Settings(BaseSettings):
     cloudinary_name: str
     cloudinary_api_key: str
     cloudinary_api_secret: str
+    cloudinary_workers: int = 4
+    cloudinary_queue_size: int = 16
+    cloudinary_queue_timeout: float = 10
+    upload_workers: int = 2
+    upload_queue_size: int = 100
+    upload_job_ttl: float = 3600
+    upload_spool_max_size: int = 1024 * 1024
+    tag_cache_size: int = 10000
+    tag_cache_ttl: float = 300
+    tag_suggest_ttl: float = 600
+    search_cache_max_ids: int = 200000
+    search_cache_ttl: float = 300
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 60
 
 
     class Config:
@@ -1,18 +1,253 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import itertools
+import time
+from contextvars import ContextVar
+
+from fastapi import Depends, Request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from src.conf.config import settings
+from src.services.metrics import metrics
+
+# The sync URL from the settings is kept for Alembic, the application talks to the database through an async driver
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    The get_async_database_url function swaps the driver of a database URL for its asyncio counterpart,
+    e.g. postgresql+psycopg2://... becomes postgresql+asyncpg://... and sqlite:///... becomes sqlite+aiosqlite:///...
+
+    :param url: str: The database URL from the settings
+    :return: The same URL with an async driver
+    :rtype: str
+    """
+    database_url = make_url(url)
+    backend = database_url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        database_url = database_url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return database_url.render_as_string(hide_password=False)
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+
+    def connect(self):
+        """
+        The connect function checks a connection out of the pool and records how long the checkout waited,
+        whether it had to open an overflow connection and whether it timed out.
+
+        :param self: Represent the instance of the class
+        :return: A pooled connection
+        """
+        overflow = self.overflow()
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            metrics.inc("db_pool_checkout_timeouts_total")
+            raise
+        finally:
+            metrics.observe("db_pool_checkout_seconds", time.perf_counter() - started)
+        if self.overflow() > max(overflow, 0):
+            metrics.inc("db_pool_overflow_connections_total")
+        return connection
+
+
+def get_engine_options(url: str) -> dict:
+    """
+    The get_engine_options function returns the pool arguments of the engine from the settings.
+    SQLite keeps the pool SQLAlchemy picks for it, a file database has nothing to gain from a sized pool.
+
+    :param url: str: The database URL from the settings
+    :return: Keyword arguments for create_async_engine
+    :rtype: dict
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def register_pool_gauges(pool, prefix: str = "db_pool"):
+    """
+    The register_pool_gauges function exports the state of a queue pool as gauges of the metrics registry.
+
+    :param pool: The pool of an engine, pools without a queue are skipped
+    :param prefix: str: The prefix of the gauge names
+    :return: None
+    """
+    if not hasattr(pool, "checkedout"):
+        return
+    metrics.register_gauge(f"{prefix}_size", pool.size)
+    metrics.register_gauge(f"{prefix}_checked_out", pool.checkedout)
+    metrics.register_gauge(f"{prefix}_checked_in", pool.checkedin)
+    metrics.register_gauge(f"{prefix}_overflow", lambda: max(pool.overflow(), 0))
+
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL),
+                             **get_engine_options(SQLALCHEMY_DATABASE_URL))
+register_pool_gauges(engine.pool)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Set by the write tracking middleware for every request, commits that wrote to the primary mark it
+request_writes: ContextVar[dict | None] = ContextVar("request_writes", default=None)
 
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+class PrimarySession(Session):
+    """Session of the primary database, it tells the request it serves whether a commit wrote something"""
+
+
+@event.listens_for(PrimarySession, "after_flush")
+def flushed(session: Session, flush_context):
+    session.info["pending_write"] = True
+
+
+@event.listens_for(PrimarySession, "do_orm_execute")
+def executed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["pending_write"] = True
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def committed(session: Session):
+    """
+    The committed function marks the current request as a writer when the committed transaction wrote.
+
+    :param session: Session: The committed session
+    :return: None
+    """
+    writes = request_writes.get()
+    if session.info.pop("pending_write", False) and writes is not None:
+        writes["wrote"] = True
+
+
+@event.listens_for(PrimarySession, "after_rollback")
+def rolled_back(session: Session):
+    session.info.pop("pending_write", None)
+
+
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False,
+                                  sync_session_class=PrimarySession)
+
+# Read replicas, a comma separated list of URLs in the settings
+REPLICA_DATABASE_URLS = [url.strip() for url in settings.sqlalchemy_replica_urls.split(",") if url.strip()]
+replica_engines = []
+for number, url in enumerate(REPLICA_DATABASE_URLS):
+    replica_engine = create_async_engine(get_async_database_url(url), **get_engine_options(url))
+    register_pool_gauges(replica_engine.pool, prefix=f"db_replica_{number}_pool")
+    replica_engines.append(replica_engine)
+ReplicaSessions = [async_sessionmaker(bind=replica_engine, autoflush=False, expire_on_commit=False,
+                                      info={"replica": True})
+                   for replica_engine in replica_engines]
+_next_replica = itertools.cycle(ReplicaSessions) if ReplicaSessions else None
+
+
+def is_replica(db: AsyncSession) -> bool:
+    """
+    The is_replica function checks if a session reads from a read replica, which may lag behind the primary.
+
+    :param db: AsyncSession: The session
+    :return: True if the session is bound to a replica
+    :rtype: bool
+    """
+    return db.info.get("replica", False)
+
+
+LAST_WRITE_COOKIE = "last_write"
+
+
+class RecentWrites:
+    MAX_WRITERS = 10000
+
+    def __init__(self, window: float):
+        """
+        The __init__ function sets up the read-your-writes bookkeeping of this process.
+
+        :param self: Represent the instance of the class
+        :param window: float: How many seconds after a write the reads of the writer stay on the primary
+        :return: The object created
+        """
+        self.window = window
+        self._writes = {}
+
+    def record(self, writer: str):
+        """
+        The record function remembers that a writer has just written to the primary.
+        Expired entries are dropped once the table grows past MAX_WRITERS.
+
+        :param self: Represent the instance of the class
+        :param writer: str: The email of the user who wrote
+        :return: None
+        """
+        now = time.monotonic()
+        self._writes[writer] = now
+        if len(self._writes) > self.MAX_WRITERS:
+            self._writes = {key: written for key, written in self._writes.items() if now - written < self.window}
+
+    def seen(self, writer: str | None) -> bool:
+        """
+        The seen function checks if a writer wrote to the primary within the window.
+
+        :param self: Represent the instance of the class
+        :param writer: str | None: The email of the user, None for anonymous requests
+        :return: True if the reads of the writer must go to the primary
+        :rtype: bool
+        """
+        written = self._writes.get(writer) if writer else None
+        return written is not None and time.monotonic() - written < self.window
+
+
+recent_writes = RecentWrites(settings.read_your_writes_seconds)
+
+
+def wrote_recently(request: Request) -> bool:
+    """
+    The wrote_recently function checks if the client of a request wrote within the read-your-writes window.
+    The in-process table covers clients with a bearer token, the last_write cookie covers browsers
+    whose next request lands on another worker.
+
+    :param request: Request: The incoming request, the writer is set on its state by the write tracking middleware
+    :return: True if the request must read from the primary
+    :rtype: bool
+    """
+    if recent_writes.seen(getattr(request.state, "writer", None)):
+        return True
     try:
+        return time.time() - float(request.cookies.get(LAST_WRITE_COOKIE, 0)) < recent_writes.window
+    except ValueError:
+        return False
+
+
+# Dependency
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+# Dependency for read-only routes
+async def get_read_db(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    The get_read_db function yields a session for routes that only read.
+    Reads go to the replicas in turn, and stay on the primary session of the request
+    when no replica is configured or the client wrote within the read-your-writes window.
+    The session must not be used for writes.
+
+    :param request: Request: The incoming request
+    :param db: AsyncSession: The primary session of the request, it connects only if it is used
+    :return: A database session
+    :rtype: AsyncSession
+    """
+    if _next_replica is None or wrote_recently(request):
         yield db
-    finally:
-        db.close()
+        return
+    async with next(_next_replica)() as replica_db:
+        yield replica_db
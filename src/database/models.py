@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, func, Table, UniqueConstraint, Enum, PickleType
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, func, Table, UniqueConstraint, CheckConstraint, Index, Enum, PickleType, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import DateTime
@@ -18,7 +18,6 @@ class User(Base):
     password = Column(String(255), nullable=False)
     crated_at = Column('crated_at', DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
-    refresh_token = Column(String(255), nullable=True)
     confirmed = Column(Boolean, default=False)
     roles = Column('roles', Enum(Role), default=Role.user)
     access = Column(Boolean, default=True)
@@ -40,12 +39,19 @@ image_m2m_tag = Table(
     Column("id", Integer, primary_key=True),
     Column("image_id", Integer, ForeignKey("images.id", ondelete="CASCADE")),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE")),
+    # Covers the tag searches of repository.find, they read image ids by tag id without touching the rows
+    Index("ix_image_m2m_tag_tag_id_image_id", "tag_id", "image_id"),
 )
 
 class Tag(Base):
     __tablename__ = "tags"
+    __table_args__ = (
+        Index('ix_tags_usage_count_id', 'usage_count', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(25), nullable=False, unique=True)
+    # Number of images with the tag, kept by repository.images
+    usage_count = Column(Integer, nullable=False, default=0, server_default='0')
 
 class Image(Base):
     __tablename__ = "images"
@@ -60,11 +66,48 @@ class Image(Base):
     created_at = Column('created_at', DateTime, default=func.now())
     updated_at = Column('updated_at', DateTime, default=func.now())
 
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    one_star_count = Column(Integer, nullable=False, default=0, server_default='0')
+    two_stars_count = Column(Integer, nullable=False, default=0, server_default='0')
+    three_stars_count = Column(Integer, nullable=False, default=0, server_default='0')
+    four_stars_count = Column(Integer, nullable=False, default=0, server_default='0')
+    five_stars_count = Column(Integer, nullable=False, default=0, server_default='0')
+
     comments = relationship('Comment', back_populates='image')
     transformated_images_settings = relationship("ImageSettings", back_populates='image')
 
 
 
+# Search on image descriptions. PostgreSQL gets a generated tsvector column with a GIN index for full-text search
+# and a GIN trigram index for substring search, SQLite an external content FTS5 table kept in sync by triggers.
+# None of them is mapped, repository.find queries them.
+FULLTEXT_CONFIG = 'simple'
+SEARCH_DDL = {
+    "postgresql": [
+        "CREATE INDEX ix_images_description_trgm ON images USING gin (description gin_trgm_ops)",
+        f"ALTER TABLE images ADD COLUMN description_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{FULLTEXT_CONFIG}', coalesce(description, ''))) STORED",
+        "CREATE INDEX ix_images_description_tsv ON images USING gin (description_tsv)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE images_fts USING fts5(description, content='images', content_rowid='id')",
+        "CREATE TRIGGER images_fts_ai AFTER INSERT ON images BEGIN "
+        "INSERT INTO images_fts(rowid, description) VALUES (new.id, new.description); END",
+        "CREATE TRIGGER images_fts_ad AFTER DELETE ON images BEGIN "
+        "INSERT INTO images_fts(images_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+        "CREATE TRIGGER images_fts_au AFTER UPDATE OF description ON images BEGIN "
+        "INSERT INTO images_fts(images_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+        "INSERT INTO images_fts(rowid, description) VALUES (new.id, new.description); END",
+    ],
+}
+for dialect, statements in SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(Image.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+event.listen(Base.metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+event.listen(Image.__table__, "before_drop", DDL("DROP TABLE IF EXISTS images_fts").execute_if(dialect="sqlite"))
+
 class Comment(Base):
     __tablename__ = 'comments'
     id = Column(Integer, primary_key=True)
@@ -94,16 +137,49 @@ class ImageSettings(Base):
     updated_at = Column('updated_at', DateTime, default=func.now())
 
 
+def star_flag(stars: int):
+    """Read-only boolean view of a star rating, kept for the one_star ... five_stars API fields."""
+    return property(lambda rating: rating.stars == stars)
+
+
 class Rating(Base):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'image_id', name='uq_ratings_user_image'),
+        CheckConstraint('stars BETWEEN 0 AND 5', name='ck_ratings_stars'),
+    )
     id = Column(Integer, primary_key=True)
-    one_star = Column(Boolean, default=False)
-    two_stars = Column(Boolean, default=False)
-    three_stars = Column(Boolean, default=False)
-    four_stars = Column(Boolean, default=False)
-    five_stars = Column(Boolean, default=False)
+    stars = Column(SmallInteger, nullable=False, default=0)
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="ratings")
     image_id = Column('image_id', ForeignKey('images.id', ondelete='CASCADE'), default=None)
     image = relationship('Image', backref="ratings")
 
+    one_star = star_flag(1)
+    two_stars = star_flag(2)
+    three_stars = star_flag(3)
+    four_stars = star_flag(4)
+    five_stars = star_flag(5)
+
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(32), nullable=False, unique=True)
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
+    # The row is useless once the token has expired, it is swept at startup
+    expires_at = Column('expires_at', DateTime, nullable=False, index=True)
+    created_at = Column('created_at', DateTime, default=func.now())
+
+
+class RefreshToken(Base):
+    __tablename__ = 'refresh_tokens'
+    id = Column(Integer, primary_key=True)
+    # SHA-256 of the token, a leaked table does not leak usable tokens
+    token_hash = Column('token_hash', String(64), nullable=False, unique=True)
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    user = relationship('User', backref="refresh_tokens")
+    device = Column('device', String(255))
+    created_at = Column('created_at', DateTime, default=func.now())
+    last_used_at = Column('last_used_at', DateTime, default=func.now())
+    expires_at = Column('expires_at', DateTime, nullable=False, index=True)
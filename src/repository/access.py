@@ -1,11 +1,11 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas import Role
-from src.repository.users import get_user_by_email
+from src.repository.users import get_user_by_email, invalidate_user
 
 
-async def update_user(email, role: Role, db: Session):
+async def update_user(email, role: Role, db: AsyncSession):
     """
     The update_user function updates the user's role in the database.
     
@@ -14,34 +14,36 @@ async def update_user(email, role: Role, db: Session):
     :param role: Pass in the role object that will be assigned to the user
     :type role: Role
     :param db: Pass the database session to the function
-    :type db: Session
+    :type db: AsyncSession
     :return: A user object with the updated role
     :rtype: User
     """
     user = await get_user_by_email(email, db)
     user.roles = role
-    db.commit()
+    await db.commit()
+    invalidate_user(email)
     return (user)
 
 
-async def block_user(email: str, db: Session):
+async def block_user(email: str, db: AsyncSession):
     """
     The block_user function takes an email address and a database connection as arguments.
     It then uses the get_user_by_email function to retrieve the user object from the database,
     and sets its access attribute to False. It then commits this change to the database, and returns a string indicating that it has done so.
     
     :param email: str: Specify the email of the user that is to be banned
-    :param db: Session: Pass the database session into the function
+    :param db: AsyncSession: Pass the database session into the function
     :return: A string message
     :doc-author: Trelent
     """
     user = await get_user_by_email(email, db)
     user.access = False
-    db.commit()
+    await db.commit()
+    invalidate_user(email)
     return (f"User {email} is banned now")
 
 
-async def unblock_user(email: str, db: Session):
+async def unblock_user(email: str, db: AsyncSession):
     """
     The unblock_user function takes an email address and a database connection as arguments.
     It then uses the get_user_by_email function to retrieve the user object from the database,
@@ -49,12 +51,13 @@ async def unblock_user(email: str, db: Session):
     a string indicating that it has been done.
     
     :param email: str: Get the email of the user that we want to unblock
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A string
     :doc-author: Trelent
     """
     user = await get_user_by_email(email, db)
     user.access = True
-    db.commit()
+    await db.commit()
+    invalidate_user(email)
     return (f"User {email} is not banned now")
 
@@ -1,12 +1,13 @@
 from typing import Optional, List
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 
 from src.database.models import Comment, User, Image, Role
 from src.schemas import CommentModel, CommentUpdateModel, CommentResponse
 
-async def get_comment(comment_id: int, db: Session) -> Optional[CommentResponse]:
+async def get_comment(comment_id: int, db: AsyncSession) -> Optional[CommentResponse]:
     """
     Retrieves a single comment with the specified ID.
 
@@ -14,14 +15,14 @@ async def get_comment(comment_id: int, db: Session) -> Optional[CommentResponse]
     :param db: The database session.
     :return: The comment with the specified ID, or None if it does not exist.
     """
-    comment_res = db.query(Comment).filter(Comment.id == comment_id).first()
+    comment_res = await db.scalar(select(Comment).filter(Comment.id == comment_id))
     print("Comment Result:", comment_res)
     if comment_res:
         return CommentResponse(content=comment_res.content, id=comment_res.id)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
 
-async def update_comment(body: CommentUpdateModel, user: User, db: Session) -> Optional[CommentResponse]:
+async def update_comment(body: CommentUpdateModel, user: User, db: AsyncSession) -> Optional[CommentResponse]:
     """
     Updates a single comment with the specified ID created by the specific user.
 
@@ -31,34 +32,34 @@ async def update_comment(body: CommentUpdateModel, user: User, db: Session) -> O
     :param db: The database session.
     :return: The updated comment, or None if it does not exist.
     """
-    comment = db.query(Comment).filter(Comment.id == body.id).first()
+    comment = await db.scalar(select(Comment).filter(Comment.id == body.id))
 
     if comment:
         if user.id == comment.user_id:
             comment.content = body.content
-            db.commit()
+            await db.commit()
             return CommentResponse(content=comment.content, id=comment.id)
 
     return None
 
 
-async def get_comments(photo_id: int, db: Session)-> List[CommentResponse]:
+async def get_comments(photo_id: int, db: AsyncSession)-> List[CommentResponse]:
     """
     Retrieves a list of comments for a specific photo with specified pagination parameters.
 
     :param photo_id: The photo id to retrieve comments for.
     :type photo_id: int
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: A list of comments.
     :rtype: List[Comment]
     """
     all_comments=[]
 
-    image = db.query(Image).filter(Image.id == photo_id).first()
+    image = await db.scalar(select(Image).filter(Image.id == photo_id))
 
     if image:
-        comments_list = db.query(Comment).filter(Comment.image_id == photo_id).all()
+        comments_list = await db.scalars(select(Comment).filter(Comment.image_id == photo_id))
         for comment in comments_list:
             all_comments.append(CommentResponse(content=comment.content, id=comment.id))
         return all_comments
@@ -66,7 +67,7 @@ async def get_comments(photo_id: int, db: Session)-> List[CommentResponse]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
 
 
-async def create_comment(body: CommentModel, user: User, db: Session) -> Comment:
+async def create_comment(body: CommentModel, user: User, db: AsyncSession) -> Comment:
     """
     Creates a new comment for a specific photo.
 
@@ -77,7 +78,7 @@ async def create_comment(body: CommentModel, user: User, db: Session) -> Comment
     :param photo: The photo to retrieve comments for.
     :type photo: Photo
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: The newly created comment.
     :rtype: Comment
     """
@@ -85,12 +86,12 @@ async def create_comment(body: CommentModel, user: User, db: Session) -> Comment
     comment = Comment(content = body.content, user_id = user.id, image_id = body.image_id)
 
     db.add(comment)
-    db.commit()
-    db.refresh(comment)
+    await db.commit()
+    await db.refresh(comment)
     return comment
 
 
-async def remove_comment(comment_id: int, user: User, db: Session) -> Optional[CommentResponse]:
+async def remove_comment(comment_id: int, user: User, db: AsyncSession) -> Optional[CommentResponse]:
     """
     Removes a single comment with the specified ID. Can be removed only by admin or moderator.
     :param comment_id: The ID of the comment to remove.
@@ -98,15 +99,15 @@ async def remove_comment(comment_id: int, user: User, db: Session) -> Optional[C
     :param user: Current user that tries to remove the comment.
     :type user: User
     :param db: The database session.
-    :type db: Session
+    :type db: AsyncSession
     :return: The removed comment, or None if it does not exist.
     :rtype: Comment | None
     """
     if user.roles == Role.admin or user.roles == Role.moderator:
-        comment = db.query(Comment).filter(Comment.id == comment_id).first()
+        comment = await db.scalar(select(Comment).filter(Comment.id == comment_id))
         if comment:
-            db.delete(comment)
-            db.commit()
+            await db.delete(comment)
+            await db.commit()
             return CommentResponse(content=comment.content, id=comment.id)
 
         return None
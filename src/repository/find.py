@@ -1,75 +1,387 @@
-from sqlalchemy.orm import Session, aliased
-import asyncio
-from sqlalchemy import desc, select
+import re
+from datetime import datetime
 
-from src.database.models import User, Image, Tag, Rating
-from src.schemas import SortField
-from src.repository.ratings import get_average_rating
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, literal, literal_column, table, column, or_, and_, case, cast, distinct, union_all, \
+    DateTime, String
 
+from src.database.db import is_replica
+from src.database.models import User, Image, Tag, Rating, image_m2m_tag, FULLTEXT_CONFIG
+from src.schemas import KeyWordsSortField, SortField, SearchMode
+from src.repository.ratings import AVERAGE_RATING, average_rating
+from src.repository.tags import get_tag_id
+from src.services.pagination import encode_cursor, decode_cursor
+from src.services.search_cache import search_cache
 
-async def get_photo_by_tag(tag: str, db: Session, sort_by):
+# The FTS5 table of image descriptions on SQLite, rank is its bm25 score (lower is better)
+images_fts = table("images_fts", column("rowid"), column("rank"))
+
+
+async def search_page(query, key, db: AsyncSession, limit: int | None = None, cursor: str | None = None,
+                      descending: bool = False):
+    """
+    The search_page function returns one page of a search, ordered by the sort key and then by image id.
+    The page starts right after the image encoded in the cursor, and the database sorts and cuts the page
+    with ORDER BY ... LIMIT, so the cost of a page does not depend on how many images match.
+
+    :param query: A query of the matching images
+    :param key: The SQL expression to sort by, a datetime or a number
+    :param db: AsyncSession: Pass the database session to the function
+    :param limit: int | None: The size of the page, None returns all remaining images
+    :param cursor: str | None: The cursor of the previous page, None starts from the first image
+    :param descending: bool: Sort the key from the highest to the lowest value
+    :return: A list of tuples (image, value of the key) and the cursor of the next page or None
+    """
+    by_date = isinstance(key.type, DateTime)
+    if cursor:
+        last_key, last_id = decode_cursor(cursor, str if by_date else float, int)
+        if by_date:
+            try:
+                last_key = datetime.fromisoformat(last_key)
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        after = key < last_key if descending else key > last_key
+        query = query.filter(or_(after, and_(key == last_key, Image.id > last_id)))
+    query = query.add_columns(key).order_by(key.desc() if descending else key, Image.id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = [tuple(row) for row in await db.execute(query)]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        image, last_key = rows[-1]
+        next_cursor = encode_cursor(last_key.isoformat() if by_date else float(last_key), image.id)
+    return rows, next_cursor
+
+
+async def cached_search(key, db: AsyncSession, by_rating: bool, search, **index):
+    """
+    The cached_search function returns a page of search results from the search cache, or runs the search
+    and caches the ids of the found images. A cached page costs one query by primary key,
+    the images and their ratings are always read fresh. Pages read from a replica are not cached,
+    a lagging replica may not have the write that last invalidated the cache, and its stale page
+    would be served to the writer whose reads go to the primary.
+
+    :param key: The key of the page: the kind of search, the normalized search, the sort field and the page
+    :param db: AsyncSession: Pass the database session to the function
+    :param by_rating: bool: Whether the page is sorted by rating and holds tuples (image, average_rating)
+    :param search: The coroutine function that runs the search and returns the page and the next cursor
+    :param index: The tags or words the search filters on, see SearchCache.set
+    :return: The page and the cursor of the next page or None
     """
-    The get_photo_by_tag function returns a list of images with the given tag.
-        The function takes in three arguments:
+    entry = search_cache.get(key)
+    if entry is not None:
+        found = {image.id: image for image in await db.scalars(select(Image).filter(Image.id.in_(entry.ids)))} \
+            if entry.ids else {}
+        images = [found[image_id] for image_id in entry.ids if image_id in found]
+        return ([(image, average_rating(image)) for image in images] if by_rating else images), entry.next_cursor
+
+    generation = search_cache.generation
+    page, next_cursor = await search()
+    ids = [image.id for image, _ in page] if by_rating else [image.id for image in page]
+    if not is_replica(db):
+        search_cache.set(key, ids, next_cursor, generation, by_rating=by_rating, **index)
+    return page, next_cursor
+
+
+async def tag_query(tag: str, db: AsyncSession):
+    """
+    The tag_query function builds the query of the images with a tag.
+
+    :param tag: str: The name of the tag
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A query of the images, or None if there is no such tag
+    """
+    tag_id = await get_tag_id(tag, db)
+    if tag_id is None:
+        return None
+    return select(Image).join(image_m2m_tag, image_m2m_tag.c.image_id == Image.id) \
+        .filter(image_m2m_tag.c.tag_id == tag_id)
+
+
+async def get_photo_by_tag(tag: str, db: AsyncSession, sort_by, limit: int | None = None, cursor: str | None = None):
+    """
+    The get_photo_by_tag function returns a page of images with the given tag.
+        The function takes in five arguments:
             - tag: A string representing the name of the tag to search for.
-            - db: An instance of Session from SQLAlchemy's ORM, used to query and update data in a database.
+            - db: An instance of AsyncSession from SQLAlchemy's ORM, used to query and update data in a database.
             - sort_by: An enum value that determines how to sort returned images (either by date or rating).
+            - limit and cursor: The size of the page and the cursor returned with the previous page.
+        Images sorted by rating come with their average rating, the best rated first.
     
     :param tag: str: Specify the tag that we want to search for
-    :param db: Session: Pass the database session into the function
+    :param db: AsyncSession: Pass the database session into the function
     :param sort_by: Sort the images by date or rating
-    :return: A list of tuples (image, average_rating)
+    :param limit: int | None: The size of the page, None returns all images
+    :param cursor: str | None: The cursor of the previous page
+    :return: A list of images, or a list of tuples (image, average_rating) when sorted by rating,
+        and the cursor of the next page or None
     :doc-author: Trelent
     """
-    if sort_by == SortField.date:
-        sorted_images = db.query(Image).join(Image.tags).filter(Tag.name == tag).order_by(Image.created_at).all()
-    else:
-        tag = db.execute(select(Tag).filter(Tag.name == tag)).scalar()
-        if not tag:
+    async def search():
+        tagged_images = await tag_query(tag, db)
+        if tagged_images is None:
             print(f"Тег '{tag}' не найден.")
-            return []
+            return [], None
+
+        if sort_by == SortField.date:
+            rows, next_cursor = await search_page(tagged_images, Image.created_at, db, limit, cursor)
+            return [image for image, _ in rows], next_cursor
+        return await search_page(tagged_images, AVERAGE_RATING, db, limit, cursor, descending=True)
+
+    return await cached_search(("tag", tag, sort_by, limit, cursor), db, sort_by != SortField.date, search, tags=[tag])
+
+
+MAX_SEARCH_TAGS = 20
+
+
+def split_tag_names(names: str | None) -> list[str]:
+    """
+    The split_tag_names function splits a comma separated list of tag names, trims them and drops the duplicates.
+
+    :param names: str | None: The tag names from the query string
+    :return: The tag names in their original order
+    :rtype: list[str]
+    """
+    if not names:
+        return []
+    return list(dict.fromkeys(name.strip() for name in names.split(",") if name.strip()))
+
+
+async def tags_query(all_tags: list[str], any_tags: list[str], none_tags: list[str], db: AsyncSession):
+    """
+    The tags_query function builds the query of the images that have every tag of all_tags, at least one tag
+    of any_tags and no tag of none_tags. The sets are combined by the database in one GROUP BY over image_m2m_tag:
+    the rows of the wanted tags are read through the (tag_id, image_id) index, grouped by image and kept
+    when HAVING counts every tag of all_tags and one of any_tags, the excluded tags are a NOT EXISTS on the same index.
+
+    :param all_tags: list[str]: The tags every image must have
+    :param any_tags: list[str]: The tags of which every image must have at least one
+    :param none_tags: list[str]: The tags no image may have
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A query of the images, or None if no image can match
+    """
+    if not all_tags and not any_tags:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Give at least one tag in all or any")
+    if len(all_tags) + len(any_tags) + len(none_tags) > MAX_SEARCH_TAGS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"A search can use at most {MAX_SEARCH_TAGS} tags")
+
+    all_ids = [await get_tag_id(name, db) for name in all_tags]
+    any_ids = [tag_id for tag_id in [await get_tag_id(name, db) for name in any_tags] if tag_id is not None]
+    none_ids = [tag_id for tag_id in [await get_tag_id(name, db) for name in none_tags] if tag_id is not None]
+    if None in all_ids or (any_tags and not any_ids):
+        return None
+
+    tag_id, image_id = image_m2m_tag.c.tag_id, image_m2m_tag.c.image_id
+    conditions = []
+    if all_ids:
+        conditions.append(func.count(distinct(case((tag_id.in_(all_ids), tag_id)))) == len(set(all_ids)))
+    if any_ids:
+        conditions.append(func.sum(case((tag_id.in_(any_ids), 1), else_=0)) > 0)
+    matches = select(image_id).filter(tag_id.in_(set(all_ids + any_ids))).group_by(image_id) \
+        .having(and_(*conditions)).subquery()
+
+    query = select(Image).join(matches, matches.c.image_id == Image.id)
+    if none_ids:
+        excluded = select(image_id).filter(tag_id.in_(none_ids), image_id == Image.id)
+        query = query.filter(~excluded.exists())
+    return query
+
+
+async def get_photo_by_tags(all_tags: list[str], any_tags: list[str], none_tags: list[str], db: AsyncSession, sort_by,
+                            limit: int | None = None, cursor: str | None = None):
+    """
+    The get_photo_by_tags function returns a page of images that have every tag of all_tags, at least one tag
+    of any_tags and no tag of none_tags, see tags_query.
+
+    :param all_tags: list[str]: The tags every image must have
+    :param any_tags: list[str]: The tags of which every image must have at least one
+    :param none_tags: list[str]: The tags no image may have
+    :param db: AsyncSession: Pass the database session into the function
+    :param sort_by: Sort the images by date or rating
+    :param limit: int | None: The size of the page, None returns all images
+    :param cursor: str | None: The cursor of the previous page
+    :return: A list of images, or a list of tuples (image, average_rating) when sorted by rating,
+        and the cursor of the next page or None
+    """
+    async def search():
+        query = await tags_query(all_tags, any_tags, none_tags, db)
+        if query is None:
+            return [], None
+
+        if sort_by == SortField.date:
+            rows, next_cursor = await search_page(query, Image.created_at, db, limit, cursor)
+            return [image for image, _ in rows], next_cursor
+        return await search_page(query, AVERAGE_RATING, db, limit, cursor, descending=True)
+
+    key = ("tags", tuple(sorted(all_tags)), tuple(sorted(any_tags)), tuple(sorted(none_tags)), sort_by, limit, cursor)
+    return await cached_search(key, db, sort_by != SortField.date, search, tags=all_tags + any_tags + none_tags)
+
+
+def like_pattern(words: str) -> str:
+    """
+    The like_pattern function turns the words into an infix LIKE pattern that matches them literally:
+    % and _ typed by the user are escaped instead of acting as wildcards.
+    On PostgreSQL the trigram index on images.description serves this pattern with ILIKE.
+
+    :param words: str: The words typed by the user
+    :return: The pattern, to be used with escape="\\"
+    """
+    escaped = words.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
 
-        images_with_ratings = []
-        images = tag.images
-        for image in images:
-            average_rating = await get_average_rating(image.id, db)
-            images_with_ratings.append(
-                (image, f"average_rating: {average_rating}"))
 
-        sorted_images = sorted(images_with_ratings,
-                               key=lambda x: x[1], reverse=True)
+def fulltext_search(words: str, dialect: str):
+    """
+    The fulltext_search function builds the full-text search of image descriptions for the dialect of the session.
+    Every word must match. PostgreSQL parses the words with websearch_to_tsquery (quotes, "or" and -word work)
+    against the GIN indexed tsvector column, SQLite matches them against the FTS5 table.
+
+    :param words: str: The words typed by the user
+    :param dialect: str: The name of the database dialect, postgresql or sqlite
+    :return: A query of the matching images and the score of the match, lower is better
+    """
+    if dialect == "postgresql":
+        vector = literal_column("images.description_tsv")
+        tsquery = func.websearch_to_tsquery(FULLTEXT_CONFIG, words)
+        return select(Image).filter(vector.bool_op("@@")(tsquery)), -func.ts_rank_cd(vector, tsquery)
 
-    return sorted_images
+    # Quoted tokens are plain words for FTS5, the operators of its query syntax cannot be injected
+    match = " ".join(f'"{token}"' for token in re.findall(r"\w+", words)) or '""'
+    query = select(Image).join(images_fts, images_fts.c.rowid == Image.id) \
+        .filter(literal_column("images_fts").op("MATCH")(match))
+    return query, images_fts.c.rank
 
 
+def key_words_query(words: str, db: AsyncSession, mode: SearchMode):
+    """
+    The key_words_query function builds the query of the images whose description contains the words.
+
+    :param words: str: The words typed by the user
+    :param db: AsyncSession: The session, its dialect picks the full-text search
+    :param mode: SearchMode: Match the words as a substring or with the full-text index
+    :return: A query of the images and the relevance to sort by, lower is better
+    """
+    if mode == SearchMode.fulltext:
+        return fulltext_search(words, db.get_bind().dialect.name)
+    return select(Image).filter(Image.description.ilike(like_pattern(words), escape="\\")), Image.created_at
 
 
-async def get_photo_by_key_words(words: str, db: Session, sort_by):
+async def get_photo_by_key_words(words: str, db: AsyncSession, sort_by, mode: SearchMode = SearchMode.substring,
+                                 limit: int | None = None, cursor: str | None = None):
     """
-    The get_photo_by_key_words function takes in a string of words and returns all images that contain those words.
-        The function also takes in a sort_by parameter which can be either SortField.date or SortField.rating,
-        and will return the images sorted by date or rating respectively.
+    The get_photo_by_key_words function takes in a string of words and returns a page of images that contain those words.
+        The function also takes in a sort_by parameter which can be either KeyWordsSortField.date,
+        KeyWordsSortField.rating or KeyWordsSortField.relevance, and will return the images sorted by date, rating or relevance respectively.
+        In substring mode the words are one literal substring of the description and relevance sorts by date,
+        in fulltext mode every word must appear in the description and the search uses the full-text index.
     
     :param words: str: Search the database for images with a description that contains the words
-    :param db: Session: Pass the database session to the function
-    :param sort_by: Sort the images by date or rating
-    :return: A list of tuples
+    :param db: AsyncSession: Pass the database session to the function
+    :param sort_by: Sort the images by date, rating or relevance
+    :param mode: SearchMode: Match the words as a substring or with the full-text index
+    :param limit: int | None: The size of the page, None returns all images
+    :param cursor: str | None: The cursor of the previous page
+    :return: A list of images, or a list of tuples (image, average_rating) when sorted by rating,
+        and the cursor of the next page or None
     :doc-author: Trelent
     """
-    if sort_by == SortField.date:
-        query = db.query(Image).filter(Image.description.ilike(
-            f"%{words}%")).order_by(Image.created_at)
-        sorted_images = query.all()
-    else:
-        images_with_ratings = []
-        images = db.query(Image).filter(Image.description.ilike(f"%{words}%")).all()
-        for image in images:
-            average_rating = await get_average_rating(image.id, db)
-            images_with_ratings.append((image, average_rating))
+    async def search():
+        query, relevance = key_words_query(words, db, mode)
+
+        if sort_by == KeyWordsSortField.rating:
+            return await search_page(query, AVERAGE_RATING, db, limit, cursor, descending=True)
+        key = Image.created_at if sort_by == KeyWordsSortField.date else relevance
+        rows, next_cursor = await search_page(query, key, db, limit, cursor)
+        return [image for image, _ in rows], next_cursor
+
+    fulltext = mode == SearchMode.fulltext
+    normalized = " ".join(words.lower().split()) if fulltext else words.lower()
+    key = ("words", normalized, mode, sort_by, limit, cursor)
+    return await cached_search(key, db, sort_by == KeyWordsSortField.rating, search, words=normalized, fulltext=fulltext)
+
 
-        sorted_images = sorted(images_with_ratings,
-                               key=lambda x: x[1], reverse=True)
+MAX_FACETS = 50
 
-    return sorted_images
+# The rating band of an image: the whole part of its average rating, or unrated
+RATING_BAND = case((Image.rating_count == 0, "unrated"), else_=cast(Image.rating_sum // Image.rating_count, String))
 
 
+async def get_facets(query, db: AsyncSession, facet_limit: int = 10, exclude_tags=()) -> dict:
+    """
+    The get_facets function counts the tags that co-occur in the results of a search and the images in every rating band.
+    Both counts are computed by one UNION ALL statement over the ids of the matched images,
+    no image row is sent to the application.
+
+    :param query: A query of the matched images, or None if nothing matches
+    :param db: AsyncSession: Pass the database session to the function
+    :param facet_limit: int: How many tags are counted at most, the most frequent first
+    :param exclude_tags: The ids of the tags every result has because the search requires them
+    :return: The tag names with their counts and the rating bands with their counts
+    :rtype: dict
+    """
+    facets = {"tags": [], "ratings": []}
+    if query is None:
+        return facets
+    matched = query.with_only_columns(Image.id).cte("matched")
+    tag_counts = select(literal("tags").label("facet"), Tag.name.label("value"), func.count().label("count")) \
+        .join(image_m2m_tag, image_m2m_tag.c.tag_id == Tag.id) \
+        .filter(image_m2m_tag.c.image_id.in_(select(matched.c.id)), Tag.id.not_in(exclude_tags)) \
+        .group_by(Tag.name).order_by(func.count().desc(), Tag.name).limit(min(facet_limit, MAX_FACETS)).subquery()
+    # Grouped by the output name, PostgreSQL would not see that the CASE of GROUP BY with its own parameters is the same
+    rating_counts = select(literal("ratings").label("facet"), RATING_BAND.label("value"), func.count().label("count")) \
+        .join(matched, matched.c.id == Image.id).group_by(literal_column("value")).subquery()
+
+    for facet, value, count in await db.execute(union_all(select(tag_counts), select(rating_counts))):
+        facets[facet].append({"value": value, "count": count})
+    facets["ratings"].sort(key=lambda band: (band["value"] != "unrated", band["value"]), reverse=True)
+    return facets
+
+
+async def get_tag_facets(tag: str, db: AsyncSession, facet_limit: int = 10) -> dict:
+    """
+    The get_tag_facets function returns the facet counts of a search by tag, the searched tag is not counted.
+
+    :param tag: str: The name of the tag
+    :param db: AsyncSession: Pass the database session to the function
+    :param facet_limit: int: How many tags are counted at most
+    :return: The tag and rating band counts, see get_facets
+    :rtype: dict
+    """
+    return await get_facets(await tag_query(tag, db), db, facet_limit, [await get_tag_id(tag, db)])
+
+
+async def get_tags_facets(all_tags: list[str], any_tags: list[str], none_tags: list[str], db: AsyncSession,
+                          facet_limit: int = 10) -> dict:
+    """
+    The get_tags_facets function returns the facet counts of a search by several tags, the tags of all_tags are not counted.
+
+    :param all_tags: list[str]: The tags every image must have
+    :param any_tags: list[str]: The tags of which every image must have at least one
+    :param none_tags: list[str]: The tags no image may have
+    :param db: AsyncSession: Pass the database session to the function
+    :param facet_limit: int: How many tags are counted at most
+    :return: The tag and rating band counts, see get_facets
+    :rtype: dict
+    """
+    query = await tags_query(all_tags, any_tags, none_tags, db)
+    return await get_facets(query, db, facet_limit, [await get_tag_id(name, db) for name in all_tags])
+
+
+async def get_key_words_facets(words: str, db: AsyncSession, mode: SearchMode = SearchMode.substring,
+                               facet_limit: int = 10) -> dict:
+    """
+    The get_key_words_facets function returns the facet counts of a search by words.
+
+    :param words: str: The words typed by the user
+    :param db: AsyncSession: Pass the database session to the function
+    :param mode: SearchMode: Match the words as a substring or with the full-text index
+    :param facet_limit: int: How many tags are counted at most
+    :return: The tag and rating band counts, see get_facets
+    :rtype: dict
+    """
+    query, _ = key_words_query(words, db, mode)
+    return await get_facets(query, db, facet_limit)
@@ -1,23 +1,45 @@
 from datetime import datetime
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from src.repository.ratings import get_average_rating
+from src.repository.ratings import average_rating
+from src.repository.tags import resolve_tags, change_usage
 from src.database.models import Image, User, Tag, Comment
+from src.services.pagination import encode_cursor, decode_cursor
+from src.services.executors import cloudinary_executor
+from src.services.photo_services import upload_file
+from src.services.search_cache import invalidate_image_searches
+from src.services.tag_suggest import tag_index
 from src.schemas import ImageUpdateModel, ImageAddModel, ImageAddTagModel, Role
 
 
-async def add_image(db: Session, image: ImageAddModel, tags: list[str], url: str, public_name: str, user: User):
+async def load_image(db: AsyncSession, *criteria) -> Image | None:
+    """
+    The load_image function returns the first image matching the criteria with its tags loaded.
+    Attributes already present in the session are overwritten, so it also serves as a refresh after a commit;
+    the async session cannot lazy-load the tags later.
+
+    :param db: AsyncSession: Access the database
+    :param criteria: The filter criteria of the image
+    :return: The image or None
+    """
+    query = select(Image).options(selectinload(Image.tags)).filter(*criteria).execution_options(populate_existing=True)
+    return await db.scalar(query)
+
+
+async def add_image(db: AsyncSession, image: ImageAddModel, tags: list[str], url: str, public_name: str, user: User):
     """
     The add_image function adds an image to the database.
         Args:
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             image (ImageAddModel): The ImageAddModel object containing the description of the new image. 
             tags (list[str]): A list of strings representing tags for this new image.  Each tag must be less than 25 characters long, and there can only be five tags per image at most.   If more than five are provided, only the first five will be used and a message will be returned indicating that this has happened so that it can be displayed to users on their screen if they
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param image: ImageAddModel: Create a new image object
     :param tags: list[str]: Pass in a list of tags
     :param url: str: Store the url of the image in the database
@@ -29,43 +51,76 @@ async def add_image(db: Session, image: ImageAddModel, tags: list[str], url: str
     if not user:
         return None
 
-    num_tags = 0
-    image_tags = []
-    for tag in tags:
-        if len(tag) > 25:
-            tag = tag[0:25]
-        if not db.query(Tag).filter(Tag.name == tag.lower()).first():
-            db_tag = Tag(name=tag.lower())
-            db.add(db_tag)
-            db.commit()
-            db.refresh(db_tag)
-    
-        if num_tags < 5:
-            image_tags.append(tag.lower())
-        num_tags += 1
+    tags = [tag[0:25].lower() for tag in tags]
     message = ""
 
-    if num_tags >= 5:
+    if len(tags) >= 5:
         message = "Only five tags can be added to an image"
 
-    tags = db.query(Tag).filter(Tag.name.in_(image_tags)).all()
+    resolved_tags = await resolve_tags(tags, db)
+    tags = resolved_tags[:5]
     db_image = Image(description=image.description, tags=tags, url=url, public_name=public_name, user_id=user.id)
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    await change_usage([tag.id for tag in tags], 1, db)
+    await db.commit()
+    for tag in resolved_tags:
+        tag_index.add(tag.id, tag.name)
+    tag_index.use([tag.name for tag in tags])
+    invalidate_image_searches(db_image.id, [tag.name for tag in tags], image.description)
+    db_image = await load_image(db, Image.id == db_image.id)
  
     return db_image, message
 
 
-async def update_image(db: Session, image_id, image: ImageUpdateModel, user: User):
+async def unique_public_name(db: AsyncSession, public_name: str) -> str:
+    """
+    The unique_public_name function checks if the public_name is already in use by another image,
+    and if it is, it adds an underscore and a number to the end of the name.
+    If that name is also taken, it increments the number until there are no more images with that name.
+
+    :param db: AsyncSession: Access the database
+    :param public_name: str: The name of the uploaded file without its extension
+    :return: A string that is the name of the image
+    """
+    right_public_name = public_name
+    suffix = 1
+
+    while await db.scalar(select(Image.id).filter(Image.public_name == right_public_name)):
+        suffix += 1
+        right_public_name = f"{public_name}_{suffix}"
+
+    return right_public_name
+
+
+async def upload_image(db: AsyncSession, image: ImageAddModel, tags: list[str], file, filename: str, user: User):
+    """
+    The upload_image function uploads a file to Cloudinary under a unique public name and adds the image to the database.
+    The upload runs on the Cloudinary thread pool, the event loop stays free meanwhile.
+
+    :param db: AsyncSession: Access the database
+    :param image: ImageAddModel: The description of the new image
+    :param tags: list[str]: The normalized tags of the new image
+    :param file: The file object to upload
+    :param filename: str: The name of the uploaded file
+    :param user: User: The owner of the new image
+    :return: A tuple of the image and a message
+    """
+    right_public_name = await unique_public_name(db, filename.split(".")[0])
+    file_name = right_public_name + "_" + str(user.username)
+    src_url = await cloudinary_executor.run(upload_file, file, f'bayraktarogram/{file_name}',
+                                            width=250, height=250, crop='fill')
+    return await add_image(db, image, tags, src_url, right_public_name, user)
+
+
+async def update_image(db: AsyncSession, image_id, image: ImageUpdateModel, user: User):
     """
     The update_image function updates the description of an image.
         Args:
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             image_id (int): The id of the image to be updated.
             image (ImageUpdateModel): An ImageUpdateModel object containing the new description for this particular 
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param image_id: Identify the image to be deleted
     :param image: ImageUpdateModel: Get the new description for the image
     :param user: User: Check if the user is an admin or not
@@ -73,40 +128,44 @@ async def update_image(db: Session, image_id, image: ImageUpdateModel, user: Use
     """
 
     if user.roles == Role.admin:
-        db_image = db.query(Image).filter(Image.id == image_id).first()
+        db_image = await db.scalar(select(Image).filter(Image.id == image_id))
     else:
-        db_image = db.query(Image).filter(Image.id == image_id, Image.user_id == user.id).first()
+        db_image = await db.scalar(select(Image).filter(Image.id == image_id, Image.user_id == user.id))
 
     if db_image:
         db_image.description = image.description
-        db.commit()
-        db.refresh(db_image)
+        await db.commit()
+        invalidate_image_searches(db_image.id, description=db_image.description)
+        await db.refresh(db_image)
         return db_image
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     
 
-async def delete_image(db: Session, id: int, user: User):
+async def delete_image(db: AsyncSession, id: int, user: User):
     """
     The delete_image function deletes an image from the database.
         Args:
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             id (int): The ID of the image to be deleted.
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param id: int: Specify which image to delete
     :param user: User: Check if the user is an admin or not
     :return: A database object
     """
 
     if user.roles == Role.admin:
-        db_image = db.query(Image).filter(Image.id == id).first()
+        db_image = await load_image(db, Image.id == id)
     else:
-        db_image = db.query(Image).filter(Image.id == id, Image.user_id == user.id).first()
+        db_image = await load_image(db, Image.id == id, Image.user_id == user.id)
 
     if db_image:
-        db.delete(db_image)
-        db.commit()
+        await db.delete(db_image)
+        await change_usage([tag.id for tag in db_image.tags], -1, db)
+        await db.commit()
+        tag_index.use([tag.name for tag in db_image.tags], -1)
+        invalidate_image_searches(db_image.id)
         return db_image
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
@@ -128,15 +187,15 @@ async def normalize_tags(body):
     return correct_tags
 
 
-async def add_tag(db: Session, image_id, body: ImageAddTagModel, user: User):
+async def add_tag(db: AsyncSession, image_id, body: ImageAddTagModel, user: User):
     """
     The add_tag function adds tags to an image.
         Args:
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             image_id (int): The id of the image to add tags to.
             body (ImageAddTagModel): A model containing the tag names in a list format, as well as a boolean value for whether or not the user wants their new tags added on top of existing ones or replacing them entirely.  This is passed in from the request body and validated by pydantic before being passed into this function.  If it fails validation, an HTTPException will be raised with status code 400 and details
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param image_id: Identify the image in the database
     :param body: ImageAddTagModel: Pass the tags to be added to the image
     :param user: User: Check if the user is an admin or not
@@ -145,81 +204,104 @@ async def add_tag(db: Session, image_id, body: ImageAddTagModel, user: User):
 
     tags = await normalize_tags(body)
 
-    num_tags = 0
-    list_tags = []
+    tags = [tag[0:25].lower() for tag in tags if tag]
     detail = ""
-    for tag in tags:
-        if tag:
-            if len(tag) > 25:
-                tag = tag[0:25]
-            if not db.query(Tag).filter(Tag.name == tag.lower()).first():
-                db_tag = Tag(name=tag.lower())
-                db.add(db_tag)
-                db.commit()
-                db.refresh(db_tag)
-
-            if num_tags < 5:
-                list_tags.append(tag.lower())
-            num_tags += 1
-
-    if num_tags >= 5:
+
+    if len(tags) >= 5:
         detail = "Only five tags can be added to an image"
 
-    tags = db.query(Tag).filter(Tag.name.in_(list_tags)).all()
+    resolved_tags = await resolve_tags(tags, db)
+    tags = resolved_tags[:5]
 
     if user.roles == Role.admin:
-        image = db.query(Image).filter(Image.id == image_id).first()
+        image = await load_image(db, Image.id == image_id)
     else:
-        image = db.query(Image).filter(Image.id == image_id, Image.user_id == user.id).first()
+        image = await load_image(db, Image.id == image_id, Image.user_id == user.id)
 
     if image:
         image.updated_at = datetime.utcnow()
+        old_tags = {tag.id: tag.name for tag in image.tags}
+        new_tags = {tag.id: tag.name for tag in tags}
+        detached = [tag_id for tag_id in old_tags if tag_id not in new_tags]
+        attached = [tag_id for tag_id in new_tags if tag_id not in old_tags]
         image.tags = tags
-        db.commit()
-        db.refresh(image)
+        await change_usage(detached, -1, db)
+        await change_usage(attached, 1, db)
+        await db.commit()
+        for tag in resolved_tags:
+            tag_index.add(tag.id, tag.name)
+        tag_index.use([old_tags[tag_id] for tag_id in detached], -1)
+        tag_index.use([new_tags[tag_id] for tag_id in attached])
+        invalidate_image_searches(image.id, {**old_tags, **new_tags}.values(), image.description)
         return image, detail
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     
 
-async def get_image(db: Session, id: int, user: User):
+async def get_image(db: AsyncSession, id: int, user: User):
     """
     The get_image function is used to retrieve an image from the database.
     It takes in a database session, an id of the image to be retrieved, and a user object.
     The function returns both the image and all comments associated with that user for that particular image.
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param id: int: Specify the id of the image that we want to get
     :param user: User: Get the user id of the user who is logged in
     :return: The image and the comments associated with it
     """
 
-    image = db.query(Image).filter(Image.id == id).first()
+    image = await load_image(db, Image.id == id)
 
     if image:
-        ratings = await get_average_rating(image.id, db)
-        comments = db.query(Comment).filter(Comment.image_id == image.id, Comment.user_id == user.id).all()
+        ratings = average_rating(image)
+        comments = (await db.scalars(select(Comment).filter(Comment.image_id == image.id,
+                                                            Comment.user_id == user.id))).all()
         return image, comments, ratings
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     
-async def get_images(db: Session, user: User):
+async def get_images(db: AsyncSession, user: User, limit: int | None = None, cursor: str | None = None):
     """
-    The get_images function returns a list of images and comments for the user.
+    The get_images function returns a page of images and comments for the user.
+    Images are ordered by id, and the page starts right after the image encoded in the cursor,
+    so every page is an index range scan on the primary key no matter how deep it is.
+    Tags and the user's comments are loaded with one IN query each, and ratings come from the image rows,
+    so a page costs the same number of statements whatever its size.
         Args:
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             user (User): The current logged in user.
+            limit (int | None): The size of the page, None returns all remaining images.
+            cursor (str | None): The next_cursor of the previous page, None starts from the first image.
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param user: User: Get the user's comments on each image
-    :return: A list of dictionaries containing the image and a list of comments
+    :param limit: int | None: The maximum number of images to return
+    :param cursor: str | None: The opaque cursor of the previous page
+    :return: A list of dictionaries containing the image and a list of comments, and the cursor of the next page or None
     """
 
-    images = db.query(Image).order_by(Image.id).all()
+    query = select(Image).options(selectinload(Image.tags)).order_by(Image.id)
+    if cursor:
+        last_id, = decode_cursor(cursor, int)
+        query = query.filter(Image.id > last_id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    images = (await db.scalars(query)).all()
+
+    next_cursor = None
+    if limit is not None and len(images) > limit:
+        images = images[:limit]
+        next_cursor = encode_cursor(images[-1].id)
+
+    # One IN query for the comments of the whole page instead of one query per image
+    comments = defaultdict(list)
+    if images:
+        page_comments = await db.scalars(select(Comment).filter(Comment.image_id.in_([image.id for image in images]),
+                                                                Comment.user_id == user.id).order_by(Comment.id))
+        for comment in page_comments:
+            comments[comment.image_id].append(comment)
 
     user_response = []
     for image in images:
-        ratings = await get_average_rating(image.id, db)
-        comments = db.query(Comment).filter(Comment.image_id == image.id, Comment.user_id == user.id).all()
-        user_response.append({"image": image, "comments": comments, "ratings": ratings,})
-    return user_response
\ No newline at end of file
+        user_response.append({"image": image, "comments": comments[image.id], "ratings": average_rating(image)})
+    return user_response, next_cursor
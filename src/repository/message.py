@@ -1,10 +1,10 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User, Message
 
 
-async def send_message (receiver, sender, message, db:Session):
+async def send_message (receiver, sender, message, db: AsyncSession):
     """
     The send_message function takes in a receiver, sender, message and db.
     It then creates a new Message object with the text_message being the message passed in.
@@ -15,30 +15,31 @@ async def send_message (receiver, sender, message, db:Session):
     :param receiver: Specify the email of the user that will receive the message
     :param sender: Get the sender's email address
     :param message: Pass the message to be sent
-    :param db:Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The message object
     :doc-author: Trelent
     """
     message = Message(text_message=message,
                       reciever=receiver, sender=sender.email)
     db.add(message)
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
     return message
 
-async def read_messages (user, db:Session):
+async def read_messages (user, db: AsyncSession):
     """
     The read_messages function takes a user and a database session as arguments.
     It returns all messages in the database that were sent to or from the given user.
     
     :param user: Determine which messages to return
-    :param db:Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: All messages that the user has sent or recieved
     :doc-author: Trelent
     """
-    return db.query(Message).filter(or_(Message.sender == user.email, Message.reciever == user.email)).all()
+    messages = await db.scalars(select(Message).filter(or_(Message.sender == user.email, Message.reciever == user.email)))
+    return messages.all()
 
-async def delete_messages (message_id, user, db:Session):
+async def delete_messages (message_id, user, db: AsyncSession):
     """
     The delete_messages function deletes a message from the database.
         Args:
@@ -47,14 +48,14 @@ async def delete_messages (message_id, user, db:Session):
     
     :param message_id: Find the message in the database
     :param user: Check if the user is the reciever of a message
-    :param db:Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: A message, which is a string
     :doc-author: Trelent
     """
-    message = db.query(Message).filter(and_(Message.id == message_id, user.email == Message.reciever)).first()
+    message = await db.scalar(select(Message).filter(and_(Message.id == message_id, user.email == Message.reciever)))
     if message:
-        db.delete(message)
-        db.commit()
+        await db.delete(message)
+        await db.commit()
     else:
         message = f"Message with id: {message_id} does not exist"
     return message
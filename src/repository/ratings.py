@@ -1,152 +1,248 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Float, case, cast, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Rating, User, Image
+from src.database.models import Rating, User, Image, Tag, image_m2m_tag
 from src.schemas import RatingModel
+from src.services.search_cache import invalidate_image_searches
 from fastapi import HTTPException
 
 
-async def get_average_rating(image_id, db: Session):
+STAR_FIELDS = ("one_star", "two_stars", "three_stars", "four_stars", "five_stars")
+HISTOGRAM_FIELDS = ("one_star_count", "two_stars_count", "three_stars_count", "four_stars_count", "five_stars_count")
+
+# The average rating of an image computed by the database from its aggregate columns, 0 if it has no ratings
+AVERAGE_RATING = case((Image.rating_count > 0, cast(Image.rating_sum, Float) / Image.rating_count), else_=0.0)
+
+
+def rating_stars(body: RatingModel) -> int | None:
+    """
+    The rating_stars function converts the one_star ... five_stars flags of a request body into a number of stars.
+    If none of the flags is set, the rating is worth 0 stars. If more than one flag is set, the body is invalid.
+
+    :param body: RatingModel: The rating from the request
+    :return: The number of stars from 0 to 5, or None if more than one flag is set
+    """
+    flags = [stars for stars, field in enumerate(STAR_FIELDS, start=1) if getattr(body, field)]
+    if len(flags) > 1:
+        return None
+    return flags[0] if flags else 0
+
+
+async def _update_aggregates(db: AsyncSession, image_id: int, old_stars: int, new_stars: int, count_delta: int):
+    """
+    The _update_aggregates function shifts the denormalized rating columns of an image.
+    The change is issued as a single UPDATE with relative increments, so concurrent rating
+    writes do not overwrite each other, and it is committed together with the rating itself.
+
+    :param db: AsyncSession: Access the database
+    :param image_id: int: The image whose aggregates are changed
+    :param old_stars: int: Stars of the rating before the change (0 for a new rating)
+    :param new_stars: int: Stars of the rating after the change (0 for a removed rating)
+    :param count_delta: int: How the number of ratings changes (1, 0 or -1)
+    """
+    values = {"rating_sum": Image.rating_sum + new_stars - old_stars,
+              "rating_count": Image.rating_count + count_delta}
+    if old_stars != new_stars:
+        if old_stars:
+            field = HISTOGRAM_FIELDS[old_stars - 1]
+            values[field] = getattr(Image, field) - 1
+        if new_stars:
+            field = HISTOGRAM_FIELDS[new_stars - 1]
+            values[field] = getattr(Image, field) + 1
+    await db.execute(update(Image).where(Image.id == image_id).values(values))
+
+
+async def invalidate_rated_image(db: AsyncSession, image_id: int):
+    """
+    The invalidate_rated_image function drops the cached search pages sorted by rating that a new rating can reorder.
+
+    :param db: AsyncSession: Access the database
+    :param image_id: int: The rated image
+    :return: None
+    """
+    description = await db.scalar(select(Image.description).filter(Image.id == image_id))
+    tags = await db.scalars(select(Tag.name).join(image_m2m_tag, image_m2m_tag.c.tag_id == Tag.id)
+                            .filter(image_m2m_tag.c.image_id == image_id))
+    invalidate_image_searches(image_id, tags.all(), description, rating_only=True)
+
+
+def average_rating(image: Image) -> float:
+    """
+    The average_rating function computes the average rating of an already loaded image from its aggregate columns.
+    It does not touch the database.
+
+    :param image: Image: The image with its rating_sum and rating_count loaded
+    :return: The average rating, 0 if the image has no ratings
+    """
+    if not image.rating_count:
+        return 0
+    return image.rating_sum / image.rating_count
+
+
+async def get_average_rating(image_id, db: AsyncSession):
     """
     The get_average_rating function takes in an image_id and a database session.
-    It then queries the Rating table for all ratings associated with that image_id.
-    If there are no ratings, it returns 0 as the average rating. If there are ratings, 
-    it sums up all of the star values (one star = 1 point, two stars = 2 points etc.) 
-    and divides by the number of total ratings to get an average rating.
+    It reads the rating_sum and rating_count columns kept on the image by every rating write.
+    If there are no ratings, it returns 0 as the average rating.
 
     :param image_id: Find the ratings for a specific image
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The average rating of a given image
     """
-    image_ratings = db.query(Rating).filter(Rating.image_id == image_id).all()
-    if len(image_ratings) == 0:
+    aggregates = (await db.execute(select(Image.rating_sum, Image.rating_count).filter(Image.id == image_id))).first()
+    if not aggregates or not aggregates.rating_count:
         return 0
-    sum_user_rating = 0
-    for el in image_ratings:
-        if el.one_star:
-            sum_user_rating += 1
-        if el.two_stars:
-            sum_user_rating += 2
-        if el.three_stars:
-            sum_user_rating += 3
-        if el.four_stars:
-            sum_user_rating += 4
-        if el.five_stars:
-            sum_user_rating += 5
-    average_user_rating = sum_user_rating / len(image_ratings)
-
-    return average_user_rating
-
-async def get_rating(rating_id: int, db: Session) -> Rating:
+    return aggregates.rating_sum / aggregates.rating_count
+
+
+async def get_average_ratings(image_ids, db: AsyncSession) -> dict[int, float]:
+    """
+    The get_average_ratings function returns the average ratings of many images in one query.
+    Images without ratings (or missing from the database) get an average rating of 0.
+
+    :param image_ids: The ids of the images
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A dictionary that maps every image id to its average rating
+    """
+    averages = {image_id: 0 for image_id in image_ids}
+    if not averages:
+        return averages
+    rows = await db.execute(select(Image.id, Image.rating_sum, Image.rating_count).filter(Image.id.in_(averages)))
+    for row in rows:
+        if row.rating_count:
+            averages[row.id] = row.rating_sum / row.rating_count
+    return averages
+
+
+async def rebuild_rating_aggregates(db: AsyncSession) -> int:
+    """
+    The rebuild_rating_aggregates function recomputes the denormalized rating columns of every image
+    from the ratings table. It is used as a one-off backfill and to repair drifted aggregates.
+
+    :param db: AsyncSession: Access the database
+    :return: The number of images that have at least one rating
+    """
+    columns = [func.sum(case((Rating.stars == value, 1), else_=0)).label(field)
+               for value, field in enumerate(HISTOGRAM_FIELDS, start=1)]
+    totals = (await db.execute(select(Rating.image_id,
+                                      func.sum(Rating.stars).label("rating_sum"),
+                                      func.count(Rating.id).label("rating_count"),
+                                      *columns).filter(Rating.image_id.isnot(None)).group_by(Rating.image_id))).all()
+
+    await db.execute(update(Image).values({field: 0 for field in ("rating_sum", "rating_count") + HISTOGRAM_FIELDS}))
+    if totals:
+        await db.execute(update(Image), [{"id": row.image_id, "rating_sum": row.rating_sum, "rating_count": row.rating_count,
+                                    **{field: getattr(row, field) for field in HISTOGRAM_FIELDS}}
+                                   for row in totals])
+    await db.commit()
+    return len(totals)
+
+async def get_rating(rating_id: int, db: AsyncSession) -> Rating:
     """
     The get_rating function takes in a rating_id and a database session.
     It then queries the database for the rating with that id, and returns it.
 
     :param rating_id: int: Specify the id of the rating we want to get
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The rating object for the given id
     """
-    return db.query(Rating).filter(Rating.id == rating_id).first()
+    return await db.get(Rating, rating_id)
 
-def get_image(db: Session, image_id: int):
+async def get_image(db: AsyncSession, image_id: int):
     """
     The get_image function takes a database session and an image id as parameters.
     It then queries the database for the image with that id, and returns it if found.
     If not found, it raises an HTTPException.
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param image_id: int: Find the image in the database
     :return: A single image from the database
     """
-    image = db.query(Image).filter(Image.id == image_id).first()
+    image = await db.get(Image, image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     return image
 
-async def create_rating(image_id: int, body: RatingModel, user: User, db: Session) -> Rating:
+async def create_rating(image_id: int, body: RatingModel, user: User, db: AsyncSession) -> Rating:
     """
     The create_rating function takes in an image_id, a RatingModel object, and a user.
     It then checks if the image exists in the database. If it does not exist, it returns None.
     If the image does exist but is owned by the user who is trying to rate it, 
-    it also returns None because you cannot rate your own images. It then checks that only one of 
-    the five rating options has been selected (i.e., that sum_of_rates == 1). If this condition is not met, 
+    it also returns None because you cannot rate your own images. It then checks that exactly one of 
+    the five rating options has been selected. If this condition is not met, 
     it also returns None because you can only select one rating option per picture.
 
     :param image_id: int: Get the image from the database
     :param body: RatingModel: Get the rating from the user
     :param user: User: Get the user id of the current user
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A rating object
     """
-    image_in_database = get_image(db, image_id)
+    image_in_database = await get_image(db, image_id)
 
     if image_in_database.user_id == user.id:
         return None
-    sum_of_rates = 0
-
-    for el in body:
-        if el[1]:
-            sum_of_rates += 1
 
-    if sum_of_rates != 1:
+    stars = rating_stars(body)
+    if not stars:
         return None
-    rating_in_database = db.query(Rating).filter(Rating.image_id == image_id, 
-                                                 Rating.user_id == user.id).first()
+    rating_in_database = await db.scalar(select(Rating).filter(Rating.image_id == image_id, 
+                                                               Rating.user_id == user.id))
 
     if rating_in_database:
         return rating_in_database
     
-    rating = Rating(one_star=body.one_star, 
-                    two_stars=body.two_stars, 
-                    three_stars=body.three_stars,
-                    four_stars=body.four_stars, 
-                    five_stars=body.five_stars, 
-                    user_id=user.id, 
-                    image_id=image_id)
+    rating = Rating(stars=stars, user_id=user.id, image_id=image_id)
     db.add(rating)
-    db.commit()
-    db.refresh(rating)
+    await _update_aggregates(db, image_id, 0, stars, 1)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request has rated the image first, the unique (user_id, image_id) constraint keeps one row
+        await db.rollback()
+        return await db.scalar(select(Rating).filter(Rating.image_id == image_id, Rating.user_id == user.id))
+    await invalidate_rated_image(db, image_id)
+    await db.refresh(rating)
     return rating
 
-async def update_rating(rating_id: int, body: RatingModel, db: Session):
+async def update_rating(rating_id: int, body: RatingModel, db: AsyncSession):
     """
     The update_rating function takes in a rating_id and a body of type RatingModel.
-    It then checks to see if the sum of all the rates is greater than 1, if it is, it returns None.
-    If not, it queries for the rating with that id and updates its values to those in body.
+    It then checks that no more than one of the five rating options is set, if more are set, it returns None.
+    If not, it queries for the rating with that id and updates its stars to those in body.
 
     :param rating_id: int: Find the rating in the database
     :param body: RatingModel: Pass the data from the request to the function
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated rating
     """
-    sum_of_rates = 0
-    for el in body:
-        if el[1]:
-            sum_of_rates += 1
-    if sum_of_rates > 1:
+    stars = rating_stars(body)
+    if stars is None:
         return None
-    rating = db.query(Rating).filter(Rating.id == rating_id).first()
+    rating = await db.get(Rating, rating_id)
     if rating:
-        rating.one_star = body.one_star
-        rating.two_stars = body.two_stars
-        rating.three_stars = body.three_stars
-        rating.four_stars = body.four_stars
-        rating.five_stars = body.five_stars
-        db.commit()
+        await _update_aggregates(db, rating.image_id, rating.stars, stars, 0)
+        rating.stars = stars
+        await db.commit()
+        await invalidate_rated_image(db, rating.image_id)
     return rating
 
-async def remove_rating(rating_id: int, db: Session):
+async def remove_rating(rating_id: int, db: AsyncSession):
     """
     The remove_rating function removes a rating from the database.
         Args:
             rating_id (int): The id of the rating to be removed.
-            db (Session): A connection to the database.
+            db (AsyncSession): A connection to the database.
 
     :param rating_id: int: Identify the rating to be removed
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The rating that is deleted
     """
-    rating = db.query(Rating).filter(Rating.id == rating_id).first()
+    rating = await db.get(Rating, rating_id)
     if rating:
-        db.delete(rating)
-        db.commit()
+        await _update_aggregates(db, rating.image_id, rating.stars, 0, -1)
+        await db.delete(rating)
+        await db.commit()
+        await invalidate_rated_image(db, rating.image_id)
     return rating
\ No newline at end of file
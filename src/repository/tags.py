@@ -1,27 +1,135 @@
 from typing import List, Type
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.conf.config import settings
 from src.database.models import Tag
 from src.schemas import TagModel
+from src.services.cache import LRUCache
+from src.services.invalidation import bus
+from src.services.search_cache import invalidate_tag_searches
+from src.services.tag_suggest import tag_index
 
-async def create_tag(body: TagModel, db: Session) -> Tag:
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Tag name -> tag id, tags are few and hot and almost never change. Only read-only lookups use it:
+# another worker may have deleted or renamed a cached tag, a write must not link an image to its id.
+tag_cache = LRUCache(settings.tag_cache_size, settings.tag_cache_ttl, name="tag")
+TAG_CHANNEL = "tags"
+
+
+def drop_cached_tag(name: str | None):
+    """
+    The drop_cached_tag function removes a tag name from the tag cache of this worker, None empties the cache.
+
+    :param name: str | None: The name of the tag
+    :return: None
+    """
+    if name is None:
+        tag_cache.clear()
+    else:
+        tag_cache.pop(name)
+
+
+bus.subscribe(TAG_CHANNEL, drop_cached_tag)
+
+
+def invalidate_tag(name: str | None = None):
+    """
+    The invalidate_tag function tells every worker to drop a renamed or deleted tag from its tag cache.
+
+    :param name: str | None: The name of the tag, None drops every tag
+    :return: None
+    """
+    bus.publish(TAG_CHANNEL, name)
+
+
+async def get_tag_id(name: str, db: AsyncSession) -> int | None:
+    """
+    The get_tag_id function returns the id of the tag with the given name, from the tag cache when it is there.
+
+    :param name: str: The normalized tag name
+    :param db: AsyncSession: Access the database
+    :return: The id of the tag or None if there is no such tag
+    """
+    tag_id = tag_cache.get(name)
+    if tag_id is None:
+        tag_id = await db.scalar(select(Tag.id).filter(Tag.name == name))
+        if tag_id is not None:
+            tag_cache.set(name, tag_id)
+    return tag_id
+
+
+async def resolve_tags(names: List[str], db: AsyncSession) -> List[Tag]:
+    """
+    The resolve_tags function returns the tags with the given names, creating the missing ones.
+    The tags are inserted by a single INSERT ... ON CONFLICT DO NOTHING RETURNING, the tags that already existed
+    are read by one more SELECT (skipped when all of them are new). The tag cache is not trusted here,
+    a tag deleted by another worker would leave the image linked to a missing tag.
+    Nothing is committed, the new tags are saved together with the image they belong to.
+
+    :param names: List[str]: The normalized (lowercase, at most 25 characters) tag names
+    :param db: AsyncSession: Access the database
+    :return: The tags in the order of the names, without duplicates
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return []
+
+    insert = DIALECT_INSERTS[db.get_bind().dialect.name](Tag)
+    insert = insert.values([{"name": name} for name in names])
+    tags = {tag.name: tag for tag in
+            await db.scalars(insert.on_conflict_do_nothing(index_elements=[Tag.name]).returning(Tag))}
+
+    existing_names = [name for name in names if name not in tags]
+    if existing_names:
+        tags.update({tag.name: tag for tag in await db.scalars(select(Tag).filter(Tag.name.in_(existing_names)))})
+
+    # The existing tags were just read, they refresh the cache of the read-only lookups.
+    # The new tags are only cached once they are committed, an image insert that fails rolls them back
+    for name in existing_names:
+        tag_cache.set(name, tags[name].id)
+
+    return [tags[name] for name in names]
+
+
+async def change_usage(tag_ids, delta: int, db: AsyncSession):
+    """
+    The change_usage function adds delta to the usage count of the tags, in the transaction of the caller.
+    It must be called whenever image_m2m_tag rows are inserted or deleted.
+
+    :param tag_ids: The ids of the tags that were attached to or detached from an image
+    :param delta: int: 1 for attached tags, -1 for detached tags
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    tag_ids = list(tag_ids)
+    if tag_ids:
+        await db.execute(update(Tag).where(Tag.id.in_(tag_ids)).values(usage_count=Tag.usage_count + delta)
+                         .execution_options(synchronize_session=False))
+
+
+async def create_tag(body: TagModel, db: AsyncSession) -> Tag:
     """
     The create_tag function creates a new tag in the database.
 
     :param body: TagModel: Define the body of the request
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A tag object
     """
 
     tag = Tag(name=body.name.lower())
     db.add(tag)
-    db.commit()
-    db.refresh(tag)
+    await db.commit()
+    await db.refresh(tag)
+    tag_cache.set(tag.name, tag.id)
+    tag_index.add(tag.id, tag.name)
    
     return tag
 
-async def update_tag(tag_id: int, body: TagModel, db: Session) -> Tag | None:
+async def update_tag(tag_id: int, body: TagModel, db: AsyncSession) -> Tag | None:
     """
     The update_tag function updates a tag in the database.
         Args:
@@ -30,50 +138,86 @@ async def update_tag(tag_id: int, body: TagModel, db: Session) -> Tag | None:
 
     :param tag_id: int: Identify the tag to be deleted
     :param body: TagModel: Get the new name of the tag
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated tag or none if the tag does not exist
     """
 
-    tag = db.query(Tag).filter(Tag.id == tag_id).first()
+    tag = await db.get(Tag, tag_id)
     if tag:
-        new_tag_in_base = db.query(Tag).filter(Tag.name == body.name.lower()).first()
-        if new_tag_in_base:
+        if await get_tag_id(body.name.lower(), db) is not None:
             return None
+        old_name = tag.name
         tag.name = body.name.lower()
-        db.commit()
+        await db.commit()
+        invalidate_tag(old_name)
+        invalidate_tag_searches([old_name, tag.name])
+        tag_index.rename(old_name, tag.name)
 
     return tag
 
-async def delete_tag(tag_id: int, db: Session) -> Tag | None:
+async def delete_tag(tag_id: int, db: AsyncSession) -> Tag | None:
     """
     The delete_tag function deletes a tag from the database.
 
     :param tag_id: int: Specify the id of the tag to be deleted
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The deleted tag
     """
 
-    tag = db.query(Tag).filter(Tag.id == tag_id).first()
+    tag = await db.get(Tag, tag_id)
     if tag:
-        db.delete(tag)
-        db.commit()
+        await db.delete(tag)
+        await db.commit()
+        invalidate_tag(tag.name)
+        invalidate_tag_searches([tag.name])
+        tag_index.remove(tag.name)
 
     return tag
 
-async def get_tags(skip: int, limit: int, db: Session) -> List[Type[Tag]]:
+async def suggest_tags(prefix: str, limit: int, db: AsyncSession) -> List[dict]:
+    """
+    The suggest_tags function returns the most used tags whose names start with the prefix, for autocomplete.
+    The suggestions come from the in-memory tag index, the database is only read to load it.
+
+    :param prefix: str: The beginning of the tag name
+    :param limit: int: The number of suggestions
+    :param db: AsyncSession: Access the database
+    :return: The suggestions, each with the id, name and usage count of a tag
+    """
+    await tag_index.ensure_loaded(db)
+    return tag_index.suggest(prefix.strip().lower(), limit)
+
+async def get_popular_tags(limit: int, db: AsyncSession) -> List[Tag]:
+    """
+    The get_popular_tags function returns the most used tags, for tag clouds.
+    The query walks the (usage_count, id) index backwards and stops after limit rows.
+    The counts are changed by UPDATE statements, so tags already in the session are overwritten with the fresh rows.
+
+    :param limit: int: The number of tags
+    :param db: AsyncSession: Access the database
+    :return: The tags with at least one image, the most used first
+    """
+
+    tags = await db.scalars(select(Tag).filter(Tag.usage_count > 0)
+                            .order_by(Tag.usage_count.desc(), Tag.id.desc()).limit(limit)
+                            .execution_options(populate_existing=True))
+    return tags.all()
+
+async def get_tags(skip: int, limit: int, db: AsyncSession) -> List[Type[Tag]]:
     """
     The get_tags function returns a list of tags from the database.
 
     :param skip: int: Skip the first n tags
     :param limit: int: Limit the number of tags returned
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of tags
     """
 
-    return db.query(Tag).offset(skip).limit(limit).all()
+    tags = await db.scalars(select(Tag).offset(skip).limit(limit))
+    return tags.all()
 
-async def get_tag(tag_id: int, db: Session) -> Type[Tag] | None:
+async def get_tag(tag_id: int, db: AsyncSession) -> Type[Tag] | None:
     
-    return db.query(Tag).filter(Tag.id == tag_id).first()
+    return await db.get(Tag, tag_id)
 
 
@@ -0,0 +1,223 @@
+"""Module for the refresh token sessions of users and the revocation of tokens before they expire"""
+
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from src.conf.config import settings
+from src.database.models import RefreshToken, RevokedToken, User
+from src.services.bloom import BloomFilter
+from src.services.invalidation import bus
+from src.services.metrics import metrics
+
+# The jti of every revoked token that has not expired, as of the last reload of this worker, plus the tokens
+# revoked by this worker since then. A token missing from the filter is not revoked as far as this worker knows.
+revoked_filter = BloomFilter(settings.revoked_filter_capacity, settings.revoked_filter_error_rate)
+REVOKED_CHANNEL = "revoked_tokens"
+# The tokens revoked while the filter is being reloaded, the reload may have read the table before they were stored
+_revoked_during_reload = None
+metrics.register_gauge("revoked_filter_size", revoked_filter.__len__)
+metrics.register_gauge("revoked_filter_fill_ratio", revoked_filter.fill_ratio)
+
+
+def remember_revoked(jti: str | None):
+    """
+    The remember_revoked function adds a token revoked by this process to its filter.
+
+    :param jti: str | None: The jti of the revoked token
+    :return: None
+    """
+    if jti is not None:
+        revoked_filter.add(jti)
+        if _revoked_during_reload is not None:
+            _revoked_during_reload.add(jti)
+
+
+bus.subscribe(REVOKED_CHANNEL, remember_revoked)
+
+
+async def revoke_token(jti: str, user_id: int | None, expires_at: datetime, db: AsyncSession) -> None:
+    """
+    The revoke_token function stores the jti of a token that must no longer be accepted
+    and adds it to the filter of this worker. The invalidation bus does not leave the process:
+    other workers refuse the token only after their next reload of the filter from the table,
+    at most revoked_tokens_reload_interval seconds later.
+
+    :param jti: str: The jti claim of the token
+    :param user_id: int | None: The id of the owner of the token
+    :param expires_at: datetime: When the token expires, the row is kept until then
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    if await db.scalar(select(RevokedToken.id).filter(RevokedToken.jti == jti)) is None:
+        db.add(RevokedToken(jti=jti, user_id=user_id, expires_at=expires_at))
+        await db.commit()
+    bus.publish(REVOKED_CHANNEL, jti)
+
+
+async def is_token_revoked(jti: str, db: AsyncSession) -> bool:
+    """
+    The is_token_revoked function checks if a token was revoked.
+    The filter answers for almost every token without a query, the database is asked only when the filter
+    reports the jti, to tell a revoked token from a false positive.
+
+    :param jti: str: The jti claim of the token
+    :param db: AsyncSession: Access the database
+    :return: True if the token was revoked
+    :rtype: bool
+    """
+    if jti not in revoked_filter:
+        return False
+    revoked = await db.scalar(select(RevokedToken.id).filter(RevokedToken.jti == jti)) is not None
+    metrics.inc("revoked_filter_hits_total" if revoked else "revoked_filter_false_positives_total")
+    return revoked
+
+
+async def load_revoked_tokens(db: AsyncSession) -> int:
+    """
+    The load_revoked_tokens function deletes the revocations of expired tokens
+    and rebuilds the filter of this worker from the others. It runs at startup and then periodically,
+    which picks up the tokens revoked by other workers and empties the filter of expired tokens
+    before its false positive rate grows.
+
+    :param db: AsyncSession: Access the database
+    :return: The number of deleted revocations
+    :rtype: int
+    """
+    global _revoked_during_reload
+    _revoked_during_reload = set()
+    try:
+        result = await db.execute(delete(RevokedToken).filter(RevokedToken.expires_at <= datetime.utcnow())
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        revoked = (await db.scalars(select(RevokedToken.jti))).all()
+        # No await between clear and the adds, no request sees the filter half loaded
+        revoked_filter.clear()
+        for jti in [*revoked, *_revoked_during_reload]:
+            revoked_filter.add(jti)
+    finally:
+        _revoked_during_reload = None
+    return result.rowcount
+
+
+def hash_token(token: str) -> str:
+    """
+    The hash_token function returns the SHA-256 of a refresh token, the form in which it is stored and looked up.
+    Refresh tokens are random and signed, a fast unsalted hash is enough to make a leaked table useless.
+
+    :param token: str: The refresh token
+    :return: The hexadecimal digest
+    :rtype: str
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def create_refresh_session(user_id: int, token: str, device: str | None, expires_at: datetime,
+                                 db: AsyncSession) -> RefreshToken:
+    """
+    The create_refresh_session function stores the refresh token of a new login.
+    Every login is its own session, logging in on another device keeps the other sessions.
+
+    :param user_id: int: The id of the user who logged in
+    :param token: str: The refresh token
+    :param device: str | None: What the client told about itself, its User-Agent
+    :param expires_at: datetime: When the refresh token expires
+    :param db: AsyncSession: Access the database
+    :return: The new session
+    :rtype: RefreshToken
+    """
+    session = RefreshToken(token_hash=hash_token(token), user_id=user_id, device=device and device[:255],
+                           expires_at=expires_at)
+    db.add(session)
+    await db.commit()
+    return session
+
+
+async def get_refresh_session(token: str, db: AsyncSession) -> RefreshToken | None:
+    """
+    The get_refresh_session function finds the session of a refresh token and its user with one indexed lookup.
+
+    :param token: str: The refresh token
+    :param db: AsyncSession: Access the database
+    :return: The session with its user loaded, or None if the token is unknown or expired
+    :rtype: RefreshToken | None
+    """
+    return await db.scalar(select(RefreshToken).options(joinedload(RefreshToken.user))
+                           .filter(RefreshToken.token_hash == hash_token(token),
+                                   RefreshToken.expires_at > datetime.utcnow()))
+
+
+async def rotate_refresh_session(session: RefreshToken, token: str, expires_at: datetime, db: AsyncSession) -> bool:
+    """
+    The rotate_refresh_session function replaces the refresh token of a session by a new one.
+    The old token is replaced only if it is still the token of the session,
+    of two refreshes racing with the same token only one wins.
+
+    :param session: RefreshToken: The session found by get_refresh_session
+    :param token: str: The new refresh token
+    :param expires_at: datetime: When the new refresh token expires
+    :param db: AsyncSession: Access the database
+    :return: True if the session now holds the new token
+    :rtype: bool
+    """
+    result = await db.execute(update(RefreshToken)
+                              .filter(RefreshToken.id == session.id, RefreshToken.token_hash == session.token_hash)
+                              .values(token_hash=hash_token(token), expires_at=expires_at,
+                                      last_used_at=datetime.utcnow()))
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def delete_refresh_session(session_id: int, user_id: int, db: AsyncSession) -> None:
+    """
+    The delete_refresh_session function ends a session of a user, its refresh token can no longer be used.
+
+    :param session_id: int: The id of the session
+    :param user_id: int: The id of the user, a session of another user is not touched
+    :param db: AsyncSession: Access the database
+    :return: None
+    """
+    await db.execute(delete(RefreshToken).filter(RefreshToken.id == session_id, RefreshToken.user_id == user_id)
+                     .execution_options(synchronize_session=False))
+    await db.commit()
+
+
+async def delete_user_refresh_sessions(email: str, db: AsyncSession) -> int:
+    """
+    The delete_user_refresh_sessions function ends every session of a user.
+
+    :param email: str: The email of the user
+    :param db: AsyncSession: Access the database
+    :return: The number of ended sessions
+    :rtype: int
+    """
+    user_id = select(User.id).filter(User.email == email).scalar_subquery()
+    result = await db.execute(delete(RefreshToken).filter(RefreshToken.user_id == user_id)
+                              .execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount
+
+
+async def delete_expired_refresh_sessions(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    The delete_expired_refresh_sessions function deletes the sessions whose refresh token has expired.
+    Rows are deleted batch_size at a time, each batch in its own transaction, so a large backlog
+    never holds locks on the table for long.
+
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: How many rows one statement deletes at most
+    :return: The number of deleted sessions
+    :rtype: int
+    """
+    deleted = 0
+    while True:
+        expired = select(RefreshToken.id).filter(RefreshToken.expires_at <= datetime.utcnow()).limit(batch_size)
+        result = await db.execute(delete(RefreshToken).filter(RefreshToken.id.in_(expired))
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
@@ -1,26 +1,28 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.database.models import User
 from src.database.models import ImageSettings, Image, User
 from fastapi import HTTPException, status
 from src.services.photo_services import create_qrcode, createImageTag, getAssetInfo, uploadImage
+from src.services.executors import cloudinary_executor
 import qrcode
 import os
 
 
 
-async def get_transformed_url(db: Session, id: int, user: User):
+async def get_transformed_url(db: AsyncSession, id: int, user: User):
     """
     The get_transformated_url function returns a transformated url by id
 
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param id: int: Get the id of the image settings that we want to update
     :param user: User: Get the user id from the user object
     :return: A transformated_url object
     :doc-author: Trelent
     """
 
-    transformed_url = db.query(ImageSettings).filter(
-        ImageSettings.id == id, ImageSettings.user_id == user.id).first()
+    transformed_url = await db.scalar(select(ImageSettings).filter(
+        ImageSettings.id == id, ImageSettings.user_id == user.id))
 
     if not transformed_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -29,7 +31,7 @@ async def get_transformed_url(db: Session, id: int, user: User):
         return transformed_url.transformed_url
 
 
-async def get_transformed_qrcode(db: Session, qrcode_url_id: int, current_user: User):
+async def get_transformed_qrcode(db: AsyncSession, qrcode_url_id: int, current_user: User):
     """
     The get_transformed_qrcode function returns a transformed qrcode image based on the user's input.
         The function takes in two parameters:
@@ -37,14 +39,14 @@ async def get_transformed_qrcode(db: Session, qrcode_url_id: int, current_user:
             - qrcode_url_id: An integer representing the id of an ImageSettings object in our database
             - current_user: A User object representing who is currently logged into our application
 
-    :param db:Session: Access the database
+    :param db: AsyncSession: Access the database
     :param qrcode_url_id: int: Get the qrcode url from the database
     :param current_user: User: Get the user id from the database
     :return: A single row from the database
     :doc-author: Trelent
     """
-    qrcode_url = db.query(ImageSettings).filter(
-        ImageSettings.id == qrcode_url_id, ImageSettings.user_id == current_user.id).first()
+    qrcode_url = await db.scalar(select(ImageSettings).filter(
+        ImageSettings.id == qrcode_url_id, ImageSettings.user_id == current_user.id))
 
     if not qrcode_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -53,26 +55,26 @@ async def get_transformed_qrcode(db: Session, qrcode_url_id: int, current_user:
         return qrcode_url
 
 
-async def create_transformed_photo_url(body: ImageSettings, db: Session, current_user: User):
+async def create_transformed_photo_url(body: ImageSettings, db: AsyncSession, current_user: User):
     """
     The create_transformed_photo_url function creates a transformed photo url and adds it to the database.
         Args:
             body (ImageSettings): The image settings that will be used to create the transformed photo url.
-            db (Session): The database session object.
+            db (AsyncSession): The database session object.
             current_user (User): The user who is currently logged in and making this request. 
         Returns: 
             ImageSettings: An ImageSettings object containing all of the information about an image, including its secure URL, transformation URL, QR code URL, etc.
 
     :param body:ImageSettings: Get the image_id, radius, effect, width and height parameters from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :param current_user: User: Get the user_id of the current user
     :return: The image_settings object
     :doc-author: Trelent
     """
 
     # Get the image url from the database (table Image)
-    result = db.query(Image).filter(Image.id == body.image_id,
-                                    Image.user_id == current_user.id).first()
+    result = await db.scalar(select(Image).filter(Image.id == body.image_id,
+                                                  Image.user_id == current_user.id))
     image_url = result.url
     print(f'image_url from Image:', image_url)
     public_name = result.public_name
@@ -83,13 +85,13 @@ async def create_transformed_photo_url(body: ImageSettings, db: Session, current
                             detail=f"Image with id {body.image_id} not found")
     else:
         # Build the URL for the image
-        secure_url = uploadImage(image_url, public_name)
+        secure_url = await cloudinary_executor.run(uploadImage, image_url, public_name)
         # Get the image info
-        getAssetInfo(public_name)
+        await cloudinary_executor.run(getAssetInfo, public_name)
 
         # Create the transformed image url
-        transformation_url = createImageTag(
-            public_name, transformation=body.transformation)
+        transformation_url = await cloudinary_executor.run(
+            createImageTag, public_name, transformation=body.transformation)
         print(f'transformation_url:', transformation_url)
 
         folder_name = "bayraktarogram"
@@ -118,6 +120,6 @@ async def create_transformed_photo_url(body: ImageSettings, db: Session, current
                                              user_id=current_user.id)
         # Add the transformed image urls to the database
         db.add(transformatiom_image)
-        db.commit()
-        db.refresh(transformatiom_image)
+        await db.commit()
+        await db.refresh(transformatiom_image)
         return transformatiom_image
\ No newline at end of file
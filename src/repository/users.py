@@ -1,13 +1,60 @@
 """Module for user's direct operations getting, creating, authorization and authentication"""
 
+from typing import NamedTuple
+
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.conf.config import settings
 from src.database.models import User, Image
 from src.schemas import UserModel, Role
+from src.services.cache import LRUCache
+from src.services.invalidation import bus
+
+
+class UserPrincipal(NamedTuple):
+    """Who made an authenticated request, what get_current_user returns instead of the User row"""
+    id: int
+    email: str
+    roles: Role
+    access: bool
+    confirmed: bool
+
 
+# Email -> principal of the user, read by every authenticated request.
+# It holds no password hash or profile data, the routes that change or return a user load the row.
+user_cache = LRUCache(settings.user_cache_size, settings.user_cache_ttl, name="user")
+USER_CHANNEL = "users"
 
-async def get_user_by_email(email: str, db: Session) -> User:
+
+def drop_cached_user(email: str | None):
+    """
+    The drop_cached_user function removes a user from the user cache of this worker, None empties the cache.
+
+    :param email: str | None: The email of the user
+    :return: None
+    """
+    if email is None:
+        user_cache.clear()
+    else:
+        user_cache.pop(email)
+
+
+bus.subscribe(USER_CHANNEL, drop_cached_user)
+
+
+def invalidate_user(email: str | None = None):
+    """
+    The invalidate_user function tells every worker to drop a changed user from its user cache.
+
+    :param email: str | None: The email of the user, None drops every user
+    :return: None
+    """
+    bus.publish(USER_CHANNEL, email)
+
+
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
     """
     The get_user_by_email function takes in an email and a database session, then returns the user with that email.
     
@@ -15,15 +62,36 @@ async def get_user_by_email(email: str, db: Session) -> User:
     :param email: Pass the email address of the user to be retrieved
     :type email: str
     :param db: Pass the database session to the function
-    :type db: Session
+    :type db: AsyncSession
     :return: User with given email
     :rtype: User
     """
-    return db.query(User).filter(User.email == email).first()
-
+    return await db.scalar(select(User).filter(User.email == email))
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def get_user_principal(email: str, db: AsyncSession) -> UserPrincipal | None:
+    """
+    The get_user_principal function returns who the user with the given email is and what they may do,
+    from the user cache when it is there. The principal is read-only and not attached to the session.
+    Every change of a user must call invalidate_user, the cache ttl only bounds the staleness of a missed call.
+
+    :param email: str: The email of the user
+    :param db: AsyncSession: Access the database
+    :return: The principal of the user, or None if there is no such user
+    :rtype: UserPrincipal | None
+    """
+    principal = user_cache.get(email)
+    if principal is None:
+        row = (await db.execute(select(User.id, User.email, User.roles, User.access, User.confirmed)
+                                .filter(User.email == email))).first()
+        if row is None:
+            return None
+        principal = UserPrincipal(*row)
+        user_cache.set(email, principal)
+    return principal
+
+
+async def create_user(body: UserModel, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
 
@@ -31,11 +99,11 @@ async def create_user(body: UserModel, db: Session) -> User:
     :param body: Create a new user
     :type body: UserModel
     :param db: Access the database
-    :type db: Session
+    :type db: AsyncSession
     :return: New user
     :rtype: User
     """
-    db_is_empty = db.query(User).first()
+    db_is_empty = await db.scalar(select(User).limit(1))
     avatar = None
     try:
         g = Gravatar(body.email)
@@ -47,28 +115,29 @@ async def create_user(body: UserModel, db: Session) -> User:
     else:
         new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_password(user: User, password_hash: str, db: AsyncSession) -> None:
     """
-    The update_token function updates the refresh token for a user.
-    
-    :param user: Identify the user that is being updated
+    The update_password function stores a new password hash of a user.
+
+    :param user: The user whose password changes
     :type user: User
-    :param token: Set the refresh token for a user
-    :Type token: str | None
+    :param password_hash: The new hash of the password
+    :type password_hash: str
     :param db: Commit the changes to the database
-    :type db: Session
+    :type db: AsyncSession
     :return: None
     """
-    user.refresh_token = token
-    db.commit()
+    user.password = password_hash
+    await db.commit()
+    invalidate_user(user.email)
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
     """
     The confirmed_email function sets the confirmed field of a user to True.
     
@@ -76,15 +145,16 @@ async def confirmed_email(email: str, db: Session) -> None:
     :param email: Get the email address of the user
     :type email: str
     :param db: Pass the database session into the function
-    :type db: Session
+    :type db: AsyncSession
     :return: None
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db.commit()
+    invalidate_user(email)
 
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession) -> User:
     """
     The update_avatar function updates the avatar of a user.
     
@@ -94,13 +164,14 @@ async def update_avatar(email, url: str, db: Session) -> User:
     :param url: Specify the type of data that is being passed in
     :type url: str
     :param db: Pass the database session to the function
-    :type db: Session
+    :type db: AsyncSession
     :return: User with given email
     :rtype: User
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await db.commit()
+    invalidate_user(email)
     return user
 
 
@@ -110,7 +181,7 @@ async def update_profile(body, current_user, db):
         Args:
             body (dict): A dictionary containing the new bio and location for the current user.
             current_user (User): The currently logged in User object.
-            db (SessionLocal): An SQLAlchemy SessionLocal object that allows us to query our database.
+            db (AsyncSession): An SQLAlchemy AsyncSession object that allows us to query our database.
     
     :param body: Get the data from the request body
     :param current_user: Get the user that is currently logged in
@@ -120,7 +191,8 @@ async def update_profile(body, current_user, db):
     """
     current_user.bio = body.bio
     current_user.location = body.location
-    db.commit()
+    await db.commit()
+    invalidate_user(current_user.email)
     return(current_user)
 
 async def get_user_info(email, db):
@@ -134,7 +206,7 @@ async def get_user_info(email, db):
     :return: A user object
     :doc-author: Trelent
     """
-    return db.query(User).filter(User.username == email).first()
+    return await db.scalar(select(User).filter(User.username == email))
     
 
 
@@ -1,14 +1,17 @@
 """Module for authorization and authentication operations"""
 
+from datetime import datetime
 from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
+from src.repository import tokens as repository_tokens
 from src.repository import users as repository_users
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
 from src.services.email import send_email
 
@@ -18,7 +21,7 @@ security = HTTPBearer()
 
 @router.post('/request_email')
 async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their email address. The function takes in a RequestEmail object, which contains the
@@ -32,7 +35,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     :param request: Get the base url of the application
     :type request: Request
     :param db: Get the database session from the dependency injection
-    :type db: Session
+    :type db: AsyncSession
     :return: A dictionary with a message key
     :rtype: str
     """
@@ -47,7 +50,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
 
@@ -59,7 +62,7 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     :param request: Get the base_url of the application
     :type request: Request
     :param db: Get the database session
-    :type db: Session
+    :type db: AsyncSession
     :return: A dictionary with the user and a string
     :rtype: dict
     """
@@ -67,7 +70,7 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
     background_tasks.add_task(
         send_email, new_user.email, new_user.username, request.base_url)
@@ -75,14 +78,17 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
+    Every login opens its own refresh token session, the sessions on other devices are kept.
     
+    :param request: Get the User-Agent of the client, stored as the device of the session
+    :type request: Request
     :param body: Get the username and password from the request body
     :type body: OAuth2PasswordRequestForm
     :param db: Get a database session
-    :type db: Session
+    :type db: AsyncSession
     :return: A dict with access token, refresh token and token type
     :rtype: dict
     """
@@ -93,47 +99,85 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     if not user.confirmed:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.verify_and_update(body.password, user.password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash is not None:
+        # The hash was made with another work factor than the configured one
+        await repository_users.update_password(user, new_hash, db)
     if user.access is False:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="You was banned")
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
     refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    session = await repository_tokens.create_refresh_session(user.id, refresh_token, request.headers.get("user-agent"),
+                                                             auth_service.get_token_expiry(refresh_token), db)
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "sid": session.id})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post("/logout")
+async def logout(token: str = Depends(auth_service.oauth2_scheme),
+                 current_user: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    The logout function revokes the access token of the request and ends the refresh token session it was issued for,
+    neither can be used again. The other sessions of the user are kept.
+
+    :param token: Get the access token from the request header
+    :type token: str
+    :param current_user: Get the user the token belongs to
+    :type current_user: UserPrincipal
+    :param db: Get a database session
+    :type db: AsyncSession
+    :return: A dictionary with a message key
+    :rtype: dict
+    """
+    payload = auth_service.decode_token(token)
+    if payload.get("jti"):
+        await repository_tokens.revoke_token(payload["jti"], current_user.id,
+                                             datetime.utcfromtimestamp(payload["exp"]), db)
+    if payload.get("sid"):
+        await repository_tokens.delete_refresh_session(payload["sid"], current_user.id, db)
+    return {"message": "Logged out"}
+
+
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
+    The session of the refresh token is found with one indexed lookup and gets a new refresh token,
+    a refresh token that was already replaced ends every session of the user, it may have been stolen.
     
     :param credentials: Get the token from the request header
     :type credentials: HTTPAuthorizationCredentials
     :param db: Pass the database connection to the function
-    :type db: Session
+    :type db: AsyncSession
     :return: A dictionary with access_token, refresh_token and token_type
     :rtype: dict
     """
     token = credentials.credentials
     email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    session = await repository_tokens.get_refresh_session(token, db)
+    if session is None or session.user.email != email:
+        await repository_tokens.delete_user_refresh_sessions(email, db)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    if session.user.access is False:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="You was banned")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
     refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    if not await repository_tokens.rotate_refresh_session(session, refresh_token,
+                                                          auth_service.get_token_expiry(refresh_token), db):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": session.id})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
 
@@ -141,7 +185,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     :param token: Get the token from the url
     :type token: str
     :param db: Get the database session
-    :type db: Session
+    :type db: AsyncSession
     :return: A message
     :rtype: str
     """
@@ -1,12 +1,14 @@
 from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.schemas import CommentModel, CommentResponse, CommentUpdateModel
 from src.repository import comments as repository_comments
-from src.database.models import Comment, User, Image
+from src.repository.users import UserPrincipal
+from src.database.models import Comment, Image
 from src.services.auth import auth_service
 
 from src.services.roles import allowed_operation_mod_and_admin, allowed_operation_everyone
@@ -16,7 +18,7 @@ router = APIRouter(prefix='/comments', tags=["comments"])
 
 
 @router.get("_to_photo/{photo_id}", response_model=List[CommentResponse], dependencies=[Depends(allowed_operation_everyone)])
-async def get_comments(photo_id: int, db: Session = Depends(get_db)):
+async def get_comments(photo_id: int, db: AsyncSession = Depends(get_read_db)):
     """
        Retrieves a list of comments for a specific photo with specified pagination parameters.
 
@@ -24,7 +26,7 @@ async def get_comments(photo_id: int, db: Session = Depends(get_db)):
        :param db: The database session.
        :return: A list of comments.
        """
-    image = db.query(Image).filter(Image.id == photo_id).first()
+    image = await db.scalar(select(Image).filter(Image.id == photo_id))
     if image is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Photo not found")
     return await repository_comments.get_comments(photo_id, db)
@@ -32,7 +34,7 @@ async def get_comments(photo_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("_by_id/{comment_id}", response_model=CommentResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def get_comment(comment_id: int, db: Session = Depends(get_db)):
+async def get_comment(comment_id: int, db: AsyncSession = Depends(get_read_db)):
     """
      Retrieves a single comment with the specified ID.
      :param comment_id: The ID of the comment to retrieve.
@@ -47,8 +49,8 @@ async def get_comment(comment_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/add", response_model=CommentResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def create_comment(body: CommentModel, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def create_comment(body: CommentModel, db: AsyncSession = Depends(get_db),
+                    current_user: UserPrincipal = Depends(auth_service.get_current_user)):
 
     """
     Creates a new comment for a specific photo.
@@ -64,8 +66,8 @@ async def create_comment(body: CommentModel, db: Session = Depends(get_db),
 
 
 @router.put("/update/{comment_id}", response_model=CommentResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def update_comment(body: CommentUpdateModel, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def update_comment(body: CommentUpdateModel, db: AsyncSession = Depends(get_db),
+                    current_user: UserPrincipal = Depends(auth_service.get_current_user)):
 
     """
     Updates a single comment with the specified ID created by the specific user.
@@ -85,8 +87,8 @@ async def update_comment(body: CommentUpdateModel, db: Session = Depends(get_db)
 
 @router.delete("/delete/{comment_id}", response_model=CommentResponse,
                dependencies=[Depends(allowed_operation_mod_and_admin)])
-async def remove_comment(comment_id: int, current_user: User = Depends(auth_service.get_current_user),
-                         db: Session = Depends(get_db)):
+async def remove_comment(comment_id: int, current_user: UserPrincipal = Depends(auth_service.get_current_user),
+                         db: AsyncSession = Depends(get_db)):
     """
     Removes a single comment with the specified ID. Can be removed only by admin or moderator.
 
@@ -1,57 +1,130 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, status, UploadFile, File, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 import cloudinary
 import cloudinary.uploader
 from sqlalchemy import func
 from enum import Enum
 
 from src.repository import find as repository_find
-from src.database.db import get_db
-from src.database.models import User, Image
+from src.database.db import get_read_db
+from src.database.models import Image
 from src.repository import users as repository_users
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
-from src.schemas import UserDb, UpdateUser, Profile, SortField
+from src.schemas import UserDb, UpdateUser, Profile, SortField, KeyWordsSortField, SearchMode
 from src.conf.config import settings
 from src.services.roles import allowed_operation_admin
 from typing import Optional
 
 router = APIRouter(prefix="/find", tags=["find"])
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 
 @router.get("/find/tag")
-async def get_photo_by_tag(tag: str, _: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db), sort_by: SortField = Query(SortField.date, description="Sort by field (date or rating)")):
+async def get_photo_by_tag(tag: str, response: Response, _: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_read_db), sort_by: SortField = Query(SortField.date, description="Sort by field (date or rating)"),
+                           limit: int = Query(20, ge=1, le=100), cursor: str | None = None,
+                           facets: bool = Query(False, description="Also return the tag and rating band counts of all the results"),
+                           facet_limit: int = Query(10, ge=1, le=50, description="How many co-occurring tags are counted")):
     """
-    The get_photo_by_tag function returns a list of photos that have the specified tag.
+    The get_photo_by_tag function returns a page of photos that have the specified tag.
         The function takes in a string representing the tag and an optional sort_by parameter, which defaults to SortField.date if not provided.
+        The cursor of the next page is sent in the X-Next-Cursor header, the header is missing on the last page.
+        With facets the photos come in the images field, next to the facets field with the counts of all the results.
     
     :param tag: str: Specify the tag that we want to search for
-    :param _: User: Get the current user, but it is not used in the function
-    :param db: Session: Pass the database session to the function
+    :param response: Response: Set the header with the cursor of the next page
+    :param _: UserPrincipal: Get the current user, but it is not used in the function
+    :param db: AsyncSession: Pass the database session to the function
     :param sort_by: SortField: Sort the images by date or rating
+    :param limit: int: The maximum number of photos on the page
+    :param cursor: str: The X-Next-Cursor of the previous page, omit it to get the first page
+    :param facets: bool: Return the counts of the co-occurring tags and the rating bands
+    :param facet_limit: int: How many co-occurring tags are counted
     :param description: Provide a description for the parameter
     :return: A list of photos that have a particular tag
     :doc-author: Trelent
     """
-    image = await repository_find.get_photo_by_tag(tag, db, sort_by)
+    image, next_cursor = await repository_find.get_photo_by_tag(tag, db, sort_by, limit, cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if facets:
+        return {"images": image, "facets": await repository_find.get_tag_facets(tag, db, facet_limit)}
     return image
 
 
 @router.get("/find/words")
-async def get_photo_by_key_words(words: str, _: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db), sort_by: SortField = Query(SortField.date, description="Sort by field (date or rating)")):
+async def get_photo_by_key_words(words: str, response: Response, _: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_read_db), sort_by: KeyWordsSortField = Query(KeyWordsSortField.date, description="Sort by field (date, rating or relevance)"),
+                                 mode: SearchMode = Query(SearchMode.substring, description="Match the words as a substring or with the full-text index"),
+                                 limit: int = Query(20, ge=1, le=100), cursor: str | None = None,
+                                 facets: bool = Query(False, description="Also return the tag and rating band counts of all the results"),
+                                 facet_limit: int = Query(10, ge=1, le=50, description="How many co-occurring tags are counted")):
     """
     The get_photo_by_key_words function returns a list of photos that match the key words provided by the user.
         The function takes in two parameters:
             -words: A string containing one or more key words separated by spaces.
-            -sort_by: An enum value indicating how to sort the results (date or rating).
+            -sort_by: An enum value indicating how to sort the results (date, rating or relevance).
+            -mode: substring matches the words literally, fulltext finds descriptions containing every word through the full-text index.
+            -limit and cursor: The size of the page and the X-Next-Cursor header of the previous page.
+            -facets: Return the photos in the images field and the tag and rating band counts of all the results in the facets field.
     
     :param words: str: Search for the photo by keywords
-    :param _: User: Get the current user
-    :param db: Session: Get the database session from the dependency injection container
-    :param sort_by: SortField: Sort the results by date or rating
+    :param response: Response: Set the header with the cursor of the next page
+    :param _: UserPrincipal: Get the current user
+    :param db: AsyncSession: Get the database session from the dependency injection container
+    :param sort_by: KeyWordsSortField: Sort the results by date, rating or relevance
+    :param mode: SearchMode: Match the words as a substring or with the full-text index
+    :param limit: int: The maximum number of photos on the page
+    :param cursor: str: The X-Next-Cursor of the previous page, omit it to get the first page
+    :param facets: bool: Return the counts of the co-occurring tags and the rating bands
+    :param facet_limit: int: How many co-occurring tags are counted
     :param description: Describe the parameter in the swagger documentation
     :return: The image that has the words in its title or description
     :doc-author: Trelent
     """
-    image = await repository_find.get_photo_by_key_words(words, db, sort_by)
+    image, next_cursor = await repository_find.get_photo_by_key_words(words, db, sort_by, mode, limit, cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if facets:
+        return {"images": image, "facets": await repository_find.get_key_words_facets(words, db, mode, facet_limit)}
+    return image
+
+
+@router.get("/tags")
+async def get_photo_by_tags(response: Response, all_tags: str | None = Query(None, alias="all", description="Comma separated tags every photo must have"),
+                            any_tags: str | None = Query(None, alias="any", description="Comma separated tags of which every photo must have one"),
+                            none_tags: str | None = Query(None, alias="none", description="Comma separated tags no photo may have"),
+                            _: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_read_db),
+                            sort_by: SortField = Query(SortField.date, description="Sort by field (date or rating)"),
+                            limit: int = Query(20, ge=1, le=100), cursor: str | None = None,
+                            facets: bool = Query(False, description="Also return the tag and rating band counts of all the results"),
+                            facet_limit: int = Query(10, ge=1, le=50, description="How many co-occurring tags are counted")):
+    """
+    The get_photo_by_tags function returns a page of photos filtered by several tags at once.
+        A photo is returned when it has every tag of all, at least one tag of any and no tag of none,
+        for example /api/find/tags?all=sea,sun&none=night. At least one of all and any must be given.
+        The cursor of the next page is sent in the X-Next-Cursor header, the header is missing on the last page.
+        With facets the photos come in the images field, next to the facets field with the counts of all the results.
+
+    :param response: Response: Set the header with the cursor of the next page
+    :param all_tags: str: The tags every photo must have
+    :param any_tags: str: The tags of which every photo must have one
+    :param none_tags: str: The tags no photo may have
+    :param _: UserPrincipal: Get the current user, but it is not used in the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param sort_by: SortField: Sort the images by date or rating
+    :param limit: int: The maximum number of photos on the page
+    :param cursor: str: The X-Next-Cursor of the previous page, omit it to get the first page
+    :param facets: bool: Return the counts of the co-occurring tags and the rating bands
+    :param facet_limit: int: How many co-occurring tags are counted
+    :return: A list of photos that match the tags
+    :doc-author: Trelent
+    """
+    tags = [repository_find.split_tag_names(names) for names in (all_tags, any_tags, none_tags)]
+    image, next_cursor = await repository_find.get_photo_by_tags(*tags, db, sort_by, limit, cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if facets:
+        return {"images": image, "facets": await repository_find.get_tags_facets(*tags, db, facet_limit)}
     return image
@@ -1,27 +1,43 @@
 import os
 from dotenv import load_dotenv, find_dotenv
 
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import cloudinary
-import cloudinary.uploader
 
-from src.database.db import get_db
-from src.database.models import User, Image
+from src.database.db import get_db, get_read_db
 from src.services.auth import auth_service
+from src.services.upload_jobs import upload_jobs, UploadJob, spool_upload
 from src.services.roles import  allowed_operation_everyone
 from src.repository import images
+from src.repository import users as repository_users
 from src.repository.images import normalize_tags
-from src.schemas import ImageAddResponse, ImageUpdateModel, ImageAddModel, ImageAddTagResponse, ImageAddTagModel, ImageGetResponse, ImageDeleteResponse, ImageUpdateDescrResponse, ImageGetAllResponse
+from src.repository.users import UserPrincipal
+from src.schemas import ImageAddResponse, ImageUpdateModel, ImageAddModel, ImageAddTagResponse, ImageAddTagModel, ImageGetResponse, ImageDeleteResponse, ImageUpdateDescrResponse, ImageGetAllResponse, UploadJobResponse
 
 load_dotenv(find_dotenv())
 
 router = APIRouter(prefix='/images', tags=["images"])
 
+
+def configure_cloudinary():
+    """
+    The configure_cloudinary function sets the Cloudinary credentials from the .env file.
+
+    :return: None
+    """
+    cloudinary.config(
+            cloud_name=os.environ.get('CLOUDINARY_NAME'),
+            api_key=os.environ.get('CLOUDINARY_API_KEY'),
+            api_secret=os.environ.get('CLOUDINARY_API_SECRET'),
+            secure=True
+        )
+
+
 @router.get("/image_id/{id}", response_model=ImageGetResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def get_image(id: int, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def get_image(id: int, db: AsyncSession = Depends(get_read_db),
+                    current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The get_image function returns a JSON object containing the image and comments.
     The image is returned as an ImageAddResponse object, which contains the following fields:
@@ -31,8 +47,8 @@ async def get_image(id: int, db: Session = Depends(get_db),
     tags ([str]): A list of
     
     :param id: int: Specify the id of the image to be retrieved
-    :param db: Session: Pass the database session to the function
-    :param current_user: User: Get the current user's information
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: UserPrincipal: Get the current user's information
     :return: A dictionary with the image and comments
     """
     
@@ -43,8 +59,8 @@ async def get_image(id: int, db: Session = Depends(get_db),
 
 @router.put("/update_description/{image_id}", response_model=ImageUpdateDescrResponse, 
             dependencies=[Depends(allowed_operation_everyone)])
-async def update_description(image_id: int, image_info: ImageUpdateModel, db: Session = Depends(get_db),
-                             current_user: User = Depends(auth_service.get_current_user)):
+async def update_description(image_id: int, image_info: ImageUpdateModel, db: AsyncSession = Depends(get_db),
+                             current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The update_description function updates the description of an image.
         Args:
@@ -53,8 +69,8 @@ async def update_description(image_id: int, image_info: ImageUpdateModel, db: Se
     
     :param image_id: int: Identify the image to be updated
     :param image_info: ImageUpdateModel: Get the image_id and description
-    :param db: Session: Access the database
-    :param current_user: User: Get the current user from the database
+    :param db: AsyncSession: Access the database
+    :param current_user: UserPrincipal: Get the current user from the database
     :return: A dictionary with the id, description and detail of the image
     """
     
@@ -63,8 +79,8 @@ async def update_description(image_id: int, image_info: ImageUpdateModel, db: Se
 
 
 @router.put("/update_tags/{image_id}", response_model=ImageAddTagResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def add_tag(image_id, body: ImageAddTagModel = Depends(), db: Session = Depends(get_db),
-                  current_user: User = Depends(auth_service.get_current_user)):
+async def add_tag(image_id: int, body: ImageAddTagModel = Depends(), db: AsyncSession = Depends(get_db),
+                  current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The add_tag function adds a tag to an image.
         The function takes in the following parameters:
@@ -74,8 +90,8 @@ async def add_tag(image_id, body: ImageAddTagModel = Depends(), db: Session = De
     
     :param image_id: Identify the image to be updated
     :param body: ImageAddTagModel: Get the tag from the request body
-    :param db: Session: Get the database session
-    :param current_user: User: Get the current user
+    :param db: AsyncSession: Get the database session
+    :param current_user: UserPrincipal: Get the current user
     :return: The image id, the tags and a detail message
     """
     
@@ -84,16 +100,16 @@ async def add_tag(image_id, body: ImageAddTagModel = Depends(), db: Session = De
 
 
 @router.delete("/{id}", response_model=ImageDeleteResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def delete_image(id: int, db: Session = Depends(get_db),
-                       current_user: User = Depends(auth_service.get_current_user)):
+async def delete_image(id: int, db: AsyncSession = Depends(get_db),
+                       current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The delete_image function deletes an image from the database.
         The function takes in a user_id and an image_id, and returns a dictionary with the deleted image's information.
     
     
     :param id: int: Specify the id of the image to be deleted
-    :param db: Session: Pass the database connection to the function
-    :param current_user: User: Get the current user from the auth_service
+    :param db: AsyncSession: Pass the database connection to the function
+    :param current_user: UserPrincipal: Get the current user from the auth_service
     :return: A dictionary with a key of image and a value of the deleted image
     """
     
@@ -103,75 +119,79 @@ async def delete_image(id: int, db: Session = Depends(get_db),
 
 @router.post("/add", response_model=ImageAddResponse, status_code=status.HTTP_201_CREATED,
              dependencies=[Depends(allowed_operation_everyone)])
-async def add_image(body: ImageAddModel = Depends(), file: UploadFile = File(), db: Session = Depends(get_db),
-                       current_user: User = Depends(auth_service.get_current_user)):
+async def add_image(body: ImageAddModel = Depends(), file: UploadFile = File(), db: AsyncSession = Depends(get_db),
+                       current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The add_image function takes a body, file, db, and current_user as parameters.
-    It then calls the change_name function to make sure that the image's public name is unique.
-    Then it uploads the image to Cloudinary using its API key and secret key from .env file. 
-    After uploading it gets a URL for an image of size 250x250 pixels with fill crop mode from Cloudinary. 
-    Finally it calls add_image function in images module which adds an Image object into database.
+    It uploads the image to Cloudinary under a unique public name while the request waits,
+    the URL points to an image of size 250x250 pixels with fill crop mode.
+    Finally it adds an Image object into database.
     
     :param body: ImageAddModel: Get the image information from the request body
     :param file: UploadFile: Upload the image to cloudinary
-    :param db: Session: Access the database
-    :param current_user: User: Get the user who is currently logged in
+    :param db: AsyncSession: Access the database
+    :param current_user: UserPrincipal: Get the user who is currently logged in
     :return: A dictionary with the image and a detail string
     """
-    
-    async def change_name(public_name, db):
-        """
-        The change_name function takes a public_name and a db as parameters.
-        It then checks if the public_name is already in use by another image,
-        and if it is, it adds an underscore and a number to the end of the name.
-        If that name is also taken, it increments the number until there are no more images with that name.
-
-        :param public_name: Check if the name is already taken
-        :param db: Access the database
-        :return: A string that is the name of the image
-        """
-
-        right_public_name = public_name
-        suffix = 1
-
-        while db.query(Image).filter(Image.public_name == right_public_name).first():
-            suffix += 1
-            right_public_name = f"{public_name}_{suffix}"
-
-        return right_public_name
-    
-    cloudinary.config(
-            cloud_name=os.environ.get('CLOUDINARY_NAME'),
-            api_key=os.environ.get('CLOUDINARY_API_KEY'),
-            api_secret=os.environ.get('CLOUDINARY_API_SECRET'),
-            secure=True
-        )
+    configure_cloudinary()
     right_tags = await normalize_tags(body)
-    public_name = file.filename.split(".")[0]
-    right_public_name = await change_name(public_name, db)
-    file_name = right_public_name + "_" + str(current_user.username)
-    r = cloudinary.uploader.upload(file.file, 
-                                   public_id=f'bayraktarogram/{file_name}',
-                                   overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'bayraktarogram/{file_name}') \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    image, details = await images.add_image(db, body, right_tags, src_url, right_public_name, current_user)
+    # The username names the uploaded file, it is not part of the principal
+    user = await repository_users.get_user_by_email(current_user.email, db)
+    image, details = await images.upload_image(db, body, right_tags, file.file, file.filename, user)
 
     return {"image": image, "detail": "Image was successfully added." + details}
 
 
+@router.post("/jobs", response_model=UploadJobResponse, status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(allowed_operation_everyone)])
+async def add_image_job(body: ImageAddModel = Depends(), file: UploadFile = File(),
+                        current_user: UserPrincipal = Depends(auth_service.get_current_user)):
+    """
+    The add_image_job function accepts an image like add_image, but answers before the image is uploaded.
+    The file is spooled to a temporary file and a job is queued, the upload to Cloudinary and the Image row
+    are made by the upload workers. The client polls GET /api/images/jobs/{job_id} to get the new image id.
+    
+    :param body: ImageAddModel: Get the image information from the request body
+    :param file: UploadFile: The image to upload
+    :param current_user: UserPrincipal: Get the user who is currently logged in
+    :return: The queued job
+    """
+    configure_cloudinary()
+    right_tags = await normalize_tags(body)
+    spool = await spool_upload(file)
+    return upload_jobs.submit(UploadJob(current_user.id, body, right_tags, spool, file.filename))
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJobResponse, dependencies=[Depends(allowed_operation_everyone)])
+async def get_image_job(job_id: str, current_user: UserPrincipal = Depends(auth_service.get_current_user)):
+    """
+    The get_image_job function reports the progress of an upload job of the current user:
+    queued, processing, done (with the id of the new image) or failed (with the reason).
+    
+    :param job_id: str: The id returned by POST /api/images/jobs
+    :param current_user: UserPrincipal: Get the user who is currently logged in
+    :return: The job
+    """
+    job = upload_jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
 @router.get("", response_model=ImageGetAllResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def get_images(db: Session = Depends(get_db),
-                     current_user: User = Depends(auth_service.get_current_user)):
+async def get_images(limit: int = Query(20, ge=1, le=100), cursor: str | None = None, db: AsyncSession = Depends(get_read_db),
+                     current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
-    The get_images function returns a list of images that the current user has uploaded.
-    The function takes in two parameters: db and current_user. The db parameter is used to 
-    access the database, while the current_user parameter is used to access information about 
-    the currently logged-in user.
+    The get_images function returns a page of images.
+    The function takes in the size of the page and the cursor returned with the previous page. 
+    The db parameter is used to access the database, while the current_user parameter is used to access 
+    information about the currently logged-in user.
     
-    :param db: Session: Pass the database session to the function
-    :param current_user: User: Get the current user from the database
-    :return: A list of images
+    :param limit: int: The maximum number of images on the page
+    :param cursor: str: The next_cursor of the previous page, omit it to get the first page
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: UserPrincipal: Get the current user from the database
+    :return: A list of images and the cursor of the next page
     """
-    user_images = await images.get_images(db, current_user)
-    return {"images": user_images}
+    user_images, next_cursor = await images.get_images(db, current_user, limit, cursor)
+    return {"images": user_images, "next_cursor": next_cursor}
@@ -1,27 +1,27 @@
 from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.database.models import User
+from src.database.db import get_db, get_read_db
 from src.services.auth import auth_service
 from src.schemas import UserDb
 from src.conf.config import settings
 from src.services.roles import allowed_operation_admin
 from src.schemas import Role
 from src.repository import message as repository_message
+from src.repository.users import UserPrincipal
 
 router = APIRouter(prefix="/message", tags=["message"])
 
 @router.put("/write_message/{reciever}")
-async def write_message(reciever: str, message: str, sender: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def write_message(reciever: str, message: str, sender: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
     """
     The write_message function takes in a reciever, message, and sender.
     The function then sends the message to the reciever using the send_message function from repository_message.py
     
     :param reciever: str: Specify the user that will recieve the message
     :param message: str: Get the message from the user
-    :param sender: User: Get the current user
-    :param db: Session: Get the database session
+    :param sender: UserPrincipal: Get the current user
+    :param db: AsyncSession: Get the database session
     :return: The message object, which is a dict
     :doc-author: Trelent
     """
@@ -30,14 +30,14 @@ async def write_message(reciever: str, message: str, sender: User = Depends(auth
 
 
 @router.get("/read_message/")
-async def read_messages(user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def read_messages(user: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_read_db)):
     """
     The read_messages function returns a list of messages that the user has received.
-        The function takes in a User object and Session object as parameters, which are used to query the database for all messages sent to the user.
+        The function takes in a User object and AsyncSession object as parameters, which are used to query the database for all messages sent to the user.
         The function returns a list of Message objects.
     
-    :param user: User: Get the current user, and db: session is used to connect to the database
-    :param db: Session: Pass the database session to the function
+    :param user: UserPrincipal: Get the current user, and db: session is used to connect to the database
+    :param db: AsyncSession: Pass the database session to the function
     :return: A list of messages
     :doc-author: Trelent
     """
@@ -45,14 +45,14 @@ async def read_messages(user: User = Depends(auth_service.get_current_user), db:
     return (messages)
 
 @router.delete("/delete_message/{message_id}")
-async def delete_message(message_id, user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def delete_message(message_id: int, user: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
     """
     The delete_message function deletes a message from the database.
         
     
     :param message_id: Specify which message to delete
-    :param user: User: Get the current user
-    :param db: Session: Pass the database session to the function
+    :param user: UserPrincipal: Get the current user
+    :param db: AsyncSession: Pass the database session to the function
     :return: A message object
     :doc-author: Trelent
     """
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+
+from src.repository.users import UserPrincipal
+from src.services.auth import auth_service
+from src.services.metrics import metrics
+from src.services.roles import allowed_operation_admin
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/", dependencies=[Depends(allowed_operation_admin)])
+async def get_metrics(_: UserPrincipal = Depends(auth_service.get_current_user)):
+    """
+    The get_metrics function returns the counters, gauges and timings collected by the application,
+    for example the connection pool checkout latency, the checked out connections and the overflow events.
+
+    :param _: UserPrincipal: Make sure that the user is logged in
+    :return: A snapshot of the metrics registry
+    :rtype: dict
+    """
+    return metrics.snapshot()
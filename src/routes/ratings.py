@@ -1,29 +1,30 @@
 from typing import List
 
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
-from src.database.models import User
+
 from src.schemas import RatingModel, RatingResponse
 from src.repository import ratings as repository_ratings
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
-from src.services.roles import  allowed_operation_everyone, allowed_operation_mod_and_admin
+from src.services.roles import  allowed_operation_everyone, allowed_operation_mod_and_admin, allowed_operation_admin
 
 router = APIRouter(prefix='/ratings', tags=["ratings"])
 
 @router.get("/image/{image_id}", response_model=float, dependencies=[Depends(allowed_operation_everyone)])
-async def get_image_rating(image_id,
-                            _: User = Depends(auth_service.get_current_user),
-                              db: Session = Depends(get_db)):
+async def get_image_rating(image_id: int,
+                            _: UserPrincipal = Depends(auth_service.get_current_user),
+                              db: AsyncSession = Depends(get_db)):
     """
     The get_image_rating function returns the average rating of an image.
         The function takes in a single parameter, the image_id, and returns a JSON object containing 
         the average rating of that particular image.
     
     :param image_id: Get the average rating for a specific image
-    :param _: User: Get the current user from the auth_service
-    :param db: Session: Access the database
+    :param _: UserPrincipal: Get the current user from the auth_service
+    :param db: AsyncSession: Access the database
     :return: The average rating for a particular image
     """
     get_rating = await repository_ratings.get_average_rating(image_id, db)
@@ -32,16 +33,16 @@ async def get_image_rating(image_id,
 
 @router.get("/{rating_id}", response_model=RatingResponse, dependencies=[Depends(allowed_operation_everyone)])
 async def read_rating(rating_id: int, 
-                      _: User = Depends(auth_service.get_current_user), 
-                      db: Session = Depends(get_db)):
+                      _: UserPrincipal = Depends(auth_service.get_current_user), 
+                      db: AsyncSession = Depends(get_db)):
     """
     The read_rating function is used to read a rating from the database.
         The function takes in an integer representing the id of the rating and returns a RatingModel object.
     
     
     :param rating_id: int: Specify the rating_id that we want to update
-    :param _: User: Make sure that the user is logged in
-    :param db: Session: Get the database session
+    :param _: UserPrincipal: Make sure that the user is logged in
+    :param db: AsyncSession: Get the database session
     :return: A rating object
     """
     rating = await repository_ratings.get_rating(rating_id, db)
@@ -49,9 +50,23 @@ async def read_rating(rating_id: int,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found")
     return rating
 
+@router.post("/rebuild_aggregates", dependencies=[Depends(allowed_operation_admin)])
+async def rebuild_aggregates(_: UserPrincipal = Depends(auth_service.get_current_user),
+                             db: AsyncSession = Depends(get_db)):
+    """
+    The rebuild_aggregates function recomputes the rating aggregates stored on every image
+    from the ratings table. It is meant for the one-off backfill and for repairs.
+
+    :param _: UserPrincipal: Make sure that the user is logged in
+    :param db: AsyncSession: Access the database
+    :return: The number of rated images that were recomputed
+    """
+    rated_images = await repository_ratings.rebuild_rating_aggregates(db)
+    return {"rated_images": rated_images, "detail": "Rating aggregates were successfully rebuilt"}
+
 @router.post("/{image_id}", response_model=RatingResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def create_rate(image_id, body: RatingModel, current_user: User = Depends(auth_service.get_current_user),
-                      db: Session = Depends(get_db)):
+async def create_rate(image_id: int, body: RatingModel, current_user: UserPrincipal = Depends(auth_service.get_current_user),
+                      db: AsyncSession = Depends(get_db)):
     """
     The create_rate function creates a new rating for an image.
         The function takes in the following parameters:
@@ -60,8 +75,8 @@ async def create_rate(image_id, body: RatingModel, current_user: User = Depends(
     
     :param image_id: Identify the image that is being rated
     :param body: RatingModel: Specify the model that will be used to validate the request body
-    :param current_user: User: Get the user information from the token
-    :param db: Session: Pass the database session to the function
+    :param current_user: UserPrincipal: Get the user information from the token
+    :param db: AsyncSession: Pass the database session to the function
     :return: A rating object
     """
     rating = await repository_ratings.create_rating(image_id, body, current_user, db)
@@ -72,8 +87,8 @@ async def create_rate(image_id, body: RatingModel, current_user: User = Depends(
 
 
 @router.put("/{rating_id}", response_model=RatingResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def update_rating(body: RatingModel, rating_id: int, db: Session = Depends(get_db),
-                        _: User = Depends(auth_service.get_current_user)):
+async def update_rating(body: RatingModel, rating_id: int, db: AsyncSession = Depends(get_db),
+                        _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The update_rating function updates a rating in the database.
         It takes a RatingModel object as input, and returns the updated RatingResponse object.
@@ -81,8 +96,8 @@ async def update_rating(body: RatingModel, rating_id: int, db: Session = Depends
     
     :param body: RatingModel: Specify the data model that will be used to create a new rating
     :param rating_id: int: Identify the rating to be deleted
-    :param db: Session: Get the database session
-    :param _: User: Ensure that the user is logged in
+    :param db: AsyncSession: Get the database session
+    :param _: UserPrincipal: Ensure that the user is logged in
     :return: The updated rating
     """
     rating = await repository_ratings.update_rating(rating_id, body, db)
@@ -93,16 +108,16 @@ async def update_rating(body: RatingModel, rating_id: int, db: Session = Depends
     
 
 @router.delete("/{rating_id}", response_model=RatingResponse, dependencies=[Depends(allowed_operation_mod_and_admin)])
-async def remove_rating(rating_id: int, db: Session = Depends(get_db),
-                        _: User = Depends(auth_service.get_current_user)):
+async def remove_rating(rating_id: int, db: AsyncSession = Depends(get_db),
+                        _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The remove_rating function removes a rating from the database.
         It takes in an integer representing the id of the rating to be removed, and returns a RatingResponse object.
         If no such rating exists, it raises an HTTPException with status code 404.
     
     :param rating_id: int: Get the rating id from the request
-    :param db: Session: Pass the database session to the repository
-    :param _: User: Make sure that the user is authenticated before removing a rating
+    :param db: AsyncSession: Pass the database session to the repository
+    :param _: UserPrincipal: Make sure that the user is authenticated before removing a rating
     :return: The deleted rating
     """
     rating = await repository_ratings.remove_rating(rating_id, db)
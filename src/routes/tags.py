@@ -1,12 +1,13 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.database.models import User, Tag
-from src.schemas import TagModel, TagResponse
+from src.database.db import get_db, get_read_db
+
+from src.schemas import TagModel, TagResponse, TagSuggestion
 from src.repository import tags as repository_tags
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
 from src.services.roles import allowed_operation_mod_and_admin, allowed_operation_everyone
 
@@ -15,21 +16,20 @@ router = APIRouter(prefix='/tags', tags=["tags"])
 
 
 @router.post("/", response_model=TagResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def create_tag(body: TagModel, db: Session = Depends(get_db), 
-                    _: User = Depends(auth_service.get_current_user)):
+async def create_tag(body: TagModel, db: AsyncSession = Depends(get_db), 
+                    _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The create_tag function creates a new tag in the database.
         It takes a TagModel object as input and returns the created tag.
 
 
     :param body: TagModel: Pass the data from the request body
-    :param db: Session: Pass the database connection to the function
-    :param _: User: Check if the user is logged in
+    :param db: AsyncSession: Pass the database connection to the function
+    :param _: UserPrincipal: Check if the user is logged in
     :return: A tagmodel object
     """
 
-    check_tag = db.query(Tag).filter(Tag.name == body.name.lower()).first()
-    if check_tag:
+    if await repository_tags.get_tag_id(body.name.lower(), db) is not None:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Tag already exist')
     tag = await repository_tags.create_tag(body, db)
     if tag is None:
@@ -37,30 +37,59 @@ async def create_tag(body: TagModel, db: Session = Depends(get_db),
     return tag
 
 @router.get("/", response_model=List[TagResponse], dependencies=[Depends(allowed_operation_everyone)])
-async def read_tags(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), 
-                    _: User = Depends(auth_service.get_current_user)):
+async def read_tags(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_read_db), 
+                    _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The read_tags function returns a list of tags.
     
     :param skip: int: Skip the first n tags
     :param limit: int: Limit the number of tags returned
-    :param db: Session: Pass the database session to the repository layer
-    :param _: User: Make sure that the user is authenticated
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param _: UserPrincipal: Make sure that the user is authenticated
     :return: A list of tag objects
     """
     
     tags = await repository_tags.get_tags(skip, limit, db)
     return tags
 
+@router.get("/suggest", response_model=List[TagSuggestion], dependencies=[Depends(allowed_operation_everyone)])
+async def suggest_tags(prefix: str = Query(min_length=1, max_length=25), limit: int = Query(10, ge=1, le=50),
+                       db: AsyncSession = Depends(get_read_db), _: UserPrincipal = Depends(auth_service.get_current_user)):
+    """
+    The suggest_tags function returns the most used tags whose names start with the prefix, for autocomplete.
+    
+    :param prefix: str: The beginning of the tag name typed by the user
+    :param limit: int: The number of suggestions
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param _: UserPrincipal: Make sure that the user is authenticated
+    :return: A list of tags with their usage counts, the most used first
+    """
+    
+    return await repository_tags.suggest_tags(prefix, limit, db)
+
+@router.get("/popular", response_model=List[TagSuggestion], dependencies=[Depends(allowed_operation_everyone)])
+async def read_popular_tags(limit: int = Query(20, ge=1, le=100), db: AsyncSession = Depends(get_read_db),
+                            _: UserPrincipal = Depends(auth_service.get_current_user)):
+    """
+    The read_popular_tags function returns the most used tags with their usage counts, for tag clouds.
+    
+    :param limit: int: The number of tags
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param _: UserPrincipal: Make sure that the user is authenticated
+    :return: A list of tags with their usage counts, the most used first
+    """
+    
+    return await repository_tags.get_popular_tags(limit, db)
+
 @router.get("/{tag_id}", response_model=TagResponse, dependencies=[Depends(allowed_operation_everyone)])
-async def read_tag(tag_id: int, db: Session = Depends(get_db),
-                   _: User = Depends(auth_service.get_current_user)):
+async def read_tag(tag_id: int, db: AsyncSession = Depends(get_read_db),
+                   _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The read_tag function returns a tag by its id.
     
     :param tag_id: int: Specify the tag id to be updated
-    :param db: Session: Pass the database session to the repository layer
-    :param _: User: Ensure that the user is authenticated
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param _: UserPrincipal: Ensure that the user is authenticated
     :return: A tag object, which is a dictionary
     """
     
@@ -70,8 +99,8 @@ async def read_tag(tag_id: int, db: Session = Depends(get_db),
     return tag
 
 @router.put("/{tag_id}", response_model=TagResponse, dependencies=[Depends(allowed_operation_mod_and_admin)])
-async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db), 
-                     _: User = Depends(auth_service.get_current_user)):
+async def update_tag(body: TagModel, tag_id: int, db: AsyncSession = Depends(get_db), 
+                     _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The update_tag function updates a tag in the database.
         It takes a TagModel object as input, and returns the updated tag.
@@ -79,8 +108,8 @@ async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db),
     
     :param body: TagModel: Pass the tagmodel object to the function
     :param tag_id: int: Specify the id of the tag to be deleted
-    :param db: Session: Get the database session
-    :param _: User: Check if the user is authenticated
+    :param db: AsyncSession: Get the database session
+    :param _: UserPrincipal: Check if the user is authenticated
     :return: A tagmodel object
     """
     
@@ -90,16 +119,16 @@ async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db),
     return tag
 
 @router.delete("/{tag_id}", response_model=TagResponse, dependencies=[Depends(allowed_operation_mod_and_admin)]) 
-async def delete_tag(tag_id: int, db: Session = Depends(get_db), 
-                     _: User = Depends(auth_service.get_current_user)):
+async def delete_tag(tag_id: int, db: AsyncSession = Depends(get_db), 
+                     _: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The delete_tag function deletes a tag from the database.
         It takes in an integer representing the id of the tag to be deleted, and returns a TagResponse object containing information about that tag.
     
     
     :param tag_id: int: Specify the id of the tag to be deleted
-    :param db: Session: Get the database session
-    :param _: User: Make sure that the user is logged in
+    :param db: AsyncSession: Get the database session
+    :param _: UserPrincipal: Make sure that the user is logged in
     :return: A tag object, which is the same as a post object
     """
     
@@ -8,12 +8,13 @@ from cloudinary import uploader
 
 
 from src.schemas import ImageSettingsModel, ImageSettingsResponseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.database.db import get_db
-from src.database.models import ImageSettings, User
+from src.database.models import ImageSettings
 from src.services.auth import auth_service
 from src.services.roles import allowed_operation_everyone
 from src.repository import transform_photo
+from src.repository.users import UserPrincipal
 from src.conf.config import settings
 
 from dotenv import find_dotenv, load_dotenv
@@ -23,15 +24,15 @@ router = APIRouter(prefix='/transform_photo', tags=["transform_photo"])
 
 
 @router.post('/transformations/add', response_model=ImageSettingsResponseModel, status_code=status.HTTP_201_CREATED, dependencies=[Depends(allowed_operation_everyone)])
-async def create_transformed_photo_url(body: ImageSettingsModel, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def create_transformed_photo_url(body: ImageSettingsModel, db: AsyncSession = Depends(get_db), current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The create_transformed_photo_url function creates a transformed photo url.
         The function takes in an ImageSettingsModel object and returns the transformed photo url.
     
     
     :param body:ImageSettingsModel: Pass the imagesettingsmodel object to the function
-    :param db: Session: Access the database
-    :param current_user: User: Get the current user's id
+    :param db: AsyncSession: Access the database
+    :param current_user: UserPrincipal: Get the current user's id
     :return: A string
     :doc-author: Trelent
     """
@@ -48,16 +49,16 @@ async def create_transformed_photo_url(body: ImageSettingsModel, db: Session = D
 
 # dependencies=[Depends(allowed_operation_everyone)
 @router.get('/transformations/{transformed_url_id}', dependencies=[Depends(allowed_operation_everyone)])
-async def get_transformed_photos(transformed_url_id: int, db: Session = Depends(get_db),
-                                 current_user: User = Depends(auth_service.get_current_user)):
+async def get_transformed_photos(transformed_url_id: int, db: AsyncSession = Depends(get_db),
+                                 current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The get_transformed_photos function returns the transformed_url of a photo that has been uploaded to the database.
         The function takes in an integer, transformed_url_id, and uses it to query the database for a matching id. 
         If no match is found, then an error message is returned.
     
     :param transformed_url_id: int: Specify the transformed_url_id of the photo that is being requested
-    :param db: Session: Access the database
-    :param current_user: User: Get the current user
+    :param db: AsyncSession: Access the database
+    :param current_user: UserPrincipal: Get the current user
     :return: The transformed_url value
     :doc-author: Trelent
     """
@@ -76,15 +77,15 @@ async def get_transformed_photos(transformed_url_id: int, db: Session = Depends(
 
 
 @router.get('/transformationsqr/{qrcode_url_id}', dependencies=[Depends(get_db)])
-async def get_transformed_qrcode(qrcode_url_id: int, db: Session = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+async def get_transformed_qrcode(qrcode_url_id: int, db: AsyncSession = Depends(get_db), current_user: UserPrincipal = Depends(auth_service.get_current_user)):
     """
     The get_transformed_qrcode function returns the transformed qrcode_url of a given qrcode_url id.
         The function takes in an integer representing the id of a given qrcode_url and returns a dictionary containing 
         the transformed url for that particular image.
     
     :param qrcode_url_id: int: Identify the qrcode_url in the database
-    :param db: Session: Pass the database connection to the function
-    :param current_user: User: Get the current user's id
+    :param db: AsyncSession: Pass the database connection to the function
+    :param current_user: UserPrincipal: Get the current user's id
     :return: The following error:
     :doc-author: Trelent
     """
@@ -1,15 +1,17 @@
 """Module for User's operations"""
 
 from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import cloudinary
-import cloudinary.uploader
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 from src.database.db import get_db
-from src.database.models import User, Image
+from src.database.models import Image
 from src.repository import users as repository_users
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
+from src.services.executors import cloudinary_executor
+from src.services.photo_services import upload_file
 from src.schemas import UserDb, UpdateUser, Profile
 from src.conf.config import settings
 from src.services.roles import allowed_operation_admin
@@ -18,24 +20,25 @@ router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.post("/me/", response_model=UserDb)
-async def update_profile(body: UpdateUser, current_user: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def update_profile(body: UpdateUser, current_user: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
     """
     The update_profile function updates the user's profile information.
-        
+    The user is loaded from the database, the principal of the request only says who it is.
     
     :param body: UpdateUser: Get the data from the request body
-    :param current_user: User: Access the current user's information
-    :param db: Session: Access the database
+    :param current_user: UserPrincipal: Access the current user's information
+    :param db: AsyncSession: Access the database
     :return: A user object
     :doc-author: Trelent
     """
-    user = await repository_users.update_profile(body, current_user, db)
+    user = await repository_users.get_user_by_email(current_user.email, db)
+    user = await repository_users.update_profile(body, user, db)
     return user
 
 
 @router.patch('/avatar', response_model=UserDb)
-async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+async def update_avatar_user(file: UploadFile = File(), current_user: UserPrincipal = Depends(auth_service.get_current_user),
+                             db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
 
@@ -43,39 +46,38 @@ async def update_avatar_user(file: UploadFile = File(), current_user: User = Dep
     :param file: Get the file from the request body
     :type file: UploadFile
     :param current_user: Get the current user from the database
-    :type current_user: User
+    :type current_user: UserPrincipal
     :param db: Pass the database session to the repository layer
-    :type db: Session
+    :type db: AsyncSession
     :return: User with updated avatar
     :rtype: User
     """
     cloudinary.config(
-        cloud_name=settings.cloud_name,
-        api_key=settings.api_key,
-        api_secret=settings.api_secret,
+        cloud_name=settings.cloudinary_name,
+        api_key=settings.cloudinary_api_key,
+        api_secret=settings.cloudinary_api_secret,
         secure=True
     )
 
-    r = cloudinary.uploader.upload(
-        file.file, public_id=f'ContactsApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'ContactsApp/{current_user.username}')\
-                        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
+    user = await repository_users.get_user_by_email(current_user.email, db)
+    src_url = await cloudinary_executor.run(upload_file, file.file, f'ContactsApp/{user.username}',
+                                            width=250, height=250, crop='fill')
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
 
 @router.get("/profile/{user}", response_model=Profile)
-async def get_profile(username: str, _: User = Depends(auth_service.get_current_user), db: Session = Depends(get_db)):
+async def get_profile(username: str, _: UserPrincipal = Depends(auth_service.get_current_user), db: AsyncSession = Depends(get_db)):
     """
     The get_profile function returns a user's profile information.
     
     :param username: str: Get the username of the user whose profile is being requested
-    :param _: User: Get the current user
-    :param db: Session: Pass the database session to the function
+    :param _: UserPrincipal: Get the current user
+    :param db: AsyncSession: Pass the database session to the function
     :return: A user's profile information
     :doc-author: Trelent
     """
     user_info = await repository_users.get_user_info(username, db)
-    photos = db.query(func.count()).filter(Image.id == user_info.id).scalar()
+    photos = await db.scalar(select(func.count()).filter(Image.id == user_info.id))
     return {"username": user_info.username, 
             "email": user_info.email,
             "crated_at": user_info.crated_at,
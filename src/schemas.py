@@ -17,6 +17,17 @@ class SortField(str, enum.Enum):
     date = "date"
     rating = "rating"
 
+
+class KeyWordsSortField(str, enum.Enum):
+    date = "date"
+    rating = "rating"
+    relevance = "relevance"
+
+
+class SearchMode(str, enum.Enum):
+    substring = "substring"
+    fulltext = "fulltext"
+
 class UpdateUser(BaseModel):
     bio: str = Field(max_length=500)
     location: str = Field(max_length=100)
@@ -91,6 +102,14 @@ class TagResponse(TagModel):
     class Config:
         orm_mode = True
 
+class TagSuggestion(BaseModel):
+    id: int
+    name: str
+    usage_count: int
+
+    class Config:
+        orm_mode = True
+
 class ImageAddModel(BaseModel):
     description: str = Field(max_length=500)
     tags: Optional[List[str]]
@@ -124,6 +143,17 @@ class ImageAddResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class UploadJobResponse(BaseModel):
+    id: str
+    status: str
+    image_id: Optional[int] = None
+    detail: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
 class ImageUpdateDescrResponse(BaseModel):
     id: int
     description: str
@@ -146,6 +176,7 @@ class ImageAddTagResponse(BaseModel):
 
 class ImageGetAllResponse(BaseModel):
     images: List[ImageGetResponse]
+    next_cursor: Optional[str] = None
 
 class RatingModel(BaseModel):
     one_star: Optional[bool] = False
@@ -161,6 +192,7 @@ class RatingResponse(RatingModel):
     three_stars: bool = False
     four_stars: bool = False
     five_stars: bool = False
+    stars: int = 0
     user_id: int = 1
     image_id: int = 1
 
@@ -1,6 +1,8 @@
 
 """Module for supporting authorization and authentication operations"""
 
+import time
+import uuid
 from typing import Optional
 
 from jose import JWTError, jwt
@@ -8,24 +10,75 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
+from src.repository import tokens as repository_tokens
 from src.repository import users as repository_users
 
 from src.conf.config import settings
+from src.services.cache import LRUCache
+from src.services.executors import password_executor
+
+# Token -> claims of the tokens whose signature was verified, every entry expires with its token
+token_cache = LRUCache(settings.token_cache_size, name="token")
+
+
+def password_context(rounds: int) -> CryptContext:
+    """
+    The password_context function creates the bcrypt context that hashes and verifies passwords.
+    Hashes made with another work factor are reported as needing an update, so they are rehashed on login.
+
+    :param rounds: int: The bcrypt work factor, every step doubles the cost of a hash
+    :return: The password context
+    :rtype: CryptContext
+    """
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds,
+                        bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds)
+
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = password_context(settings.bcrypt_rounds)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-    def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        The verify_password function checks a password against its hash on the password pool,
+        bcrypt is too slow to run on the event loop.
 
-    def get_password_hash(self, password: str):
-        return self.pwd_context.hash(password)
+        :param self: Represent the instance of the class
+        :param plain_password: str: The password given by the user
+        :param hashed_password: str: The stored hash
+        :return: True if the password matches the hash
+        :rtype: bool
+        """
+        return await password_executor.run(self.pwd_context.verify, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_and_update function checks a password against its hash on the password pool
+        and rehashes the password when the hash was made with another work factor than the configured one.
+
+        :param self: Represent the instance of the class
+        :param plain_password: str: The password given by the user
+        :param hashed_password: str: The stored hash
+        :return: Whether the password matches, and the new hash to store or None
+        :rtype: tuple[bool, str | None]
+        """
+        return await password_executor.run(self.pwd_context.verify_and_update, plain_password, hashed_password)
+
+    async def get_password_hash(self, password: str) -> str:
+        """
+        The get_password_hash function hashes a password with the configured work factor on the password pool.
+
+        :param self: Represent the instance of the class
+        :param password: str: The password to hash
+        :return: The hash of the password
+        :rtype: str
+        """
+        return await password_executor.run(self.pwd_context.hash, password)
 
     # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -47,7 +100,7 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update(
-            {"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+            {"iat": datetime.utcnow(), "exp": expire, "scope": "access_token", "jti": uuid.uuid4().hex})
         encoded_access_token = jwt.encode(
             to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
@@ -72,11 +125,47 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update(
-            {"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
+            {"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token", "jti": uuid.uuid4().hex})
         encoded_refresh_token = jwt.encode(
             to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
+    def decode_token(self, token: str) -> dict:
+        """
+        The decode_token function verifies a token and returns its claims.
+        The claims of verified tokens are cached until the token expires, so a client sending the same token
+        again skips the signature check. A cached token is checked against its exp claim on every hit,
+        an expired token is never accepted. Tokens that fail verification or have no exp are not cached.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The claims of the token, shared with the cache and not to be modified
+        :rtype: dict
+        :raises JWTError: The token is invalid or expired
+        """
+        payload = token_cache.get(token)
+        if payload is not None:
+            if payload["exp"] > time.time():
+                return payload
+            token_cache.pop(token)
+        payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        expires_in = payload.get("exp", 0) - time.time()
+        if expires_in > 0:
+            token_cache.set(token, payload, ttl=expires_in)
+        return payload
+
+    def get_token_expiry(self, token: str) -> datetime:
+        """
+        The get_token_expiry function returns when a verified token expires.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The exp claim of the token as a naive UTC datetime
+        :rtype: datetime
+        :raises JWTError: The token is invalid or expired
+        """
+        return datetime.utcfromtimestamp(self.decode_token(token)["exp"])
+
     async def decode_refresh_token(self, refresh_token: str):
         """
         The decode_refresh_token function is used to decode the refresh token.
@@ -89,8 +178,7 @@ class Auth:
         :rtype: str
         """
         try:
-            payload = jwt.decode(
-                refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(refresh_token)
             if payload['scope'] == 'refresh_token':
                 email = payload['sub']
                 return email
@@ -100,16 +188,37 @@ class Auth:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def get_token_subject(self, authorization: Optional[str]) -> Optional[str]:
+        """
+        The get_token_subject function reads the email from a bearer Authorization header without verifying the token.
+        It must only be used where a forged token does no harm, like picking the database that serves a read.
+
+        :param self: Represent the instance of the class
+        :param authorization: Optional[str]: The value of the Authorization header
+        :return: The subject of the token, or None if there is no readable bearer token
+        :rtype: Optional[str]
+        """
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return jwt.get_unverified_claims(token).get("sub")
+        except JWTError:
+            return None
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the UserResource class.
         It takes an access token as input and returns the user object associated with it.
+        It returns the principal of the user (id, email, roles, access, confirmed), not the User row.
+        The principal comes from the user cache when it is there, so most requests authenticate without a query.
+        Revoked tokens and blocked users are refused, the revocation check is answered by an in-memory filter.
         
         :param self: Represent the instance of a class
         :param token: str: Get the token from the request header
-        :param db: Session: Pass the database session to the function
-        :return: The user object
-        :rtype: User
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The principal of the user
+        :rtype: UserPrincipal
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -119,8 +228,7 @@ class Auth:
 
         try:
             # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY,
-                                 algorithms=[self.ALGORITHM])
+            payload = self.decode_token(token)
             if payload['scope'] == 'access_token':
                 email = payload["sub"]
                 if email is None:
@@ -130,9 +238,15 @@ class Auth:
         except JWTError as e:
             raise credentials_exception
 
-        user = await repository_users.get_user_by_email(email, db)
+        # Tokens issued before tokens got a jti cannot be revoked, they expire on their own
+        if payload.get("jti") and await repository_tokens.is_token_revoked(payload["jti"], db):
+            raise credentials_exception
+
+        user = await repository_users.get_user_principal(email, db)
         if user is None:
             raise credentials_exception
+        if user.access is False:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You was banned")
         return user
     
     def create_email_token(self, data: dict):
@@ -166,7 +280,7 @@ class Auth:
         :rtype: str
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode_token(token)
             email = payload["sub"]
             return email
         except JWTError as e:
@@ -0,0 +1,81 @@
+"""Bloom filter, a compact set that may answer yes for an item it does not hold but never no for one it holds"""
+
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        The __init__ function creates an empty filter sized so that, holding capacity items,
+        it wrongly reports an absent item as present with probability error_rate.
+        More items make it fill up and answer yes more often, it never answers no for an added item.
+
+        :param self: Represent the instance of the class
+        :param capacity: int: The number of items the filter is sized for
+        :param error_rate: float: The false positive rate at capacity, between 0 and 1
+        :return: The object created
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _positions(self, item: str):
+        """
+        The _positions function yields the bits of an item, derived from two halves of one hash.
+
+        :param self: Represent the instance of the class
+        :param item: str: The item
+        :return: The indexes of the bits of the item
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        for number in range(self.hashes):
+            yield (first + number * second) % self.size
+
+    def add(self, item: str):
+        """
+        The add function puts an item into the filter.
+
+        :param self: Represent the instance of the class
+        :param item: str: The item
+        :return: None
+        """
+        with self._lock:
+            for position in self._positions(item):
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self):
+        """
+        The clear function removes every item.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self.count = 0
+
+    def fill_ratio(self) -> float:
+        """
+        The fill_ratio function returns the share of bits that are set, the false positive rate is about
+        this ratio to the power of the number of hashes.
+
+        :param self: Represent the instance of the class
+        :return: The share of set bits, between 0 and 1
+        :rtype: float
+        """
+        return int.from_bytes(self._bits, "little").bit_count() / self.size
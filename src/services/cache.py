@@ -0,0 +1,123 @@
+"""Bounded in-process caches with expiry and hit/miss statistics"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from src.services.metrics import metrics
+
+
+class LRUCache:
+
+    def __init__(self, maxsize: int, ttl: float | None = None, name: str | None = None):
+        """
+        The __init__ function creates an empty cache that keeps at most maxsize entries.
+        When it is full, the least recently used entry is evicted. Entries older than ttl seconds are never returned.
+
+        :param self: Represent the instance of the class
+        :param maxsize: int: The maximal number of entries
+        :param ttl: float | None: The default lifetime of an entry in seconds, None keeps entries until they are evicted
+        :param name: str | None: The name used as the prefix of the metrics of the cache, None does not export metrics
+        :return: The object created
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            metrics.register_gauge(f"{name}_cache_size", self.__len__)
+            metrics.register_gauge(f"{name}_cache_hit_rate", lambda: self.stats()["hit_rate"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _count(self, event: str):
+        """
+        The _count function increments a statistic of the cache and its counter in the metrics registry.
+
+        :param self: Represent the instance of the class
+        :param event: str: hits, misses or evictions
+        :return: None
+        """
+        setattr(self, event, getattr(self, event) + 1)
+        if self.name:
+            metrics.inc(f"{self.name}_cache_{event}_total")
+
+    def get(self, key, default=None):
+        """
+        The get function returns the value stored under key and marks it as recently used.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the entry
+        :param default: The value returned when the key is missing or expired
+        :return: The cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._count("misses")
+                return default
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return entry[0]
+
+    def set(self, key, value, ttl: float | None = None):
+        """
+        The set function stores a value, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the entry
+        :param value: The value to store
+        :param ttl: float | None: The lifetime of this entry in seconds, the default lifetime of the cache if None
+        :return: None
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+
+    def pop(self, key, default=None):
+        """
+        The pop function removes an entry.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the entry
+        :param default: The value returned when the key is missing
+        :return: The removed value or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        """
+        The clear function removes every entry, the statistics are kept.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the hit and miss statistics of the cache.
+
+        :param self: Represent the instance of the class
+        :return: The size, hits, misses, evictions and hit rate
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,110 @@
+"""Bounded thread pools for blocking SDK calls and CPU-bound work made from async routes"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+from src.services.metrics import metrics
+
+
+class BoundedExecutor:
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, queue_timeout: float):
+        """
+        The __init__ function creates a thread pool that accepts at most max_workers + max_queue calls at a time.
+        Callers over that limit wait up to queue_timeout seconds for a free slot and then get a 503,
+        so a slow remote service cannot pile up an unbounded backlog of blocked requests.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the pool, used as the prefix of its metrics and thread names
+        :param max_workers: int: The number of threads
+        :param max_queue: int: How many calls may wait for a thread
+        :param queue_timeout: float: How many seconds a caller waits for a free slot
+        :return: The object created
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        metrics.register_gauge(f"{name}_executor_queue_depth", lambda: self._queued)
+        metrics.register_gauge(f"{name}_executor_running", lambda: self._running)
+
+    def _call(self, job: dict, fn, *args, **kwargs):
+        """
+        The _call function runs a call on a pool thread and records how long it waited and how long it ran.
+
+        :param self: Represent the instance of the class
+        :param job: dict: The bookkeeping of the call, the submit time and whether it has started
+        :param fn: The blocking function
+        :return: The result of fn
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if not job["started"]:
+                job["started"] = True
+                self._queued -= 1
+            self._running += 1
+        metrics.observe(f"{self.name}_executor_wait_seconds", started - job["submitted"])
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+            metrics.observe(f"{self.name}_executor_run_seconds", time.perf_counter() - started)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        The run function calls a blocking function on the pool and awaits its result without blocking the event loop.
+
+        :param self: Represent the instance of the class
+        :param fn: The blocking function
+        :param args: The positional arguments of fn
+        :param kwargs: The keyword arguments of fn
+        :return: The result of fn
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc(f"{self.name}_executor_rejected_total")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Service is busy, try again later", headers={"Retry-After": "1"})
+        job = {"submitted": time.perf_counter(), "started": False}
+        with self._lock:
+            self._queued += 1
+        try:
+            call = functools.partial(self._call, job, fn, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+        finally:
+            # A call cancelled before a thread picked it up never reaches _call
+            with self._lock:
+                if not job["started"]:
+                    job["started"] = True
+                    self._queued -= 1
+            self._slots.release()
+
+    def shutdown(self):
+        """
+        The shutdown function waits for the running calls and stops the threads.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        self._pool.shutdown(wait=True)
+
+
+cloudinary_executor = BoundedExecutor("cloudinary", settings.cloudinary_workers,
+                                      settings.cloudinary_queue_size, settings.cloudinary_queue_timeout)
+
+# bcrypt releases the GIL while it hashes, so one thread per core keeps every core busy
+password_executor = BoundedExecutor("password", settings.password_workers,
+                                    settings.password_queue_size, settings.password_queue_timeout)
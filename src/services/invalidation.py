@@ -0,0 +1,47 @@
+"""Publish/subscribe hook that tells every worker to drop stale cache entries"""
+
+from collections import defaultdict
+from typing import Callable
+
+
+class LocalInvalidationBus:
+    """
+    In-process stand-in for a broker such as Redis pub/sub: a message is delivered to the subscribers
+    of this worker only. A broker-backed bus must offer the same publish and subscribe methods and also
+    deliver every message back to the worker that published it.
+    """
+
+    def __init__(self):
+        """
+        The __init__ function creates a bus without subscribers.
+
+        :param self: Represent the instance of the class
+        :return: The object created
+        """
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, channel: str, callback: Callable[[str | None], None]):
+        """
+        The subscribe function registers a callback for the messages of a channel.
+
+        :param self: Represent the instance of the class
+        :param channel: str: The name of the channel, for example tags
+        :param callback: Callable[[str | None], None]: Called with the message, usually the key to drop
+        :return: None
+        """
+        self._subscribers[channel].append(callback)
+
+    def publish(self, channel: str, message: str | None = None):
+        """
+        The publish function sends a message to the subscribers of a channel.
+
+        :param self: Represent the instance of the class
+        :param channel: str: The name of the channel
+        :param message: str | None: The key to drop, None asks the subscribers to drop everything
+        :return: None
+        """
+        for callback in self._subscribers[channel]:
+            callback(message)
+
+
+bus = LocalInvalidationBus()
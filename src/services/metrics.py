@@ -0,0 +1,133 @@
+"""In-process metrics registry exported by the /api/metrics endpoint"""
+
+import bisect
+import threading
+from collections import defaultdict
+from typing import Callable
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket catches everything slower
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timing:
+
+    def __init__(self):
+        """
+        The __init__ function sets up an empty latency histogram.
+
+        :param self: Represent the instance of the class
+        :return: The object created
+        """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        """
+        The observe function records one measured duration.
+
+        :param self: Represent the instance of the class
+        :param seconds: float: The measured duration in seconds
+        :return: None
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the histogram as a dictionary.
+        Buckets are cumulative, like Prometheus buckets: every bucket counts the observations lower or equal to its bound.
+
+        :param self: Represent the instance of the class
+        :return: The count, sum, average, maximum and buckets of the observed durations
+        :rtype: dict
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.total, "avg": self.total / self.count if self.count else 0.0,
+                "max": self.max, "buckets": buckets}
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        The __init__ function creates an empty registry of counters, gauges and timings.
+        Counters and timings can be updated from any thread, gauges are callbacks read on every snapshot.
+
+        :param self: Represent the instance of the class
+        :return: The object created
+        """
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = defaultdict(Timing)
+        self._gauges = {}
+
+    def inc(self, name: str, value: int = 1):
+        """
+        The inc function increments a counter.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the counter
+        :param value: int: The increment
+        :return: None
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, seconds: float):
+        """
+        The observe function adds a measured duration to a timing.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the timing
+        :param seconds: float: The measured duration in seconds
+        :return: None
+        """
+        with self._lock:
+            self._timings[name].observe(seconds)
+
+    def register_gauge(self, name: str, callback: Callable[[], float]):
+        """
+        The register_gauge function registers a callback that returns the current value of a gauge.
+        Registering the same name again replaces the callback.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the gauge
+        :param callback: Callable[[], float]: A function without arguments returning the value
+        :return: None
+        """
+        self._gauges[name] = callback
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function returns the current value of every metric.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary with counters, gauges and timings
+        :rtype: dict
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: timing.snapshot() for name, timing in self._timings.items()}
+        gauges = {name: callback() for name, callback in self._gauges.items()}
+        return {"counters": counters, "gauges": gauges, "timings": timings}
+
+    def reset(self):
+        """
+        The reset function clears counters and timings, the registered gauges are kept.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
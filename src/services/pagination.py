@@ -0,0 +1,40 @@
+"""Opaque cursors for keyset pagination"""
+
+import base64
+import json
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(*values) -> str:
+    """
+    The encode_cursor function packs the sort key of the last returned row into an opaque string.
+    Datetimes must be converted by the caller (for example to an ISO string) before encoding.
+
+    :param values: The values of the sort key, for example the id of the last image
+    :return: A url-safe cursor string
+    :rtype: str
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor and checks the type of every value.
+    A malformed cursor, or a cursor that does not hold one value of each given type, raises an HTTPException with status 400.
+
+    :param cursor: str: The cursor sent by the client
+    :param types: The expected type of every value of the sort key, for example int for an id
+    :return: The values of the sort key
+    :rtype: list
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != len(types) \
+            or not all(isinstance(value, kind) for value, kind in zip(values, types)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
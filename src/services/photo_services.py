@@ -65,6 +65,21 @@ def uploadImage(src_url, public_id):
     return srcURL
   
 
+def upload_file(file, public_id, **url_options):
+    """
+    The upload_file function uploads a file object to Cloudinary and builds the delivery URL of the uploaded version.
+    It blocks for the whole upload, so async code must call it through cloudinary_executor.
+
+    :param file: The file object to upload, for example UploadFile.file
+    :param public_id: The public id of the asset, including its folder
+    :param url_options: The transformation of the delivery URL, for example width, height and crop
+    :return: The delivery URL of the uploaded version
+    :doc-author: Trelent
+    """
+    r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True)
+    return cloudinary.CloudinaryImage(public_id).build_url(version=r.get('version'), **url_options)
+
+
 def getAssetInfo(public_id):
     """
     The getAssetInfo function gets and uses details of the image.
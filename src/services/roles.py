@@ -2,7 +2,8 @@ from typing import List
 
 from fastapi import Depends, HTTPException, status, Request
 
-from src.database.models import User, Role
+from src.database.models import Role
+from src.repository.users import UserPrincipal
 from src.services.auth import auth_service
 
 
@@ -21,14 +22,14 @@ class RoleAccess:
         self.allowed_roles = allowed_roles
 
 
-    async def __call__(self, request:Request, current_user: User = Depends(auth_service.get_current_user)):
+    async def __call__(self, request:Request, current_user: UserPrincipal = Depends(auth_service.get_current_user)):
         """
         The __call__ function is the function that will be called when a user tries to access an endpoint.
             It checks if the current_user has one of the allowed roles, and if not it raises a 403 error.
         
         :param self: Access the class attributes
         :param request:Request: Get the request method and url
-        :param current_user: User: Get the current user from the database
+        :param current_user: UserPrincipal: Get the current user from the database
         :return: A response object
         :doc-author: Trelent
         """
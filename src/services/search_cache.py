@@ -0,0 +1,325 @@
+"""Cache of search results that keeps only the ids of the found images"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from src.conf.config import settings
+from src.services.invalidation import bus
+from src.services.metrics import metrics
+
+SEARCH_CHANNEL = "search"
+
+
+def words_of(text: str) -> set[str]:
+    """
+    The words_of function splits a text into the lowercase words the full-text search matches on.
+
+    :param text: str: A description or the words of a search
+    :return: The words of the text
+    :rtype: set[str]
+    """
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class SearchEntry:
+
+    def __init__(self, ids: list[int], next_cursor: str | None, tags, words: str | None, fulltext: bool,
+                 by_rating: bool, expires: float | None):
+        """
+        The __init__ function creates a cached page of search results with what is needed to invalidate it.
+
+        :param self: Represent the instance of the class
+        :param ids: list[int]: The ids of the found images in the order of the page
+        :param next_cursor: str | None: The cursor of the next page
+        :param tags: The names of the tags the search filters on
+        :param words: str | None: The normalized words of a search by words
+        :param fulltext: bool: Whether the words are matched by the full-text search
+        :param by_rating: bool: Whether the page is sorted by rating
+        :param expires: float | None: The monotonic time the entry expires at
+        :return: The object created
+        """
+        self.ids = ids
+        self.next_cursor = next_cursor
+        self.tags = frozenset(tags)
+        self.words = words
+        self.fulltext = fulltext
+        self.by_rating = by_rating
+        self.expires = expires
+
+    def matches(self, tags, description: str | None) -> bool:
+        """
+        The matches function checks if an image with these tags and description could belong to the search.
+        It errs on the side of yes, a false match only costs a cache miss.
+
+        :param self: Represent the instance of the class
+        :param tags: The names of the tags of the image, or of the tags it gained or lost
+        :param description: str | None: The description of the image
+        :return: True if the image could be found by the search
+        :rtype: bool
+        """
+        if self.tags & set(tags):
+            return True
+        if self.words is None or description is None:
+            return False
+        if self.fulltext:
+            return bool(words_of(self.words) & words_of(description))
+        return self.words in description.lower()
+
+
+class SearchCache:
+
+    def __init__(self, max_ids: int, ttl: float | None = None):
+        """
+        The __init__ function creates an empty cache of search result pages.
+        The memory budget is the total number of image ids of all pages: when it is exceeded,
+        the least recently used pages are evicted. Pages are indexed by the ids they hold and the tags they filter on,
+        so a write drops only the pages it can change.
+
+        :param self: Represent the instance of the class
+        :param max_ids: int: How many image ids the cache keeps at most
+        :param ttl: float | None: How many seconds a page is kept, None keeps pages until they are evicted or invalidated
+        :return: The object created
+        """
+        self.max_ids = max_ids
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_image = defaultdict(set)
+        self._by_tag = defaultdict(set)
+        self._by_words = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        metrics.register_gauge("search_cache_size", self.__len__)
+        metrics.register_gauge("search_cache_ids", lambda: self._size)
+        metrics.register_gauge("search_cache_hit_rate", lambda: self.stats()["hit_rate"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _count(self, event: str, kind: str | None = None):
+        """
+        The _count function increments a statistic of the cache and its counters in the metrics registry.
+
+        :param self: Represent the instance of the class
+        :param event: str: hits, misses, evictions or invalidations
+        :param kind: str | None: The kind of search, for example tag or words, for hits and misses
+        :return: None
+        """
+        setattr(self, event, getattr(self, event) + 1)
+        metrics.inc(f"search_cache_{event}_total")
+        if kind:
+            metrics.inc(f"search_cache_{kind}_{event}_total")
+
+    def _remove(self, key) -> SearchEntry | None:
+        """
+        The _remove function takes a page out of the cache and its indexes, the lock must be held.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the page
+        :return: The removed page or None
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._size -= len(entry.ids)
+        for image_id in entry.ids:
+            keys = self._by_image[image_id]
+            keys.discard(key)
+            if not keys:
+                del self._by_image[image_id]
+        for name in entry.tags:
+            keys = self._by_tag[name]
+            keys.discard(key)
+            if not keys:
+                del self._by_tag[name]
+        self._by_words.discard(key)
+        return entry
+
+    def get(self, key) -> SearchEntry | None:
+        """
+        The get function returns the cached page stored under key and marks it as recently used.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the page, a tuple whose first item is the kind of search
+        :return: The cached page or None
+        :rtype: SearchEntry | None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._count("misses", key[0])
+                return None
+            self._entries.move_to_end(key)
+            self._count("hits", key[0])
+            return entry
+
+    def set(self, key, ids: list[int], next_cursor: str | None, generation: int, tags=(), words: str | None = None,
+            fulltext: bool = False, by_rating: bool = False):
+        """
+        The set function stores a page of search results, evicting the least recently used pages
+        until the ids fit in the budget. The page is not stored if the cache was invalidated since generation
+        was read, the search may have run before the write that invalidated it.
+
+        :param self: Represent the instance of the class
+        :param key: The key of the page
+        :param ids: list[int]: The ids of the found images in the order of the page
+        :param next_cursor: str | None: The cursor of the next page
+        :param generation: int: The generation of the cache read before the search ran
+        :param tags: The names of the tags the search filters on
+        :param words: str | None: The normalized words of a search by words
+        :param fulltext: bool: Whether the words are matched by the full-text search
+        :param by_rating: bool: Whether the page is sorted by rating
+        :return: None
+        """
+        if len(ids) > self.max_ids:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        entry = SearchEntry(list(ids), next_cursor, tags, words, fulltext, by_rating, expires)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += len(entry.ids)
+            for image_id in entry.ids:
+                self._by_image[image_id].add(key)
+            for name in entry.tags:
+                self._by_tag[name].add(key)
+            if words is not None:
+                self._by_words.add(key)
+            while self._size > self.max_ids:
+                self._remove(next(iter(self._entries)))
+                self._count("evictions")
+
+    def invalidate_image(self, image_id: int, tags=(), description: str | None = None, rating_only: bool = False) -> int:
+        """
+        The invalidate_image function drops the pages a write to an image can change.
+        Pages are keyset pages, so an image only changes the pages that hold it and the pages it may enter:
+        those filtering on one of its tags, or whose words match its description.
+        A new rating only moves the image within the pages sorted by rating.
+
+        :param self: Represent the instance of the class
+        :param image_id: int: The id of the image
+        :param tags: The names of the tags of the image, and of the tags it lost
+        :param description: str | None: The description of the image
+        :param rating_only: bool: Whether only the rating of the image changed
+        :return: The number of dropped pages
+        :rtype: int
+        """
+        with self._lock:
+            self.generation += 1
+            candidates = set(self._by_words)
+            for name in tags:
+                candidates |= self._by_tag.get(name, set())
+            stale = {key for key in candidates if self._entries[key].matches(tags, description)}
+            stale |= self._by_image.get(image_id, set())
+            if rating_only:
+                stale = {key for key in stale if self._entries[key].by_rating}
+            for key in stale:
+                self._remove(key)
+                self._count("invalidations")
+        return len(stale)
+
+    def invalidate_tags(self, names) -> int:
+        """
+        The invalidate_tags function drops the pages filtering on renamed or deleted tags.
+
+        :param self: Represent the instance of the class
+        :param names: The names of the tags
+        :return: The number of dropped pages
+        :rtype: int
+        """
+        with self._lock:
+            self.generation += 1
+            stale = set()
+            for name in names:
+                stale |= self._by_tag.get(name, set())
+            for key in stale:
+                self._remove(key)
+                self._count("invalidations")
+        return len(stale)
+
+    def clear(self):
+        """
+        The clear function removes every page, the statistics are kept.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_image.clear()
+            self._by_tag.clear()
+            self._by_words.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the hit and miss statistics of the cache.
+
+        :param self: Represent the instance of the class
+        :return: The number of pages and ids, hits, misses, evictions, invalidations and hit rate
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "ids": self._size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+search_cache = SearchCache(settings.search_cache_max_ids, settings.search_cache_ttl)
+
+
+def apply_search_change(message: str | None):
+    """
+    The apply_search_change function applies a change published on the search channel to the cache of this worker.
+
+    :param message: str | None: The change as JSON, None empties the cache
+    :return: None
+    """
+    if message is None:
+        search_cache.clear()
+        return
+    change = json.loads(message)
+    if "image" in change:
+        search_cache.invalidate_image(change["image"], change["tags"], change["description"], change["rating_only"])
+    else:
+        search_cache.invalidate_tags(change["tags"])
+
+
+bus.subscribe(SEARCH_CHANNEL, apply_search_change)
+
+
+def invalidate_image_searches(image_id: int, tags=(), description: str | None = None, rating_only: bool = False):
+    """
+    The invalidate_image_searches function tells every worker to drop the search pages a write to an image can change.
+
+    :param image_id: int: The id of the image
+    :param tags: The names of the tags of the image, and of the tags it lost
+    :param description: str | None: The description of the image
+    :param rating_only: bool: Whether only the rating of the image changed
+    :return: None
+    """
+    bus.publish(SEARCH_CHANNEL, json.dumps({"image": image_id, "tags": list(tags), "description": description,
+                                            "rating_only": rating_only}))
+
+
+def invalidate_tag_searches(names):
+    """
+    The invalidate_tag_searches function tells every worker to drop the search pages filtering on some tags.
+
+    :param names: The names of the renamed or deleted tags
+    :return: None
+    """
+    bus.publish(SEARCH_CHANNEL, json.dumps({"tags": list(names)}))
@@ -0,0 +1,110 @@
+"""Background tasks that periodically purge expired rows"""
+
+import asyncio
+import time
+
+from src.conf.config import settings
+from src.database.db import SessionLocal
+from src.repository.tokens import delete_expired_refresh_sessions, load_revoked_tokens
+from src.services.metrics import metrics
+
+
+async def sweep_refresh_tokens() -> int:
+    """
+    The sweep_refresh_tokens function deletes the expired refresh token sessions in batches.
+
+    :return: The number of deleted sessions
+    :rtype: int
+    """
+    async with SessionLocal() as db:
+        return await delete_expired_refresh_sessions(db, settings.refresh_token_sweep_batch_size)
+
+
+async def reload_revoked_tokens() -> int:
+    """
+    The reload_revoked_tokens function deletes the revocations of expired tokens and rebuilds the revocation filter
+    of this worker, which learns this way about the tokens revoked by other workers.
+
+    :return: The number of deleted revocations
+    :rtype: int
+    """
+    async with SessionLocal() as db:
+        return await load_revoked_tokens(db)
+
+
+class Sweeper:
+
+    def __init__(self, name: str, interval: float, handler):
+        """
+        The __init__ function sets up a sweep, its task is started by start.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the sweep, used as the prefix of its metrics
+        :param interval: float: How many seconds pass between two sweeps
+        :param handler: The coroutine function that sweeps and returns the number of deleted rows
+        :return: The object created
+        """
+        self.name = name
+        self.interval = interval
+        self.handler = handler
+        # The error of the last failed sweep, kept for operators
+        self.last_error = None
+        self._task = None
+
+    def start(self):
+        """
+        The start function starts the sweep on the running event loop, it does nothing if it is running.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        The stop function cancels the sweep.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def sweep(self) -> int:
+        """
+        The sweep function runs the handler once and records how many rows it deleted and how long it took.
+        A failed sweep is counted and its error kept in last_error, the next one runs as planned.
+
+        :param self: Represent the instance of the class
+        :return: The number of deleted rows, 0 if the sweep failed
+        :rtype: int
+        """
+        started = time.perf_counter()
+        try:
+            deleted = await self.handler()
+        except Exception as error:
+            self.last_error = repr(error)
+            metrics.inc(f"{self.name}_sweep_failures_total")
+            return 0
+        finally:
+            metrics.observe(f"{self.name}_sweep_seconds", time.perf_counter() - started)
+        metrics.inc(f"{self.name}_swept_rows_total", deleted)
+        return deleted
+
+    async def _run(self):
+        """
+        The _run function sweeps every interval seconds until it is cancelled.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+
+refresh_token_sweeper = Sweeper("refresh_tokens", settings.refresh_token_sweep_interval, sweep_refresh_tokens)
+revoked_tokens_sweeper = Sweeper("revoked_tokens", settings.revoked_tokens_reload_interval, reload_revoked_tokens)
@@ -0,0 +1,227 @@
+"""In-memory prefix index of tag names for autocomplete"""
+
+import asyncio
+import bisect
+import heapq
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.db import SessionLocal, is_replica
+from src.database.models import Tag
+from src.services.cache import LRUCache
+
+MAX_SUGGESTIONS = 50
+
+
+class TagSuggestIndex:
+
+    def __init__(self, ttl: float, memo_size: int = 4096):
+        """
+        The __init__ function creates an empty index, it is loaded from the database on the first suggestion.
+        Changes made by this worker are applied to the index as they are committed, the whole index is reloaded
+        every ttl seconds to pick up the changes made by other workers. Changes committed while a reload
+        is running are replayed on the new snapshot.
+
+        :param self: Represent the instance of the class
+        :param ttl: float: How many seconds the loaded index is used before it is reloaded
+        :param memo_size: int: How many prefixes keep their ranked suggestions
+        :return: The object created
+        """
+        self.ttl = ttl
+        self._names = []
+        self._tags = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        self._memo = LRUCache(memo_size, name="tag_suggest")
+        self._pending = None
+
+    def _record(self, change: str, *args):
+        """
+        The _record function remembers a change made while the index is reloading, to replay it after the load.
+
+        :param self: Represent the instance of the class
+        :param change: str: The name of the method that makes the change
+        :param args: The arguments of the change
+        :return: None
+        """
+        if self._pending is not None:
+            self._pending.append((change, args))
+
+    def _forget_prefixes(self, name: str):
+        """
+        The _forget_prefixes function drops the memoized suggestions of every prefix of a name.
+
+        :param self: Represent the instance of the class
+        :param name: str: The tag name that was added, removed or used
+        :return: None
+        """
+        for end in range(1, len(name) + 1):
+            self._memo.pop(name[:end])
+
+    def load(self, rows):
+        """
+        The load function replaces the content of the index.
+
+        :param self: Represent the instance of the class
+        :param rows: Tuples of tag id, tag name and usage count
+        :return: None
+        """
+        self._tags = {name: [tag_id, usage] for tag_id, name, usage in rows}
+        self._names = sorted(self._tags)
+        self._memo.clear()
+        self._loaded_at = time.monotonic()
+
+    def clear(self):
+        """
+        The clear function empties the index, the next suggestion loads it again.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        self._names = []
+        self._tags = {}
+        self._memo.clear()
+        self._loaded_at = None
+
+    async def ensure_loaded(self, db: AsyncSession):
+        """
+        The ensure_loaded function loads the tag names and their usage counts when the index is empty or too old.
+        The index is loaded from the primary, a snapshot of a lagging replica would be served for ttl seconds.
+        The changes committed while the query runs may or may not be in the snapshot, they are replayed on it:
+        adding, removing and renaming a tag twice changes nothing, a usage count may be off by the replayed
+        changes until the next reload.
+
+        :param self: Represent the instance of the class
+        :param db: AsyncSession: Access the database, a replica session is replaced by a primary one
+        :return: None
+        """
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            self._pending = []
+            try:
+                if is_replica(db):
+                    async with SessionLocal() as primary_db:
+                        rows = (await primary_db.execute(select(Tag.id, Tag.name, Tag.usage_count))).all()
+                else:
+                    rows = (await db.execute(select(Tag.id, Tag.name, Tag.usage_count))).all()
+            finally:
+                pending, self._pending = self._pending, None
+            self.load(rows)
+            for change, args in pending:
+                getattr(self, change)(*args)
+
+    def add(self, tag_id: int, name: str, usage: int = 0):
+        """
+        The add function puts a new tag into the index.
+
+        :param self: Represent the instance of the class
+        :param tag_id: int: The id of the tag
+        :param name: str: The name of the tag
+        :param usage: int: How many images have the tag
+        :return: None
+        """
+        self._record("add", tag_id, name, usage)
+        self._add(tag_id, name, usage)
+
+    def _add(self, tag_id: int, name: str, usage: int):
+        """
+        The _add function puts a new tag into the loaded index.
+
+        :param self: Represent the instance of the class
+        :param tag_id: int: The id of the tag
+        :param name: str: The name of the tag
+        :param usage: int: How many images have the tag
+        :return: None
+        """
+        if self._loaded_at is None or name in self._tags:
+            return
+        bisect.insort(self._names, name)
+        self._tags[name] = [tag_id, usage]
+        self._forget_prefixes(name)
+
+    def remove(self, name: str):
+        """
+        The remove function takes a deleted tag out of the index.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the tag
+        :return: None
+        """
+        self._record("remove", name)
+        self._remove(name)
+
+    def _remove(self, name: str):
+        """
+        The _remove function takes a tag out of the loaded index.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the tag
+        :return: None
+        """
+        if self._tags.pop(name, None) is None:
+            return
+        del self._names[bisect.bisect_left(self._names, name)]
+        self._forget_prefixes(name)
+
+    def rename(self, old_name: str, new_name: str):
+        """
+        The rename function moves a renamed tag to its new place in the index, its usage count is kept.
+
+        :param self: Represent the instance of the class
+        :param old_name: str: The name before the update
+        :param new_name: str: The name after the update
+        :return: None
+        """
+        self._record("rename", old_name, new_name)
+        tag = self._tags.get(old_name)
+        if tag is None:
+            return
+        self._remove(old_name)
+        self._add(tag[0], new_name, tag[1])
+
+    def use(self, names, delta: int = 1):
+        """
+        The use function changes the usage count of tags that were attached to or detached from an image.
+
+        :param self: Represent the instance of the class
+        :param names: The names of the tags
+        :param delta: int: 1 when the tags were attached, -1 when they were detached
+        :return: None
+        """
+        names = list(names)
+        self._record("use", names, delta)
+        for name in names:
+            tag = self._tags.get(name)
+            if tag is not None:
+                tag[1] = max(tag[1] + delta, 0)
+                self._forget_prefixes(name)
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        """
+        The suggest function returns the most used tags whose names start with the prefix.
+        The names matching a prefix form one slice of the sorted names, found by binary search,
+        the ranked top of every prefix is memoized until a tag with that prefix changes.
+
+        :param self: Represent the instance of the class
+        :param prefix: str: The beginning of the tag name, in lowercase
+        :param limit: int: The number of suggestions, at most MAX_SUGGESTIONS
+        :return: The suggestions, each with the id, name and usage count of a tag
+        :rtype: list[dict]
+        """
+        ranked = self._memo.get(prefix)
+        if ranked is None:
+            start = bisect.bisect_left(self._names, prefix)
+            end = bisect.bisect_left(self._names, prefix + "\U0010ffff", lo=start)
+            top = heapq.nsmallest(MAX_SUGGESTIONS, self._names[start:end], key=lambda name: -self._tags[name][1])
+            ranked = [{"id": self._tags[name][0], "name": name, "usage_count": self._tags[name][1]} for name in top]
+            self._memo.set(prefix, ranked)
+        return ranked[:limit]
+
+
+tag_index = TagSuggestIndex(settings.tag_suggest_ttl)
@@ -0,0 +1,229 @@
+"""In-process job queue for image uploads that are answered before Cloudinary is done"""
+
+import asyncio
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException, UploadFile, status
+
+from src.conf.config import settings
+from src.database.db import SessionLocal
+from src.database.models import User
+from src.repository import images as repository_images
+from src.schemas import ImageAddModel
+from src.services.metrics import metrics
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadJob:
+
+    def __init__(self, user_id: int, body: ImageAddModel, tags: list[str], file, filename: str):
+        """
+        The __init__ function creates a queued upload job.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The id of the owner of the new image
+        :param body: ImageAddModel: The description of the new image
+        :param tags: list[str]: The normalized tags of the new image
+        :param file: The spooled copy of the uploaded file, the job closes it when it is done
+        :param filename: str: The name of the uploaded file
+        :return: The object created
+        """
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.body = body
+        self.tags = tags
+        self.file = file
+        self.filename = filename
+        self.status = "queued"
+        self.image_id = None
+        self.detail = None
+        # The unexpected error that failed the job, kept for operators and not shown to the client
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+
+async def spool_upload(file: UploadFile):
+    """
+    The spool_upload function copies an uploaded file to a temporary file that outlives the request.
+    Small files stay in memory, larger ones roll over to disk.
+
+    :param file: UploadFile: The uploaded file
+    :return: The temporary file, positioned at its start
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.upload_spool_max_size)
+    while chunk := await file.read(SPOOL_CHUNK_SIZE):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+async def ingest(job: UploadJob):
+    """
+    The ingest function does the work of an upload job: the Cloudinary upload, the tags and the Image row.
+    Every job gets its own database session.
+
+    :param job: UploadJob: The job to run
+    :return: None
+    """
+    async with SessionLocal() as db:
+        user = await db.get(User, job.user_id)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        image, details = await repository_images.upload_image(db, job.body, job.tags, job.file, job.filename, user)
+    job.image_id = image.id
+    job.detail = "Image was successfully added." + details
+
+
+class UploadJobs:
+
+    def __init__(self, workers: int, queue_size: int, ttl: float, handler=ingest):
+        """
+        The __init__ function sets up the queue, the workers are started by start.
+
+        :param self: Represent the instance of the class
+        :param workers: int: How many jobs run at the same time
+        :param queue_size: int: How many jobs may wait, further submissions get a 503
+        :param ttl: float: How many seconds a finished job can still be polled
+        :param handler: The coroutine function that runs a job
+        :return: The object created
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.handler = handler
+        self._jobs = {}
+        self._queue = None
+        self._tasks = []
+        metrics.register_gauge("upload_jobs_queue_depth", lambda: self._queue.qsize() if self._queue else 0)
+
+    def start(self):
+        """
+        The start function starts the workers on the running event loop, it does nothing if they are running.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        The stop function cancels the workers. Jobs still in the queue are dropped and their files closed.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.file.close()
+            self._finish(job, "failed", "The server stopped before the upload was processed")
+
+    def submit(self, job: UploadJob) -> UploadJob:
+        """
+        The submit function puts a job in the queue.
+        A full queue raises an HTTPException with status 503, the client should retry later.
+
+        :param self: Represent the instance of the class
+        :param job: UploadJob: The job to run
+        :return: The queued job
+        :rtype: UploadJob
+        """
+        self.start()
+        self._prune()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            job.file.close()
+            metrics.inc("upload_jobs_rejected_total")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many uploads in progress, try again later", headers={"Retry-After": "5"})
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, user_id: int) -> UploadJob | None:
+        """
+        The get function returns a job of a user.
+
+        :param self: Represent the instance of the class
+        :param job_id: str: The id of the job
+        :param user_id: int: The id of the user who asks, only the owner can see a job
+        :return: The job, or None if there is no such job of the user
+        :rtype: UploadJob | None
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self):
+        """
+        The _prune function forgets the jobs that finished more than ttl seconds ago.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        expired = datetime.utcnow().timestamp() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at.timestamp() < expired]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: UploadJob, job_status: str, detail: str | None = None):
+        """
+        The _finish function marks a job as done or failed.
+
+        :param self: Represent the instance of the class
+        :param job: UploadJob: The finished job
+        :param job_status: str: done or failed
+        :param detail: str | None: The message for the client, the handler may have set it already
+        :return: None
+        """
+        job.status = job_status
+        if detail is not None:
+            job.detail = detail
+        job.finished_at = datetime.utcnow()
+        metrics.inc(f"upload_jobs_{job_status}_total")
+
+    async def _worker(self):
+        """
+        The _worker function runs the queued jobs one after another until it is cancelled.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        while True:
+            job = await self._queue.get()
+            started = time.perf_counter()
+            job.status = "processing"
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                self._finish(job, "failed", "The server stopped before the upload was processed")
+                raise
+            except HTTPException as error:
+                self._finish(job, "failed", error.detail)
+            except Exception as error:
+                job.error = repr(error)
+                metrics.inc("upload_jobs_errors_total")
+                self._finish(job, "failed", "The upload failed")
+            else:
+                self._finish(job, "done")
+            finally:
+                job.file.close()
+                metrics.observe("upload_jobs_seconds", time.perf_counter() - started)
+                metrics.observe("upload_jobs_latency_seconds",
+                                (job.finished_at - job.created_at).total_seconds())
+                self._queue.task_done()
+
+
+upload_jobs = UploadJobs(settings.upload_workers, settings.upload_queue_size, settings.upload_job_ttl)
@@ -1,51 +1,69 @@
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 
 from main import app
 from src.database.models import Base
 from src.database.db import get_db
+from src.repository.tags import tag_cache
+from src.repository.tokens import revoked_filter
+from src.repository.users import user_cache
+from src.services.auth import token_cache
+from src.services.search_cache import search_cache
+from src.services.tag_suggest import tag_index
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=NullPool
 )
-TestingSessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=engine)
+
+
+async def create_database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
 
 
 @pytest.fixture(scope="module")
 def session():
     # Create the database
 
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    asyncio.run(create_database())
 
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    yield TestingSessionLocal
 
 
 @pytest.fixture(scope="module")
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with session() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
 
     yield TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Every test gets a fresh database, ids cached by another test would point to other rows
+    tag_cache.clear()
+    tag_index.clear()
+    search_cache.clear()
+    user_cache.clear()
+    token_cache.clear()
+    revoked_filter.clear()
+
+
 @pytest.fixture(scope="module")
 def user():
     return {"username": "ghost", "email": "ghost@example.com", "password": "123456789", "bio":"I'm test user", "location":"Ghost city"}
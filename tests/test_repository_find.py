@@ -1,31 +1,33 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.session import Session
+from fastapi import HTTPException
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 import pytest
+import pytest_asyncio
 import asyncio
 
 from src.repository.ratings import get_average_rating
-from src.database.models import Base, User, Image, Tag, Rating
-from src.schemas import SortField
-from src.repository.find import get_photo_by_tag, get_photo_by_key_words
-
-DATABASE_URL = "sqlite:///test.db"
-
-
-@pytest.fixture
-def db():
-    engine = create_engine(DATABASE_URL)
-    Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
-    try:
+from src.database.models import Base, User, Image, Tag, Rating, image_m2m_tag
+from src.schemas import KeyWordsSortField, SortField, SearchMode
+from src.repository.find import get_photo_by_tag, get_photo_by_tags, get_photo_by_key_words, fulltext_search, split_tag_names, \
+    get_tag_facets, get_tags_facets, get_key_words_facets
+from src.repository.tags import get_tag_id
+
+DATABASE_URL = "sqlite+aiosqlite:///test.db"
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine(DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+    await engine.dispose()
 
 
 @pytest.mark.asyncio
-async def test_get_photo_by_tag(db: Session):
+async def test_get_photo_by_tag(db: AsyncSession):
     tag_name = "test_tag"
     tag = Tag(name=tag_name)
     image1 = Image(description="Test Image 1")
@@ -38,46 +40,205 @@ async def test_get_photo_by_tag(db: Session):
     db.add(image1)
     db.add(image2)
     db.add(image3)
-    db.commit()
+    await db.commit()
 
 
-    sorted_images = await get_photo_by_tag(tag_name, db, SortField.date)
+    sorted_images, _ = await get_photo_by_tag(tag_name, db, SortField.date)
     assert len(sorted_images) == 3
     assert sorted_images[0].created_at <= sorted_images[1].created_at
 
-    sorted_images = await get_photo_by_tag(tag_name, db, SortField.rating)
+    sorted_images, _ = await get_photo_by_tag(tag_name, db, SortField.rating)
     assert len(sorted_images) == 3
 
 
 @pytest.mark.asyncio
-async def test_get_photo_by_key_words(db: Session):
+async def test_get_photo_by_key_words(db: AsyncSession):
     image1 = Image(description="Test Image 1")
     image2 = Image(description="Test Image 2")
     image3 = Image(description="Another Image")
     db.add(image1)
     db.add(image2)
     db.add(image3)
-    db.commit()
+    await db.commit()
 
-    sorted_images = await get_photo_by_key_words("Test", db, SortField.date)
+    sorted_images, _ = await get_photo_by_key_words("Test", db, SortField.date)
     assert len(sorted_images) == 2
     assert sorted_images[0].created_at <= sorted_images[1].created_at
 
-    sorted_images = await get_photo_by_key_words("Test", db, SortField.rating)
+    sorted_images, _ = await get_photo_by_key_words("Test", db, SortField.rating)
     assert len(sorted_images) == 2
 
 
 @pytest.mark.asyncio
-async def test_get_average_rating(db: Session):
+async def test_get_average_rating(db: AsyncSession):
     image = Image(description="Test Image")
     rating1 = Rating(rating=4)
     rating2 = Rating(rating=5)
     image.ratings.append(rating1)
     image.ratings.append(rating2)
     db.add(image)
-    db.commit()
+    await db.commit()
 
     average_rating = await get_average_rating(image.id, db)
     assert average_rating == pytest.approx((4 + 5) / 2.0, 0.01)
 
 
+
+
+@pytest_asyncio.fixture
+async def fulltext_db():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        db.add_all([Image(description="Sunny beach at noon"), Image(description="Beach, sunny beach and more beach"),
+                    Image(description="Mountain lake"), Image(description="The sun over the beach")])
+        await db.commit()
+        yield db
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_get_photo_by_key_words_fulltext(fulltext_db: AsyncSession):
+    images, _ = await get_photo_by_key_words("beach sunny", fulltext_db, KeyWordsSortField.relevance, SearchMode.fulltext)
+    assert [image.description for image in images] == ["Beach, sunny beach and more beach", "Sunny beach at noon"]
+
+    images, _ = await get_photo_by_key_words("beach", fulltext_db, SortField.date, SearchMode.fulltext)
+    assert len(images) == 3
+    assert (await get_photo_by_key_words('lake" OR', fulltext_db, SortField.date, SearchMode.fulltext)) == ([], None)
+    assert len((await get_photo_by_key_words('"lake*', fulltext_db, SortField.date, SearchMode.fulltext))[0]) == 1
+    assert await get_photo_by_key_words("!!", fulltext_db, SortField.date, SearchMode.fulltext) == ([], None)
+
+    image = images[0]
+    image.description = "Forest"
+    await fulltext_db.commit()
+    images, _ = await get_photo_by_key_words("beach", fulltext_db, SortField.rating, SearchMode.fulltext)
+    assert len(images) == 2
+
+
+@pytest.mark.asyncio
+async def test_fulltext_search_uses_the_index(fulltext_db: AsyncSession):
+    query, relevance = fulltext_search("beach", "sqlite")
+    compiled = query.order_by(relevance).compile(compile_kwargs={"literal_binds": True})
+    plan = (await fulltext_db.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))).all()
+    assert any("VIRTUAL TABLE INDEX" in row[-1] for row in plan), plan
+    assert "SCAN images" not in [row[-1] for row in plan], plan
+
+
+@pytest.mark.asyncio
+async def test_get_photo_by_key_words_matches_wildcards_literally(fulltext_db: AsyncSession):
+    fulltext_db.add_all([Image(description="100% sunny_day"), Image(description="1000 sunny days")])
+    await fulltext_db.commit()
+
+    images, _ = await get_photo_by_key_words("0% sunny_", fulltext_db, SortField.date)
+    assert [image.description for image in images] == ["100% sunny_day"]
+    assert await get_photo_by_key_words("\\", fulltext_db, SortField.date) == ([], None)
+    assert len((await get_photo_by_key_words("SUNNY", fulltext_db, SortField.date))[0]) == 4
+
+
+@pytest.mark.asyncio
+async def test_find_pages_are_sorted_by_the_database(fulltext_db: AsyncSession):
+    tag = Tag(name="page_tag")
+    for rating_sum, rating_count in [(9, 2), (5, 1), (0, 0), (3, 1), (9, 2)]:
+        fulltext_db.add(Image(description=f"Beach page {rating_sum}/{rating_count}", tags=[tag],
+                              rating_sum=rating_sum, rating_count=rating_count))
+    await fulltext_db.commit()
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = await get_photo_by_tag("page_tag", fulltext_db, SortField.rating, limit=2, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [2, 2, 1]
+    ratings = [rating for page in pages for _, rating in page]
+    assert ratings == [5.0, 4.5, 4.5, 3.0, 0.0]
+    assert len({image.id for page in pages for image, _ in page}) == 5
+
+    first, cursor = await get_photo_by_key_words("page", fulltext_db, SortField.date, limit=3)
+    second, last = await get_photo_by_key_words("page", fulltext_db, SortField.date, limit=3, cursor=cursor)
+    assert last is None
+    assert [image.id for image in first + second] == sorted(image.id for image in first + second)
+
+    first, cursor = await get_photo_by_key_words("beach", fulltext_db, KeyWordsSortField.relevance, SearchMode.fulltext, 4)
+    second, _ = await get_photo_by_key_words("beach", fulltext_db, KeyWordsSortField.relevance, SearchMode.fulltext, 4, cursor)
+    assert first[0].description == "Beach, sunny beach and more beach"
+    assert len(first + second) == 8
+    assert len({image.id for image in first + second}) == 8
+
+    with pytest.raises(HTTPException) as error:
+        await get_photo_by_tag("page_tag", fulltext_db, SortField.date, limit=2, cursor="bm90IGEgY3Vyc29y")
+    assert error.value.status_code == 400
+
+
+@pytest_asyncio.fixture
+async def tagged_db(fulltext_db: AsyncSession):
+    sea, sun, night, city = Tag(name="sea"), Tag(name="sun"), Tag(name="night"), Tag(name="city")
+    fulltext_db.add_all([
+        Image(description="sea sun", tags=[sea, sun], rating_sum=4, rating_count=1),
+        Image(description="sea night", tags=[sea, night], rating_sum=5, rating_count=1),
+        Image(description="sea sun night", tags=[sea, sun, night], rating_sum=3, rating_count=1),
+        Image(description="city sun", tags=[city, sun], rating_sum=0, rating_count=0),
+        Image(description="city night", tags=[city, night], rating_sum=0, rating_count=0),
+    ])
+    await fulltext_db.commit()
+    yield fulltext_db
+
+
+async def described(all_tags, any_tags, none_tags, db):
+    images, _ = await get_photo_by_tags(all_tags, any_tags, none_tags, db, SortField.date)
+    return sorted(image.description for image in images)
+
+
+@pytest.mark.asyncio
+async def test_get_photo_by_tags(tagged_db: AsyncSession):
+    assert await described(["sea", "sun"], [], [], tagged_db) == ["sea sun", "sea sun night"]
+    assert await described(["sea", "sun"], [], ["night"], tagged_db) == ["sea sun"]
+    assert await described([], ["city", "sea"], ["sun"], tagged_db) == ["city night", "sea night"]
+    assert await described(["sun"], ["city", "night"], [], tagged_db) == ["city sun", "sea sun night"]
+    assert await described(["sea"], ["missing"], [], tagged_db) == []
+    assert await described(["sea", "missing"], [], [], tagged_db) == []
+    assert await described([], ["sea", "missing"], ["missing"], tagged_db) == ["sea night", "sea sun", "sea sun night"]
+
+    images, cursor = await get_photo_by_tags(["sea"], [], [], tagged_db, SortField.rating, limit=2)
+    assert [(image.description, rating) for image, rating in images] == [("sea night", 5.0), ("sea sun", 4.0)]
+    images, cursor = await get_photo_by_tags(["sea"], [], [], tagged_db, SortField.rating, limit=2, cursor=cursor)
+    assert [image.description for image, _ in images] == ["sea sun night"]
+    assert cursor is None
+
+    with pytest.raises(HTTPException) as error:
+        await get_photo_by_tags([], [], ["sea"], tagged_db, SortField.date)
+    assert error.value.status_code == 400
+    assert split_tag_names(" sea, sun,,sea ") == ["sea", "sun"]
+
+
+@pytest.mark.asyncio
+async def test_get_photo_by_tags_uses_the_tag_index(tagged_db: AsyncSession):
+    tag_id, image_id = image_m2m_tag.c.tag_id, image_m2m_tag.c.image_id
+    query = select(image_id).filter(tag_id.in_([1, 2])).group_by(image_id)
+    compiled = query.compile(compile_kwargs={"literal_binds": True})
+    plan = (await tagged_db.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))).all()
+    assert any("COVERING INDEX ix_image_m2m_tag_tag_id_image_id" in row[-1] for row in plan), plan
+
+
+@pytest.mark.asyncio
+async def test_facets_are_counted_in_one_statement(tagged_db: AsyncSession):
+    await get_tag_id("sea", tagged_db)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(tagged_db.get_bind(), "before_cursor_execute", listener)
+    facets = await get_tag_facets("sea", tagged_db)
+    event.remove(tagged_db.get_bind(), "before_cursor_execute", listener)
+
+    assert len(statements) == 1
+    assert facets["tags"] == [{"value": "night", "count": 2}, {"value": "sun", "count": 2}]
+    assert facets["ratings"] == [{"value": "5", "count": 1}, {"value": "4", "count": 1}, {"value": "3", "count": 1}]
+
+    facets = await get_key_words_facets("sun", tagged_db, facet_limit=1)
+    assert facets["tags"] == [{"value": "sun", "count": 3}]
+    assert facets["ratings"][-1] == {"value": "unrated", "count": 4}
+    facets = await get_tags_facets([], ["city"], ["sun"], tagged_db)
+    assert facets == {"tags": [{"value": "city", "count": 1}, {"value": "night", "count": 1}],
+                      "ratings": [{"value": "unrated", "count": 1}]}
+    assert await get_tag_facets("missing", tagged_db) == {"tags": [], "ratings": []}
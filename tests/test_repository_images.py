@@ -0,0 +1,106 @@
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+import pytest_asyncio
+
+from src.database.models import Base, User, Image, Tag, Comment
+from src.repository.images import get_images, get_image
+from src.schemas import ImageGetAllResponse, ImageGetResponse
+
+DATABASE_URL = "sqlite+aiosqlite://"
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def db(engine):
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        yield db
+
+
+@pytest_asyncio.fixture
+async def user(db: AsyncSession):
+    user = User(email="viewer@example.com", password="secret")
+    db.add(user)
+    await db.flush()
+    db.add_all([Image(description=f"Image {number}", url=f"url_{number}", user_id=user.id) for number in range(5)])
+    await db.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_get_images_pages_with_cursor(db: AsyncSession, user: User):
+    first_page, cursor = await get_images(db, user, limit=2)
+    assert [item["image"].description for item in first_page] == ["Image 0", "Image 1"]
+    assert cursor is not None
+
+    second_page, cursor = await get_images(db, user, limit=2, cursor=cursor)
+    assert [item["image"].description for item in second_page] == ["Image 2", "Image 3"]
+
+    last_page, cursor = await get_images(db, user, limit=2, cursor=cursor)
+    assert [item["image"].description for item in last_page] == ["Image 4"]
+    assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_get_images_rejects_invalid_cursor(db: AsyncSession, user: User):
+    with pytest.raises(HTTPException) as exc_info:
+        await get_images(db, user, limit=2, cursor="not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+
+async def seed_gallery(db: AsyncSession, user: User, size: int):
+    tags = [Tag(name=f"tag_{number}") for number in range(3)]
+    for number in range(size):
+        image = Image(description=f"Gallery {number}", url=f"gallery_{number}", user_id=user.id,
+                      tags=tags[:number % 3 + 1])
+        image.comments.append(Comment(content=f"Comment {number}", user_id=user.id))
+        db.add(image)
+    await db.commit()
+    await db.refresh(user)
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [3, 30])
+async def test_get_images_statement_count_is_fixed(engine, db: AsyncSession, user: User, size: int):
+    await seed_gallery(db, user, size)
+    statements = count_statements(engine)
+
+    items, _ = await get_images(db, user, limit=100)
+    response = ImageGetAllResponse(images=items)
+
+    assert len(response.images) == size + 5
+    assert all(item.image.tags for item in response.images[5:])
+    assert sum(len(item.comments) for item in response.images) == size
+    # images page + tags (selectinload) + comments (one IN query), serialization must not lazy-load anything
+    assert len(statements) == 3, statements
+
+
+@pytest.mark.asyncio
+async def test_get_image_statement_count_is_fixed(engine, db: AsyncSession, user: User):
+    await seed_gallery(db, user, 3)
+    image_id = await db.scalar(select(Image.id).filter(Image.description == "Gallery 2"))
+    statements = count_statements(engine)
+
+    image, comments, ratings = await get_image(db, image_id, user)
+    ImageGetResponse(image=image, comments=comments)
+
+    assert len(image.tags) == 3
+    assert ratings == 0
+    assert len(statements) == 3, statements
@@ -1,34 +1,33 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 import pytest
+import pytest_asyncio
 
 from src.database.models import Base, User, Message
 from src.repository.message import send_message, read_messages, delete_messages
 
-DATABASE_URL = "sqlite:///test.db"
+DATABASE_URL = "sqlite+aiosqlite:///test.db"
 
 
-@pytest.fixture
-def db():
-    engine = create_engine(DATABASE_URL)
-    Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
-    try:
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine(DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+    await engine.dispose()
 
 
 @pytest.mark.asyncio
-async def test_send_and_read_message(db: Session):
+async def test_send_and_read_message(db: AsyncSession):
     sender = User(email="sender@example.com")
     db.add(sender)
-    db.commit()
+    await db.commit()
 
     receiver = User(email="receiver@example.com")
     db.add(receiver)
-    db.commit()
+    await db.commit()
 
     message_text = "Test message"
     message = await send_message(receiver, sender, message_text, db)
@@ -45,14 +44,14 @@ async def test_send_and_read_message(db: Session):
 
 
 @pytest.mark.asyncio
-async def test_delete_message(db: Session):
+async def test_delete_message(db: AsyncSession):
     user = User(email="user@example.com")
     db.add(user)
-    db.commit()
+    await db.commit()
 
     sender = User(email="sender@example.com")
     db.add(sender)
-    db.commit()
+    await db.commit()
     message = await send_message(user, sender, "Test message", db)
 
     result = await delete_messages(message.id, user, db)
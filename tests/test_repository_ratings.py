@@ -0,0 +1,108 @@
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+import pytest_asyncio
+
+from src.database.models import Base, User, Image, Rating
+from src.schemas import RatingModel, RatingResponse
+from src.repository.ratings import (
+    get_average_rating,
+    get_average_ratings,
+    create_rating,
+    update_rating,
+    remove_rating,
+    rebuild_rating_aggregates,
+)
+
+DATABASE_URL = "sqlite+aiosqlite://"
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        yield db
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def image(db: AsyncSession):
+    owner = User(email="owner@example.com", password="secret")
+    db.add(owner)
+    await db.commit()
+    image = Image(description="Rated image", user_id=owner.id)
+    db.add(image)
+    await db.commit()
+    return image
+
+
+async def make_user(db: AsyncSession, email: str) -> User:
+    user = User(email=email, password="secret")
+    db.add(user)
+    await db.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_rating_writes_keep_aggregates(db: AsyncSession, image: Image):
+    first = await create_rating(image.id, RatingModel(four_stars=True), await make_user(db, "first@example.com"), db)
+    second = await create_rating(image.id, RatingModel(two_stars=True), await make_user(db, "second@example.com"), db)
+
+    await db.refresh(image)
+    assert (image.rating_sum, image.rating_count) == (6, 2)
+    assert (image.two_stars_count, image.four_stars_count) == (1, 1)
+    assert await get_average_rating(image.id, db) == pytest.approx(3.0)
+
+    await update_rating(second.id, RatingModel(five_stars=True), db)
+    await db.refresh(image)
+    assert (image.rating_sum, image.rating_count) == (9, 2)
+    assert (image.two_stars_count, image.five_stars_count) == (0, 1)
+
+    await remove_rating(first.id, db)
+    await db.refresh(image)
+    assert (image.rating_sum, image.rating_count, image.four_stars_count) == (5, 1, 0)
+    assert await get_average_rating(image.id, db) == pytest.approx(5.0)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_rating_aggregates(db: AsyncSession, image: Image):
+    for stars, email in ((1, "a@example.com"), (3, "b@example.com"), (3, "c@example.com")):
+        user = await make_user(db, email)
+        db.add(Rating(stars=stars, user_id=user.id, image_id=image.id))
+    await db.commit()
+    assert await get_average_rating(image.id, db) == 0
+
+    assert await rebuild_rating_aggregates(db) == 1
+    await db.refresh(image)
+    assert (image.rating_sum, image.rating_count) == (7, 3)
+    assert (image.one_star_count, image.three_stars_count) == (1, 2)
+    assert await get_average_rating(image.id, db) == pytest.approx(7 / 3)
+
+
+@pytest.mark.asyncio
+async def test_get_average_ratings(db: AsyncSession, image: Image):
+    unrated = Image(description="Unrated image")
+    db.add(unrated)
+    await db.commit()
+    await create_rating(image.id, RatingModel(three_stars=True), await make_user(db, "rater@example.com"), db)
+
+    averages = await get_average_ratings([image.id, unrated.id, 999], db)
+    assert averages == {image.id: pytest.approx(3.0), unrated.id: 0, 999: 0}
+    assert await get_average_ratings([], db) == {}
+
+
+@pytest.mark.asyncio
+async def test_rating_keeps_star_flags_at_api_edge(db: AsyncSession, image: Image):
+    rating = await create_rating(image.id, RatingModel(four_stars=True), await make_user(db, "flags@example.com"), db)
+    assert rating.stars == 4
+
+    response = RatingResponse.from_orm(rating)
+    assert response.four_stars is True
+    assert not any([response.one_star, response.two_stars, response.three_stars, response.five_stars])
+
+    assert await create_rating(image.id, RatingModel(one_star=True, two_stars=True),
+                               await make_user(db, "twice@example.com"), db) is None
+    assert await update_rating(rating.id, RatingModel(one_star=True, five_stars=True), db) is None
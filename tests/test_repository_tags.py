@@ -0,0 +1,141 @@
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+import pytest_asyncio
+
+from src.database.models import Base, User, Tag
+from src.repository.images import add_image, add_tag, delete_image
+from src.repository.tags import resolve_tags, get_tag_id, create_tag, update_tag, delete_tag, suggest_tags, get_popular_tags, tag_cache
+from src.schemas import ImageAddModel, ImageAddTagModel, TagModel
+
+DATABASE_URL = "sqlite+aiosqlite://"
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def db(engine):
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        yield db
+
+
+@pytest_asyncio.fixture
+async def user(db: AsyncSession):
+    user = User(email="tagger@example.com", password="secret")
+    db.add_all([user, Tag(name="sun"), Tag(name="sea")])
+    await db.commit()
+    return user
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.mark.asyncio
+async def test_resolve_tags_inserts_missing_tags_in_one_statement(engine, db: AsyncSession, user: User):
+    statements = count_statements(engine)
+
+    tags = await resolve_tags(["sun", "beach", "sea", "beach"], db)
+
+    assert [tag.name for tag in tags] == ["sun", "beach", "sea"]
+    assert all(tag.id for tag in tags)
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING for the new tags, one SELECT for the existing ones
+    assert len(statements) == 2, statements
+
+    statements.clear()
+    assert [tag.name for tag in await resolve_tags(["palm", "dune"], db)] == ["palm", "dune"]
+    assert len(statements) == 1, statements
+    assert await resolve_tags([], db) == []
+
+
+@pytest.mark.asyncio
+async def test_add_image_and_add_tag_resolve_tags(db: AsyncSession, user: User):
+    image, message = await add_image(db, ImageAddModel(description="Beach", tags=[]), ["Sun", "Beach"],
+                                     "url", "beach", user)
+    assert sorted(tag.name for tag in image.tags) == ["beach", "sun"]
+    assert message == ""
+
+    image, detail = await add_tag(db, image.id, ImageAddTagModel(tags=["a,b,c,d,e,f"]), user)
+    assert [tag.name for tag in image.tags] == ["a", "b", "c", "d", "e"]
+    assert detail == "Only five tags can be added to an image"
+    assert len((await db.scalars(select(Tag))).all()) == 2 + 1 + 6
+
+
+@pytest.mark.asyncio
+async def test_tag_cache_skips_lookups_and_is_invalidated(engine, db: AsyncSession, user: User):
+    tags = await resolve_tags(["sun", "sea"], db)
+    await db.commit()
+    statements = count_statements(engine)
+
+    assert await get_tag_id("sun", db) == tags[0].id
+    assert await get_tag_id("sea", db) == tags[1].id
+    assert statements == []
+
+    renamed = await update_tag(tags[0].id, TagModel(name="Sunset"), db)
+    assert renamed.name == "sunset"
+    assert tag_cache.get("sun") is None
+    assert await get_tag_id("sun", db) is None
+
+    await delete_tag(tags[1].id, db)
+    assert tag_cache.get("sea") is None
+    assert tag_cache.stats()["hits"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_tag_deleted_behind_the_cache_is_recreated(db: AsyncSession, user: User):
+    sun_id = await get_tag_id("sun", db)
+    assert tag_cache.get("sun") == sun_id
+    # Another worker deletes the tag, this worker is not told
+    await db.execute(text("DELETE FROM tags WHERE name = 'sun'"))
+    await db.commit()
+
+    image, _ = await add_image(db, ImageAddModel(description="Sunny", tags=[]), ["sun"], "url", "sunny", user)
+
+    assert [tag.name for tag in image.tags] == ["sun"]
+    assert image.tags[0].id != sun_id
+    links = (await db.execute(text("SELECT tag_id FROM image_m2m_tag WHERE image_id = :id"),
+                              {"id": image.id})).scalars().all()
+    assert links == [image.tags[0].id]
+    assert await db.scalar(select(Tag.usage_count).filter(Tag.id == image.tags[0].id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_suggest_tags_counts_usage(db: AsyncSession, user: User):
+    await add_image(db, ImageAddModel(description="Sunny", tags=[]), ["sun", "sunset"], "url_1", "sunny", user)
+    await add_image(db, ImageAddModel(description="Sunset", tags=[]), ["sunset"], "url_2", "sunset", user)
+
+    suggestions = await suggest_tags("SU", 10, db)
+    assert [(tag["name"], tag["usage_count"]) for tag in suggestions] == [("sunset", 2), ("sun", 1)]
+
+    tag = await create_tag(TagModel(name="Sundial"), db)
+    assert [tag["name"] for tag in await suggest_tags("sun", 10, db)] == ["sunset", "sun", "sundial"]
+    await delete_tag(tag.id, db)
+    assert [tag["name"] for tag in await suggest_tags("sun", 10, db)] == ["sunset", "sun"]
+
+
+@pytest.mark.asyncio
+async def test_usage_count_follows_image_tags(db: AsyncSession, user: User):
+    first, _ = await add_image(db, ImageAddModel(description="First", tags=[]), ["sun", "sea"], "url_1", "first", user)
+    await add_image(db, ImageAddModel(description="Second", tags=[]), ["sun", "palm"], "url_2", "second", user)
+    await add_tag(db, first.id, ImageAddTagModel(tags=["sun,dune"]), user)
+
+    async def usage():
+        return dict((await db.execute(select(Tag.name, Tag.usage_count))).all())
+
+    assert await usage() == {"sun": 2, "sea": 0, "palm": 1, "dune": 1}
+    assert [(tag.name, tag.usage_count) for tag in await get_popular_tags(2, db)] == [("sun", 2), ("dune", 1)]
+
+    await delete_image(db, first.id, user)
+    assert await usage() == {"sun": 1, "sea": 0, "palm": 1, "dune": 0}
+    assert [tag.name for tag in await get_popular_tags(10, db)] == ["palm", "sun"]
@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+import pytest_asyncio
+
+from src.database.models import Base, RefreshToken, RevokedToken, User
+from src.repository.access import block_user
+from src.repository.tokens import (create_refresh_session, delete_expired_refresh_sessions, delete_refresh_session,
+                                   delete_user_refresh_sessions, get_refresh_session, hash_token, is_token_revoked,
+                                   load_revoked_tokens, revoke_token, revoked_filter, rotate_refresh_session)
+from src.services.auth import auth_service
+
+DATABASE_URL = "sqlite+aiosqlite://"
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session_maker(engine):
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        db.add(User(username="ghost", email="ghost@example.com", password="secret", confirmed=True))
+        await db.commit()
+    return SessionLocal
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.mark.asyncio
+async def test_only_tokens_in_the_filter_are_looked_up(engine, session_maker):
+    statements = count_statements(engine)
+    async with session_maker() as db:
+        assert not await is_token_revoked("a" * 32, db)
+        assert statements == []
+
+        await revoke_token("b" * 32, 1, datetime.utcnow() + timedelta(minutes=15), db)
+        statements.clear()
+        assert await is_token_revoked("b" * 32, db)
+        assert len(statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_load_revoked_tokens_sweeps_expired_revocations(session_maker):
+    async with session_maker() as db:
+        db.add_all([RevokedToken(jti="a" * 32, expires_at=datetime.utcnow() - timedelta(minutes=1)),
+                    RevokedToken(jti="b" * 32, expires_at=datetime.utcnow() + timedelta(minutes=15))])
+        await db.commit()
+        revoked_filter.add("c" * 32)
+
+        assert await load_revoked_tokens(db) == 1
+        assert "b" * 32 in revoked_filter
+        assert "c" * 32 not in revoked_filter
+        assert (await db.scalars(select(RevokedToken.jti))).all() == ["b" * 32]
+
+
+@pytest.mark.asyncio
+async def test_reload_keeps_tokens_revoked_while_it_runs(monkeypatch, session_maker):
+    async with session_maker() as db, session_maker() as other_db:
+        scalars = db.scalars
+
+        async def revoke_during_reload(*args, **kwargs):
+            # Revoked after the reload read the table
+            result = await scalars(*args, **kwargs)
+            await revoke_token("d" * 32, 1, datetime.utcnow() + timedelta(minutes=15), other_db)
+            return result
+
+        monkeypatch.setattr(db, "scalars", revoke_during_reload)
+        await load_revoked_tokens(db)
+        assert "d" * 32 in revoked_filter
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_refuses_revoked_tokens_and_blocked_users(session_maker):
+    token = await auth_service.create_access_token(data={"sub": "ghost@example.com"})
+    async with session_maker() as db:
+        assert (await auth_service.get_current_user(token, db)).email == "ghost@example.com"
+
+        payload = auth_service.decode_token(token)
+        await revoke_token(payload["jti"], 1, datetime.utcfromtimestamp(payload["exp"]), db)
+        with pytest.raises(HTTPException) as exc_info:
+            await auth_service.get_current_user(token, db)
+        assert exc_info.value.status_code == 401
+
+    token = await auth_service.create_access_token(data={"sub": "ghost@example.com"})
+    async with session_maker() as db:
+        await block_user("ghost@example.com", db)
+    async with session_maker() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await auth_service.get_current_user(token, db)
+        assert exc_info.value.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_refresh_sessions_of_several_devices(engine, session_maker):
+    expires_at = datetime.utcnow() + timedelta(days=7)
+    async with session_maker() as db:
+        phone = await create_refresh_session(1, "phone token", "Phone", expires_at, db)
+        laptop = await create_refresh_session(1, "laptop token", "Laptop", expires_at, db)
+        assert phone.token_hash == hash_token("phone token") != "phone token"
+
+    statements = count_statements(engine)
+    async with session_maker() as db:
+        session = await get_refresh_session("phone token", db)
+        assert (session.id, session.device, session.user.email) == (phone.id, "Phone", "ghost@example.com")
+        assert len(statements) == 1
+        assert await get_refresh_session("unknown token", db) is None
+
+        assert await rotate_refresh_session(session, "new phone token", expires_at, db)
+        assert await get_refresh_session("phone token", db) is None
+        assert (await get_refresh_session("new phone token", db)).id == phone.id
+        assert (await get_refresh_session("laptop token", db)).id == laptop.id
+
+        await delete_refresh_session(laptop.id, 2, db)
+        assert await get_refresh_session("laptop token", db) is not None
+        await delete_refresh_session(laptop.id, 1, db)
+        assert await get_refresh_session("laptop token", db) is None
+
+
+@pytest.mark.asyncio
+async def test_only_one_of_two_racing_rotations_wins(session_maker):
+    expires_at = datetime.utcnow() + timedelta(days=7)
+    async with session_maker() as db:
+        await create_refresh_session(1, "token", None, expires_at, db)
+    async with session_maker() as first, session_maker() as second:
+        first_session = await get_refresh_session("token", first)
+        second_session = await get_refresh_session("token", second)
+        assert await rotate_refresh_session(first_session, "first token", expires_at, first)
+        assert not await rotate_refresh_session(second_session, "second token", expires_at, second)
+    async with session_maker() as db:
+        assert await get_refresh_session("first token", db) is not None
+        assert await delete_user_refresh_sessions("ghost@example.com", db) == 1
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_refresh_sessions_in_batches(engine, session_maker):
+    async with session_maker() as db:
+        expired = datetime.utcnow() - timedelta(minutes=1)
+        db.add_all([RefreshToken(token_hash=hash_token(f"old {number}"), user_id=1, expires_at=expired)
+                    for number in range(5)])
+        await create_refresh_session(1, "token", None, datetime.utcnow() + timedelta(days=7), db)
+
+    statements = count_statements(engine)
+    async with session_maker() as db:
+        assert await get_refresh_session("old 0", db) is None
+        statements.clear()
+        assert await delete_expired_refresh_sessions(db, batch_size=2) == 5
+        assert len([statement for statement in statements if statement.startswith("DELETE")]) == 3
+        assert (await db.scalars(select(RefreshToken.token_hash))).all() == [hash_token("token")]
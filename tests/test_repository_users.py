@@ -0,0 +1,73 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+import pytest
+import pytest_asyncio
+
+from src.database.models import Base, User
+from src.repository.access import block_user, update_user
+from src.repository.users import get_user_by_email, get_user_principal, update_password, update_profile, user_cache, UserPrincipal
+from src.schemas import Role, UpdateUser
+
+DATABASE_URL = "sqlite+aiosqlite://"
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session_maker(engine):
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        db.add(User(username="ghost", email="ghost@example.com", password="secret", bio="old", confirmed=True))
+        await db.commit()
+    return SessionLocal
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.mark.asyncio
+async def test_get_user_principal_skips_the_query_of_known_users(engine, session_maker):
+    statements = count_statements(engine)
+    async with session_maker() as db:
+        principal = await get_user_principal("ghost@example.com", db)
+        assert len(statements) == 1
+        assert await get_user_principal("nobody@example.com", db) is None
+
+    statements.clear()
+    async with session_maker() as db:
+        assert await get_user_principal("ghost@example.com", db) == principal
+        assert statements == []
+        assert principal == UserPrincipal(principal.id, "ghost@example.com", Role.user, True, True)
+        # Only the principal is cached, no password hash or profile data
+        assert user_cache.get("ghost@example.com") == principal
+        assert not hasattr(principal, "password")
+
+
+@pytest.mark.asyncio
+async def test_user_changes_invalidate_the_cache(session_maker):
+    async with session_maker() as db:
+        await get_user_principal("ghost@example.com", db)
+        await block_user("ghost@example.com", db)
+    async with session_maker() as db:
+        assert (await get_user_principal("ghost@example.com", db)).access is False
+        await update_user("ghost@example.com", Role.moderator, db)
+    async with session_maker() as db:
+        assert (await get_user_principal("ghost@example.com", db)).roles == Role.moderator
+        user = await get_user_by_email("ghost@example.com", db)
+        await update_profile(UpdateUser(bio="new", location="sea"), user, db)
+        assert user_cache.get("ghost@example.com") is None
+        await update_password(user, "rehashed", db)
+    async with session_maker() as db:
+        user = await get_user_by_email("ghost@example.com", db)
+        assert (user.bio, user.location, user.password) == ("new", "sea", "rehashed")
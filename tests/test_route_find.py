@@ -0,0 +1,23 @@
+import pytest
+
+from src.database.models import User
+from src.services.auth import auth_service
+
+
+@pytest.fixture
+def signed_in(client):
+    client.app.dependency_overrides[auth_service.get_current_user] = lambda: User(id=1, email="ghost@example.com")
+    yield client
+    del client.app.dependency_overrides[auth_service.get_current_user]
+
+
+@pytest.mark.parametrize("path", ["/api/find/find/tag?tag=sea", "/api/find/tags?all=sea"])
+def test_tag_searches_reject_relevance_sort(signed_in, path):
+    response = signed_in.get(f"{path}&sort_by=relevance")
+    assert response.status_code == 422, response.text
+    assert signed_in.get(f"{path}&sort_by=rating").status_code == 200
+
+
+def test_key_words_search_sorts_by_relevance(signed_in):
+    response = signed_in.get("/api/find/find/words?words=sea&sort_by=relevance")
+    assert response.status_code == 200, response.text
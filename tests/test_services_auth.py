@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from jose import JWTError, jwt
+import pytest
+
+from src.services import auth
+from src.services.auth import auth_service, password_context, token_cache
+from src.services.metrics import metrics
+
+
+@pytest.fixture
+def fast_context(monkeypatch):
+    monkeypatch.setattr(auth_service, "pwd_context", password_context(5))
+
+
+@pytest.mark.asyncio
+async def test_password_hashing_runs_on_the_password_pool(fast_context):
+    metrics.reset()
+    password_hash = await auth_service.get_password_hash("secret")
+    assert await auth_service.verify_password("secret", password_hash)
+    assert not await auth_service.verify_password("wrong", password_hash)
+    assert metrics.snapshot()["timings"]["password_executor_run_seconds"]["count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_password_hashing_does_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(auth_service, "pwd_context", password_context(10))
+    password_hash = await auth_service.get_password_hash("secret")
+    ticks = []
+
+    async def heartbeat():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    beating = asyncio.ensure_future(heartbeat())
+    await asyncio.gather(*(auth_service.verify_password("secret", password_hash) for _ in range(4)))
+    beating.cancel()
+    assert len(ticks) > 2
+
+
+@pytest.mark.asyncio
+async def test_verify_and_update_rehashes_hashes_of_another_work_factor(fast_context):
+    current = await auth_service.get_password_hash("secret")
+    assert await auth_service.verify_and_update("secret", current) == (True, None)
+
+    verified, new_hash = await auth_service.verify_and_update("secret", password_context(4).hash("secret"))
+    assert verified
+    assert new_hash.startswith("$2b$05$")
+    assert await auth_service.verify_password("secret", new_hash)
+
+    assert await auth_service.verify_and_update("wrong", password_context(4).hash("secret")) == (False, None)
+
+
+def count_decodes(monkeypatch):
+    decodes = []
+    decode = jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: decodes.append(args[0]) or decode(*args, **kwargs))
+    return decodes
+
+
+@pytest.mark.asyncio
+async def test_decode_token_verifies_a_token_once_until_it_expires(monkeypatch):
+    decodes = count_decodes(monkeypatch)
+    token = await auth_service.create_access_token(data={"sub": "ghost@example.com"}, expires_delta=60)
+    hits = token_cache.hits
+
+    for _ in range(3):
+        assert auth_service.decode_token(token)["sub"] == "ghost@example.com"
+    assert decodes == [token]
+    assert token_cache.hits - hits == 2
+    assert 55 < token_cache._entries[token][1] - time.monotonic() <= 60
+
+
+@pytest.mark.asyncio
+async def test_decode_token_never_accepts_an_expired_token():
+    token = await auth_service.create_access_token(data={"sub": "ghost@example.com"}, expires_delta=-10)
+    with pytest.raises(JWTError):
+        auth_service.decode_token(token)
+    assert len(token_cache) == 0
+
+    # An entry the cache still holds is checked against the exp claim of the token
+    token_cache.set(token, jwt.get_unverified_claims(token), ttl=60)
+    with pytest.raises(JWTError):
+        auth_service.decode_token(token)
+    assert len(token_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_decode_token_does_not_cache_invalid_tokens(monkeypatch):
+    token = await auth_service.create_access_token(data={"sub": "ghost@example.com"})
+    forged = jwt.encode(jwt.get_unverified_claims(token), "another secret", algorithm=auth_service.ALGORITHM)
+    decodes = count_decodes(monkeypatch)
+    for _ in range(2):
+        with pytest.raises(JWTError):
+            auth_service.decode_token(forged)
+    assert len(decodes) == 2
+    assert len(token_cache) == 0
@@ -0,0 +1,27 @@
+from src.services.bloom import BloomFilter
+
+
+def test_bloom_filter_holds_every_added_item():
+    bloom = BloomFilter(1000, 0.01)
+    items = [f"token-{number}" for number in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    assert len(bloom) == 1000
+
+
+def test_bloom_filter_false_positive_rate_at_capacity():
+    bloom = BloomFilter(1000, 0.01)
+    for number in range(1000):
+        bloom.add(f"token-{number}")
+    false_positives = sum(f"other-{number}" in bloom for number in range(10000))
+    assert false_positives < 300
+    assert 0.3 < bloom.fill_ratio() < 0.7
+
+
+def test_bloom_filter_clear():
+    bloom = BloomFilter(100, 0.01)
+    bloom.add("token")
+    bloom.clear()
+    assert "token" not in bloom
+    assert (len(bloom), bloom.fill_ratio()) == (0, 0.0)
@@ -0,0 +1,40 @@
+import time
+
+from src.services.cache import LRUCache
+from src.services.invalidation import LocalInvalidationBus
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "evictions": 1, "hit_rate": 0.75}
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=0)
+    cache.set("long", 2)
+    time.sleep(0.001)
+
+    assert cache.get("short", "expired") == "expired"
+    assert cache.get("long") == 2
+    assert len(cache) == 1
+
+
+def test_invalidation_bus_delivers_to_subscribers():
+    bus = LocalInvalidationBus()
+    cache = LRUCache(maxsize=10)
+    cache.set("sun", 1)
+    cache.set("sea", 2)
+    bus.subscribe("tags", lambda name: cache.pop(name) if name else cache.clear())
+
+    bus.publish("tags", "sun")
+    assert (cache.get("sun"), cache.get("sea")) == (None, 2)
+    bus.publish("tags")
+    assert len(cache) == 0
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+from fastapi import HTTPException
+import pytest
+
+from src.services.executors import BoundedExecutor
+from src.services.metrics import metrics
+
+
+@pytest.fixture
+def executor():
+    metrics.reset()
+    executor = BoundedExecutor("test", max_workers=1, max_queue=1, queue_timeout=0.05)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_run_returns_result_off_the_event_loop(executor):
+    loop_thread = threading.get_ident()
+    result, thread = await executor.run(lambda value: (value * 2, threading.get_ident()), 21)
+    assert result == 42
+    assert thread != loop_thread
+    assert metrics.snapshot()["timings"]["test_executor_run_seconds"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_rejects_calls_over_the_queue_limit(executor):
+    release = threading.Event()
+    running = asyncio.ensure_future(executor.run(release.wait))
+    queued = asyncio.ensure_future(executor.run(release.wait))
+    await asyncio.sleep(0.01)
+    assert metrics.snapshot()["gauges"]["test_executor_queue_depth"] == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        await executor.run(release.wait)
+    assert exc_info.value.status_code == 503
+    assert metrics.snapshot()["counters"]["test_executor_rejected_total"] == 1
+
+    release.set()
+    await asyncio.gather(running, queued)
+    gauges = metrics.snapshot()["gauges"]
+    assert (gauges["test_executor_queue_depth"], gauges["test_executor_running"]) == (0, 0)
@@ -0,0 +1,132 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+
+from src.database.models import Base, Image, Tag, User
+from src.repository import find, images as repository_images, ratings as repository_ratings
+from src.schemas import ImageUpdateModel, RatingModel, Role, SortField, SearchMode
+from src.services.search_cache import SearchCache, search_cache
+
+
+def test_search_cache_keeps_ids_within_budget():
+    cache = SearchCache(max_ids=5)
+    cache.set(("tag", "sea"), [1, 2, 3], None, cache.generation, tags=["sea"])
+    cache.set(("tag", "sun"), [4, 5], "next", cache.generation, tags=["sun"])
+    assert cache.get(("tag", "sea")).ids == [1, 2, 3]
+
+    cache.set(("tag", "city"), [6], None, cache.generation, tags=["city"])
+    assert cache.get(("tag", "sun")) is None
+    assert cache.get(("tag", "sea")) is not None
+    assert cache.stats()["ids"] == 4
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hit_rate"] == pytest.approx(2 / 3)
+
+    cache.set(("tag", "huge"), list(range(10)), None, cache.generation)
+    assert cache.get(("tag", "huge")) is None
+
+
+def test_search_cache_invalidates_selectively():
+    cache = SearchCache(max_ids=100)
+    cache.set(("tag", "sea"), [1, 2], None, cache.generation, tags=["sea"])
+    cache.set(("tag", "sun", "rating"), [3], None, cache.generation, tags=["sun"], by_rating=True)
+    cache.set(("words", "beach"), [2], None, cache.generation, words="beach")
+    cache.set(("words", "sunny beach"), [], None, cache.generation, words="sunny beach", fulltext=True)
+
+    assert cache.invalidate_image(9, ["city"], "A city at night") == 0
+    assert cache.invalidate_image(9, ["sun"], "A city at night", rating_only=True) == 1
+    assert cache.get(("tag", "sun", "rating")) is None
+
+    assert cache.invalidate_image(9, ["city"], "Sunny hills") == 1
+    assert cache.get(("words", "sunny beach")) is None
+    assert cache.invalidate_image(2) == 2
+    assert (cache.get(("tag", "sea")), cache.get(("words", "beach"))) == (None, None)
+
+    cache.set(("tag", "sea"), [1], None, cache.generation, tags=["sea"])
+    assert cache.invalidate_tags(["sea", "sky"]) == 1
+    assert len(cache) == 0
+
+
+def test_search_cache_skips_results_older_than_a_write():
+    cache = SearchCache(max_ids=100)
+    generation = cache.generation
+    cache.invalidate_image(1, ["sea"])
+    cache.set(("tag", "sea"), [1], None, generation, tags=["sea"])
+    assert len(cache) == 0
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with SessionLocal() as db:
+        yield db
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_searches_are_cached_until_a_write_touches_them(db: AsyncSession):
+    owner = User(username="owner", email="owner@example.com", password="secret", roles=Role.admin)
+    critic = User(username="critic", email="critic@example.com", password="secret")
+    db.add_all([owner, critic])
+    await db.commit()
+    sea_image, _ = await repository_images.add_image(db, ImageUpdateModel(description="Calm sea"), ["sea"],
+                                                     "url1", "one", owner)
+    await repository_images.add_image(db, ImageUpdateModel(description="Sunny city"), ["city"], "url2", "two", owner)
+
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.rating)
+    assert [image.id for image, _ in page] == [sea_image.id]
+    await find.get_photo_by_key_words("sunny", db, SortField.date)
+    hits = search_cache.hits
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.rating)
+    assert [(image.id, rating) for image, rating in page] == [(sea_image.id, 0)]
+    await find.get_photo_by_key_words("SUNNY", db, SortField.date)
+    assert search_cache.hits == hits + 2
+
+    await find.get_photo_by_tag("city", db, SortField.date)
+    sunny_sea, _ = await repository_images.add_image(db, ImageUpdateModel(description="Sunny sea"), ["sea"],
+                                                     "url3", "three", owner)
+    hits = search_cache.hits
+    page, _ = await find.get_photo_by_tag("city", db, SortField.date)
+    assert len(page) == 1
+    assert search_cache.hits == hits + 1
+    page, _ = await find.get_photo_by_key_words("sunny", db, SortField.date)
+    assert len(page) == 2
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.rating)
+    assert len(page) == 2
+
+    await repository_ratings.create_rating(sunny_sea.id, RatingModel(five_stars=True), critic, db)
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.rating)
+    assert [(image.id, rating) for image, rating in page] == [(sunny_sea.id, 5.0), (sea_image.id, 0)]
+
+    await repository_images.update_image(db, sunny_sea.id, ImageUpdateModel(description="Grey sea"), owner)
+    page, _ = await find.get_photo_by_key_words("sunny", db, SortField.date, SearchMode.fulltext)
+    assert [image.description for image in page] == ["Sunny city"]
+
+    await repository_images.delete_image(db, sea_image.id, owner)
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.rating)
+    assert [image.id for image, _ in page] == [sunny_sea.id]
+
+
+@pytest.mark.asyncio
+async def test_pages_read_from_a_replica_are_not_cached(db: AsyncSession):
+    owner = User(username="owner", email="owner@example.com", password="secret", roles=Role.admin)
+    db.add(owner)
+    await db.commit()
+    await repository_images.add_image(db, ImageUpdateModel(description="Calm sea"), ["sea"], "url1", "one", owner)
+    await find.get_photo_by_tag("sea", db, SortField.date)
+
+    # The write invalidates the page, a replica may not have it yet so its page must not refill the cache
+    await repository_images.add_image(db, ImageUpdateModel(description="Rough sea"), ["sea"], "url2", "two", owner)
+    async with AsyncSession(bind=db.bind, info={"replica": True}) as replica:
+        page, _ = await find.get_photo_by_tag("sea", replica, SortField.date)
+        assert len(page) == 2
+    assert len(search_cache) == 0
+
+    hits = search_cache.hits
+    page, _ = await find.get_photo_by_tag("sea", db, SortField.date)
+    assert [image.description for image in page] == ["Calm sea", "Rough sea"]
+    assert search_cache.hits == hits
+    await find.get_photo_by_tag("sea", db, SortField.date)
+    assert search_cache.hits == hits + 1
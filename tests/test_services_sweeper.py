@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from src.services.metrics import metrics
+from src.services.sweeper import Sweeper
+
+
+@pytest.mark.asyncio
+async def test_sweeper_runs_the_handler_every_interval():
+    metrics.reset()
+    sweeps = []
+
+    async def handler():
+        sweeps.append(len(sweeps))
+        return 2
+
+    sweeper = Sweeper("test", 0.01, handler)
+    sweeper.start()
+    await asyncio.sleep(0.05)
+    await sweeper.stop()
+    assert len(sweeps) >= 2
+    assert metrics.snapshot()["counters"]["test_swept_rows_total"] == 2 * len(sweeps)
+
+
+@pytest.mark.asyncio
+async def test_failed_sweep_is_counted():
+    metrics.reset()
+
+    async def handler():
+        raise RuntimeError("database is down")
+
+    sweeper = Sweeper("test", 60, handler)
+    assert await sweeper.sweep() == 0
+    assert metrics.snapshot()["counters"]["test_sweep_failures_total"] == 1
+    assert sweeper.last_error == "RuntimeError('database is down')"
@@ -0,0 +1,106 @@
+import random
+import string
+import time
+
+import pytest
+
+from src.services import tag_suggest
+from src.services.tag_suggest import TagSuggestIndex
+
+
+def make_index(rows):
+    index = TagSuggestIndex(ttl=60)
+    index.load(rows)
+    return index
+
+
+def names(suggestions):
+    return [suggestion["name"] for suggestion in suggestions]
+
+
+def test_suggest_ranks_prefix_matches_by_usage():
+    index = make_index([(1, "sun", 3), (2, "sunset", 7), (3, "sea", 9), (4, "summer", 3), (5, "sund", 0)])
+
+    assert names(index.suggest("su")) == ["sunset", "summer", "sun", "sund"]
+    assert names(index.suggest("sun", limit=2)) == ["sunset", "sun"]
+    assert index.suggest("x") == []
+
+
+def test_incremental_updates_refresh_memoized_prefixes():
+    index = make_index([(1, "sun", 3), (2, "sunset", 7)])
+    assert names(index.suggest("sun")) == ["sunset", "sun"]
+
+    index.use(["sun"], 5)
+    assert names(index.suggest("sun")) == ["sun", "sunset"]
+
+    index.add(3, "sunny", 100)
+    index.remove("sunset")
+    assert names(index.suggest("sun")) == ["sunny", "sun"]
+
+    index.rename("sunny", "beach")
+    assert names(index.suggest("sun")) == ["sun"]
+    assert index.suggest("b") == [{"id": 3, "name": "beach", "usage_count": 100}]
+
+
+def test_suggest_is_fast_on_a_large_vocabulary():
+    generator = random.Random(1)
+    rows = {"".join(generator.choices(string.ascii_lowercase, k=generator.randint(3, 12))) for _ in range(100_000)}
+    index = make_index([(tag_id, name, generator.randint(0, 1000)) for tag_id, name in enumerate(rows)])
+    prefixes = ["".join(generator.choices(string.ascii_lowercase, k=3)) for _ in range(1000)]
+
+    started = time.perf_counter()
+    for prefix in prefixes:
+        index.suggest(prefix)
+    assert (time.perf_counter() - started) / len(prefixes) < 0.001
+
+
+class FakeSession:
+
+    def __init__(self, rows, replica=False, during_query=None):
+        self.rows = rows
+        self.info = {"replica": replica}
+        self.during_query = during_query
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, query):
+        assert not self.info["replica"], "the index must be loaded from the primary"
+        if self.during_query:
+            self.during_query()
+        return self
+
+    def all(self):
+        return self.rows
+
+
+@pytest.mark.asyncio
+async def test_changes_made_during_a_reload_are_replayed():
+    index = TagSuggestIndex(ttl=60)
+
+    def commit_changes():
+        index.add(3, "sunny")
+        index.use(["sunny", "sun"])
+        index.rename("sunset", "dusk")
+
+    await index.ensure_loaded(FakeSession([(1, "sun", 3), (2, "sunset", 7)], during_query=commit_changes))
+    assert names(index.suggest("sun")) == ["sun", "sunny"]
+    assert index.suggest("sun")[0]["usage_count"] == 4
+    assert names(index.suggest("d")) == ["dusk"]
+
+    index.use(["sunny"], 5)
+    assert names(index.suggest("sun")) == ["sunny", "sun"]
+
+
+@pytest.mark.asyncio
+async def test_index_is_loaded_from_the_primary(monkeypatch):
+    monkeypatch.setattr(tag_suggest, "SessionLocal", FakeSession([(1, "sun", 3)]))
+    index = TagSuggestIndex(ttl=60)
+    await index.ensure_loaded(FakeSession([], replica=True))
+    assert names(index.suggest("s")) == ["sun"]
@@ -0,0 +1,90 @@
+import asyncio
+import io
+
+from fastapi import HTTPException
+import pytest
+
+from src.schemas import ImageAddModel
+from src.services.metrics import metrics
+from src.services.upload_jobs import UploadJobs, UploadJob
+
+
+def make_job(user_id=1, content=b"image"):
+    return UploadJob(user_id, ImageAddModel(description="Queued image", tags=[]), [], io.BytesIO(content), "photo.png")
+
+
+async def wait_for(job):
+    for _ in range(100):
+        if job.finished_at is not None:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job.id} is still {job.status}")
+
+
+@pytest.mark.asyncio
+async def test_job_runs_in_the_background():
+    release = asyncio.Event()
+
+    async def handler(job):
+        await release.wait()
+        assert job.file.read() == b"image"
+        job.image_id = 7
+
+    jobs = UploadJobs(workers=1, queue_size=2, ttl=60, handler=handler)
+    job = jobs.submit(make_job())
+    await asyncio.sleep(0)
+    assert jobs.get(job.id, user_id=1).status == "processing"
+    assert jobs.get(job.id, user_id=2) is None
+
+    release.set()
+    await wait_for(job)
+    assert (job.status, job.image_id) == ("done", 7)
+    assert job.file.closed
+    await jobs.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_job_reports_the_reason():
+    async def handler(job):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    jobs = UploadJobs(workers=1, queue_size=2, ttl=60, handler=handler)
+    job = await wait_for(jobs.submit(make_job()))
+    assert (job.status, job.detail) == ("failed", "User not found")
+    await jobs.stop()
+
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_is_recorded_and_counted():
+    async def handler(job):
+        raise RuntimeError("Cloudinary is down")
+
+    errors = metrics.snapshot()["counters"].get("upload_jobs_errors_total", 0)
+    jobs = UploadJobs(workers=1, queue_size=2, ttl=60, handler=handler)
+    job = await wait_for(jobs.submit(make_job()))
+    assert (job.status, job.detail) == ("failed", "The upload failed")
+    assert job.error == "RuntimeError('Cloudinary is down')"
+    assert metrics.snapshot()["counters"]["upload_jobs_errors_total"] == errors + 1
+    await jobs.stop()
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_jobs():
+    release = asyncio.Event()
+
+    async def handler(job):
+        await release.wait()
+
+    jobs = UploadJobs(workers=1, queue_size=1, ttl=60, handler=handler)
+    jobs.submit(make_job())
+    await asyncio.sleep(0)
+    queued = jobs.submit(make_job())
+
+    rejected = make_job()
+    with pytest.raises(HTTPException) as exc_info:
+        jobs.submit(rejected)
+    assert exc_info.value.status_code == 503
+    assert rejected.file.closed
+
+    await jobs.stop()
+    assert (queued.status, queued.file.closed) == ("failed", True)
@@ -4,7 +4,6 @@ from sqlalchemy.orm import Session
 from src.repository.users import (
     get_user_by_email,
     create_user,
-    update_token,
     confirmed_email,
     update_avatar,
     update_profile,
@@ -35,12 +34,6 @@ class TestUserModule(unittest.TestCase):
         new_user = create_user(user_data, self.db_session)
         self.assertEqual(new_user.email, "new_user@example.com")
 
-    def test_update_token(self):
-
-        user = User(id=1, email="test@example.com", avatar=None)
-        update_token(user, "new_refresh_token", self.db_session)
-        self.assertEqual(user.refresh_token, "new_refresh_token")
-
     def test_confirmed_email(self):
 
         self.db_session.query().filter().first.return_value = User(